@@ -1,19 +1,74 @@
-import pygame
-import sounddevice as sd
+import time
+STARTUP_T0 = time.perf_counter()  # Reference point for the --benchmark-startup timeline
 import numpy as np
-import colorsys
-import tkinter as tk
-from tkinter import ttk
 import logging
 import sys
-import time
-from queue import Queue
+import os
+import json
+import importlib
+import struct
+import socket
+import select
+import threading
+import base64
+import hashlib
+import itertools
+import io
+import wave
+import argparse
+import signal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue, Empty
 import math
 from collections import deque
-from lifxlan import LifxLAN, Light, WorkflowException
 
 logging.basicConfig(level=logging.INFO)
 
+# -----------------------------
+# Lazy Subsystem Imports & Startup Timing
+# -----------------------------
+# pygame, sounddevice and lifxlan are imported on first use and Tk only when the device picker
+# is shown, so replays and light-only runs never pay for SDL, PortAudio or the LIFX stack.
+pygame = None
+sd = None
+lifxlan = None
+startup_marks = {}  # Startup milestone -> seconds since STARTUP_T0 (first occurrence only)
+
+
+def mark_startup(label):
+    if label not in startup_marks:
+        startup_marks[label] = time.perf_counter() - STARTUP_T0
+
+
+def import_subsystem(name):
+    module = importlib.import_module(name)
+    mark_startup(f"import {name}")
+    return module
+
+
+def ensure_pygame():
+    global pygame
+    if pygame is None:
+        pygame = import_subsystem("pygame")
+    return pygame
+
+
+def ensure_sounddevice():
+    global sd
+    if sd is None:
+        sd = import_subsystem("sounddevice")
+    return sd
+
+
+def ensure_lifxlan():
+    global lifxlan
+    if lifxlan is None:
+        lifxlan = import_subsystem("lifxlan")
+    return lifxlan
+
+
+mark_startup("core imports")
+
 
 # -----------------------------
 #Version 0.05b
@@ -24,23 +79,46 @@ logging.basicConfig(level=logging.INFO)
 # -----------------------------
 LIFX_IP = ""  # IP address of your LIFX light
 LIFX_MAC = ""  # MAC address of your LIFX light
-lifx = LifxLAN()
+LIFX_ENABLED = True  # Set False for visuals only; lifxlan is then never imported
+LIFX_DISCOVER_ON_START = True  # Discover bulbs once when none are configured or saved
+lifx = None  # LifxLAN discovery client, created only when discovery runs
 bulb = None
+lifx_lights = []  # Main light group; bulb is its first light
 #bulb = Light(LIFX_MAC, LIFX_IP)  # Use the specific IP and MAC to control the light
 
+# Input channels mapped to their own light groups, e.g.
+# {0: [("d0:73:d5:00:00:01", "192.168.1.20")], 1: [("d0:73:d5:00:00:02", "192.168.1.21")]}
+CHANNEL_LIGHT_GROUPS = {}
+channel_light_groups = {}  # Channel -> [Light], built by connect_lifx_lights()
+
+# Multizone strips/beams and tile chains that show the spectrum across their zones, e.g.
+# [("multizone", "d0:73:d5:00:00:03", "192.168.1.30", 16), ("tile", "d0:73:d5:00:00:04", "192.168.1.31", 5)]
+# The last value is the zone count for a multizone light and the number of tiles for a chain.
+LIFX_ZONE_LIGHTS = []
+zone_outputs = []  # ZoneOutput per entry, built by connect_lifx_lights()
+
+# Further input devices captured alongside the main one, each with its own stream and analysis,
+# driving its own light group and screen region (x, y, width, height as fractions of the window), e.g.
+# [("USB Audio CODEC", [("d0:73:d5:00:00:05", "192.168.1.40")], (0.5, 0.0, 0.5, 1.0))]
+# The device is an index or a name as accepted by sounddevice; lights or region may be empty/None.
+EXTRA_INPUTS = []
+extra_inputs = []  # AudioInput per entry, started by start_extra_inputs()
+
 # -----------------------------
 # CONSTANTS for Audio Processing
 # -----------------------------
 RATE = 44100
 BUFFER = 128
+TUNED_BLOCK_SECONDS = 128 / 44100  # Block period the per-block smoothing and onset constants are counted in
 NOISE_FLOOR = -100
 
 TARGET_FREQS = [35, 40, 45, 50]
-PRECOMPUTED_RFFT_FREQS = np.fft.rfftfreq(BUFFER, 1.0 / RATE)
 
-SMOOTHING_WINDOW = 10
-smoothing_buffer = deque(maxlen=SMOOTHING_WINDOW)
+INPUT_CHANNELS = 2  # Channels captured from the input device (clamped to what the device offers)
+channel_glow_values = np.zeros(1)  # Per-channel glow (0 to 1)
+channel_db_smoothed = np.full(1, float(NOISE_FLOOR))  # Per-channel smoothed peak dB
 
+current_gain_db = NOISE_FLOOR  # Peak-held dB of the channel mix
 current_gain_db_smoothed = NOISE_FLOOR
 glow_value = 0.0  # Visual brightness (0 to 1)
 hue_value = 1.0 / 3.0  # Starting hue (green)
@@ -49,10 +127,11 @@ hue_value = 1.0 / 3.0  # Starting hue (green)
 # -----------------------------
 # Modes
 # -----------------------------
-available_modes = ["polygon", "both", "db meters", "gravity", "waveform", "radial"]
+available_modes = ["polygon", "both", "db meters", "gravity", "waveform", "radial", "spectrogram"]
 
 current_mode_index = 0
 visualization_mode = available_modes[current_mode_index]
+active_mode = None  # VisualizationMode instance drawing right now (see the mode registry)
 slider_active = False
 
 WINDOW_WIDTH = 900
@@ -83,17 +162,10 @@ manual_hue_value = 0.0  # 0 means auto-cycle; else fixed hue (0.0 to 1.0)
 cycle_rate = 0.0003  # Hue cycle rate when auto-cycling
 hue = 0
 
-# Global for storing the latest audio data for waveform:
-latest_audio_data = None
-
 audio_queue = Queue(maxsize=16)
-last_update_time = time.time()
-last_packet_time = time.time()
-UPDATE_INTERVAL = 1.0 / 240.0
-PACKET_SEND_INTERVAL = 0.009
+PACKET_SEND_INTERVAL = 0.009  # Cadence of the LIFX output scheduler (seconds between ticks)
 
 # Cube & Polygon Constants
-cube_vertices = []  # To be initialized later
 DEFAULT_SCALE_FACTOR = 100
 MAX_SCALE_FACTOR = 6.0
 ALPHA_CONSTANT = 157.50
@@ -104,7 +176,6 @@ ESCAPE_MODE = False
 SHAKE_INTENSITY = 5
 
 #Waveform Rending
-waveform_buffers = []  # To be initialized
 
 # Base dimensions for scaling menus
 BASE_WIDTH = 900
@@ -112,7 +183,6 @@ BASE_HEIGHT = 600
 
 OFFSCREEN_WIDTH = 900
 OFFSCREEN_HEIGHT = 600
-pygame_surface = None
 
 # -----------------------------
 # Constants for Radial dB Meters
@@ -140,6 +210,25 @@ TRIANGLE_SIZE = 15  # Size of triangles if used for decoration (not used here bu
 show_fps = True  # Initially, FPS is visible
 
 
+# -----------------------------
+# Input Region Overlay
+# -----------------------------
+# Outlines each extra input's screen region in its glow and fills a level bar along the bottom.
+def draw_input_regions():
+    for audio_input in extra_inputs:
+        audio_input.display_glow = audio_input.display_smoother.process(audio_input.glow)
+        if not audio_input.region:
+            continue
+        x, y, w, h = audio_input.region
+        rect = pygame.Rect(int(x * WINDOW_WIDTH), int(y * WINDOW_HEIGHT), int(w * WINDOW_WIDTH), int(h * WINDOW_HEIGHT))
+        color = rgb_color(hue_value, max(audio_input.display_glow, control_brightness_floor))
+        pygame.draw.rect(screen, color, rect, GLOW_WIDTH)
+        bar = pygame.Rect(rect.left, rect.bottom - METER_WIDTH // 4, int(rect.width * audio_input.display_glow), METER_WIDTH // 4)
+        pygame.draw.rect(screen, color, bar)
+        label = font.render(f"{audio_input.name}: {audio_input.gain_db:.0f} dB", True, color)
+        screen.blit(label, (rect.left + TEXT_PADDING, rect.top + TEXT_PADDING))
+
+
 # -----------------------------
 # FPS Drawing Function
 # -----------------------------
@@ -160,13 +249,186 @@ def draw_fps():
     return fps_rect  # Always return the area, even if FPS is not visible
 
 # -----------------------------
-# Helper Functions for Scaling and Offscreen Surface
+# Frame Profiler Overlay
+# -----------------------------
+PROFILER_SECTIONS = ["audio", "events", "draw", "hud", "flip"]
+PROFILER_HISTORY = 3600  # Frames kept for the overlay statistics and CSV export
+PROFILER_GRAPH_FRAMES = 240  # Frames shown in the frame-time graph
+PROFILER_FRAME_BUDGET = 1.0 / 60.0  # Frames above this are marked as worst frames
+PROFILER_TOGGLE_KEY = "f3"  # pygame key names, resolved once the window exists
+PROFILER_EXPORT_KEY = "f4"
+PROFILER_EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+PROFILER_SECTION_COLORS = [(80, 160, 255), (255, 200, 80), (120, 220, 120), (220, 120, 220), (255, 110, 110)]
+show_profiler = False
+
+
+class FrameProfiler:
+    def __init__(self, sections, history):
+        self.sections = sections
+        self.section_index = {name: i for i, name in enumerate(sections)}
+        # One row per frame: per-section seconds followed by the total frame time (incl. tick wait).
+        self.samples = np.zeros((history, len(sections) + 1))
+        self.frames = 0
+        self.current = np.zeros(len(sections))
+        self.frame_start = None
+        self.mark_time = 0.0
+
+    def begin_frame(self):
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            row = self.samples[self.frames % len(self.samples)]
+            row[:-1] = self.current
+            row[-1] = now - self.frame_start
+            self.frames += 1
+        self.current[:] = 0.0
+        self.frame_start = now
+        self.mark_time = now
+
+    # Attributes the time since the previous mark (or frame start) to `section`.
+    def mark(self, section):
+        now = time.perf_counter()
+        self.current[self.section_index[section]] += now - self.mark_time
+        self.mark_time = now
+
+    def recent(self, count=None):
+        count = min(self.frames, len(self.samples) if count is None else count)
+        idx = (self.frames - count + np.arange(count)) % len(self.samples)
+        return self.samples[idx]
+
+    def export_csv(self):
+        os.makedirs(PROFILER_EXPORT_DIR, exist_ok=True)
+        path = os.path.join(PROFILER_EXPORT_DIR, time.strftime("frame_profile_%Y%m%d_%H%M%S.csv"))
+        rows = self.recent()
+        first_frame = self.frames - len(rows)
+        with open(path, "w") as f:
+            f.write("frame," + ",".join(f"{s}_ms" for s in self.sections) + ",frame_ms\n")
+            for i, row in enumerate(rows):
+                f.write(f"{first_frame + i}," + ",".join(f"{v * 1000:.4f}" for v in row) + "\n")
+        logging.info(f"Frame profile exported to {path}")
+        return path
+
+
+frame_profiler = FrameProfiler(PROFILER_SECTIONS, PROFILER_HISTORY)
+
+
+def draw_profiler_overlay():
+    rows = frame_profiler.recent(PROFILER_GRAPH_FRAMES)
+    if len(rows) == 0:
+        return
+    hf = WINDOW_HEIGHT / BASE_HEIGHT
+    line_height = menu_font.get_linesize()
+    graph_w = PROFILER_GRAPH_FRAMES
+    graph_h = int(80 * hf)
+    panel_w = graph_w + 20
+    panel_h = line_height * (len(PROFILER_SECTIONS) + 3) + graph_h + 20
+    panel_x = WINDOW_WIDTH - panel_w - 10
+    panel_y = 10
+    panel = pygame.Surface((panel_w, panel_h), pygame.SRCALPHA)
+    panel.fill((0, 0, 0, 180))
+    screen.blit(panel, (panel_x, panel_y))
+
+    totals = rows[:, -1]
+    worst = int(np.argmax(totals))
+    worst_section = PROFILER_SECTIONS[int(np.argmax(rows[worst, :-1]))]
+    fps = 1.0 / np.mean(totals) if np.mean(totals) > 0 else 0.0
+    lines = [(f"FPS {fps:5.0f}   frame avg {np.mean(totals) * 1000:5.2f} ms", MENU_FONT_COLOR)]
+    for i, section in enumerate(PROFILER_SECTIONS):
+        lines.append((f"{section:<7} avg {np.mean(rows[:, i]) * 1000:6.2f}  max {np.max(rows[:, i]) * 1000:6.2f} ms",
+                      PROFILER_SECTION_COLORS[i]))
+    lines.append((f"worst {totals[worst] * 1000:6.2f} ms ({worst_section})", (255, 110, 110)))
+    y = panel_y + 8
+    for text, color in lines:
+        screen.blit(menu_font.render(text, True, color), (panel_x + 10, y))
+        y += line_height
+
+    # Frame-time graph: stacked section bars per frame, budget line and worst-frame markers.
+    graph_x = panel_x + 10
+    graph_bottom = y + graph_h + 4
+    scale = graph_h / (2 * PROFILER_FRAME_BUDGET)
+    for x, row in enumerate(rows):
+        bottom = graph_bottom
+        for i, value in enumerate(row[:-1]):
+            height = min(int(value * scale), bottom - (graph_bottom - graph_h))
+            if height > 0:
+                pygame.draw.line(screen, PROFILER_SECTION_COLORS[i], (graph_x + x, bottom), (graph_x + x, bottom - height))
+                bottom -= height
+        if row[-1] > PROFILER_FRAME_BUDGET:
+            pygame.draw.line(screen, (255, 40, 40), (graph_x + x, graph_bottom - graph_h), (graph_x + x, graph_bottom - graph_h + 6))
+    budget_y = graph_bottom - int(PROFILER_FRAME_BUDGET * scale)
+    pygame.draw.line(screen, (200, 200, 200), (graph_x, budget_y), (graph_x + graph_w, budget_y))
+
+
 # -----------------------------
-def update_offscreen_surface(width, height):
-    global pygame_surface
-    pygame_surface = pygame.Surface((width, height))
+# Colour Lookup Tables
+# -----------------------------
+# Screen RGB and LIFX HSBK values are read from tables quantized over hue x brightness, so a
+# colour is one index lookup and arrays of colours (zones, bars, particles) convert with a
+# single numpy gather. Every colour in the visuals and on the lights is fully saturated.
+COLOR_HUE_STEPS = 1024  # Hue resolution of the tables (~0.35 degrees)
+COLOR_BRIGHTNESS_STEPS = 256  # RGB brightness levels (one per 8-bit value)
+HSBK_BRIGHTNESS_STEPS = 4096  # LIFX brightness levels
+LIFX_KELVIN = 3500
+
+
+# colorsys.hsv_to_rgb with saturation 1 over arrays; returns 0-1 floats with a trailing RGB axis.
+def hsv_to_rgb_array(hues, values):
+    hues = np.asarray(hues, dtype=np.float64) % 1.0
+    values = np.asarray(values, dtype=np.float64)
+    k = (np.array([5.0, 3.0, 1.0]) + hues[..., np.newaxis] * 6.0) % 6.0
+    return values[..., np.newaxis] * (1.0 - np.clip(np.minimum(k, 4.0 - k), 0.0, 1.0))
+
+
+COLOR_HUE_GRID = np.arange(COLOR_HUE_STEPS) / COLOR_HUE_STEPS
+RGB_LUT = np.round(hsv_to_rgb_array(COLOR_HUE_GRID[:, np.newaxis],
+                                    np.linspace(0.0, 1.0, COLOR_BRIGHTNESS_STEPS)[np.newaxis, :]) * 255).astype(np.uint8)
+HSBK_HUE_LUT = np.round(COLOR_HUE_GRID * 65535).astype(np.uint16)
+HSBK_BRIGHTNESS_LUT = np.round(np.linspace(0.0, 65535.0, HSBK_BRIGHTNESS_STEPS)).astype(np.uint16)
+
+
+def hue_index(hue):
+    return int(hue % 1.0 * COLOR_HUE_STEPS) % COLOR_HUE_STEPS
+
+
+def level_index(level, steps):
+    return min(max(int(level * (steps - 1) + 0.5), 0), steps - 1)
+
 
+def rgb_color(hue, brightness):
+    return tuple(RGB_LUT[hue_index(hue), level_index(brightness, COLOR_BRIGHTNESS_STEPS)].tolist())
 
+
+def hsbk_color(hue, brightness):
+    return [int(HSBK_HUE_LUT[hue_index(hue)]), 65535,
+            int(HSBK_BRIGHTNESS_LUT[level_index(brightness, HSBK_BRIGHTNESS_STEPS)]), LIFX_KELVIN]
+
+
+def hue_indices(hues):
+    return (np.asarray(hues) % 1.0 * COLOR_HUE_STEPS).astype(np.intp) % COLOR_HUE_STEPS
+
+
+def level_indices(levels, steps):
+    return np.clip(np.asarray(levels) * (steps - 1) + 0.5, 0, steps - 1).astype(np.intp)
+
+
+# (N, 3) uint8 screen colours for arrays of hues and brightness (broadcast against each other).
+def rgb_colors(hues, brightness):
+    return RGB_LUT[hue_indices(hues), level_indices(brightness, COLOR_BRIGHTNESS_STEPS)]
+
+
+# (N, 4) uint16 LIFX HSBK colours for arrays of hues and brightness.
+def hsbk_colors(hues, brightness):
+    hue_idx, level_idx = np.broadcast_arrays(hue_indices(hues), level_indices(brightness, HSBK_BRIGHTNESS_STEPS))
+    colors = np.empty(hue_idx.shape + (4,), dtype=np.uint16)
+    colors[..., 0] = HSBK_HUE_LUT[hue_idx]
+    colors[..., 1] = 65535
+    colors[..., 2] = HSBK_BRIGHTNESS_LUT[level_idx]
+    colors[..., 3] = LIFX_KELVIN
+    return colors
+
+
+# -----------------------------
+# Helper Functions for Scaling and Offscreen Surface
+# -----------------------------
 def update_meter_dimensions():
     global MARGIN, METER_WIDTH, TEXT_PADDING, GLOW_WIDTH
     width_factor = WINDOW_WIDTH / BASE_WIDTH
@@ -179,39 +441,1223 @@ def update_meter_dimensions():
 
 
 # -----------------------------
-# Dummy Smoothing Functions
+# Smoothing Filters (DSP Chain)
+# -----------------------------
+# Stateful filters for the analysis and display paths. process(x) advances one step, where x is a
+# scalar or one value per channel; process_batch(xs) advances len(xs) steps at once (steps along
+# axis 0) and returns every output. Backlogs of up to SEQUENTIAL_STEPS steps take the cheaper
+# process() path, so the vectorized _process_batch only runs where its setup pays off. State
+# starts over whenever the number of channels changes.
+def filter_output(state):
+    return state[()] if state.ndim == 0 else state.copy()
+
+
+# Converts a count of tuned blocks into blocks of block_size at rate, keeping its duration.
+def scaled_block_count(count, block_size, rate):
+    return max(1, int(round(count * TUNED_BLOCK_SECONDS * rate / block_size)))
+
+
+class StatefulFilter:
+    SEQUENTIAL_STEPS = 1
+
+    def __init__(self, initial=0.0):
+        self.initial = initial
+        self.state = None
+
+    def reset(self):
+        self.state = None
+
+    def _begin(self, x):
+        x = np.asarray(x, dtype=float)
+        if self.state is None or self.state.shape != x.shape:
+            self.state = np.full(x.shape, float(self.initial))
+        return x
+
+    def _begin_batch(self, xs):
+        xs = np.asarray(xs, dtype=float)
+        self._begin(xs[0])
+        return xs
+
+    def process_batch(self, xs):
+        if len(xs) == 1:
+            return np.asarray(self.process(xs[0]))[np.newaxis]
+        if len(xs) <= self.SEQUENTIAL_STEPS:
+            return np.array([self.process(x) for x in xs])
+        return self._process_batch(xs)
+
+    def _process_batch(self, xs):
+        return np.array([self.process(x) for x in xs])
+
+
+class OnePoleEMA(StatefulFilter):
+    SEQUENTIAL_STEPS = 8
+    BATCH_CHUNK = 64  # Steps solved together in closed form (keeps the decay powers well-scaled)
+
+    def __init__(self, factor, initial=0.0):
+        super().__init__(initial)
+        self.factor = factor
+
+    def process(self, x):
+        x = self._begin(x)
+        self.state += self.factor * (x - self.state)
+        return filter_output(self.state)
+
+    def _process_batch(self, xs):
+        # y[k] = keep^(k+1) * y[-1] + factor * sum_j keep^(k-j) * x[j], as one matrix product per chunk.
+        xs = self._begin_batch(xs)
+        keep = 1.0 - self.factor
+        out = np.empty_like(xs)
+        for start in range(0, len(xs), self.BATCH_CHUNK):
+            chunk = xs[start:start + self.BATCH_CHUNK]
+            steps = np.arange(len(chunk))
+            weights = np.tril(keep ** np.maximum(steps[:, None] - steps[None, :], 0))
+            carry = (keep ** (steps + 1)).reshape((-1,) + (1,) * self.state.ndim)
+            out[start:start + len(chunk)] = self.factor * np.tensordot(weights, chunk, axes=1) + carry * self.state
+            self.state = out[start + len(chunk) - 1].copy()
+        return out
+
+
+# Follows rises with the attack factor and falls with the release factor.
+class AttackRelease(StatefulFilter):
+    SEQUENTIAL_STEPS = 8
+    BATCH_CHUNK = 64  # Steps solved together (keeps the products of the decay factors well-scaled)
+
+    def __init__(self, attack, release, initial=0.0):
+        super().__init__(initial)
+        self.attack = attack
+        self.release = release
+
+    def process(self, x):
+        x = self._begin(x)
+        self.state += np.where(x > self.state, self.attack, self.release) * (x - self.state)
+        return filter_output(self.state)
+
+    def _process_batch(self, xs):
+        xs = self._begin_batch(xs)
+        out = np.empty_like(xs)
+        for start in range(0, len(xs), self.BATCH_CHUNK):
+            chunk = self._solve_chunk(xs[start:start + self.BATCH_CHUNK])
+            out[start:start + len(chunk)] = chunk
+            self.state = chunk[-1].copy()
+        return out
+
+    # Whether a step attacks depends on the output before it. Guess from the current state, solve
+    # the recurrence for those factors in closed form and repeat with the directions that path
+    # implies: each pass settles at least one more leading step, so this ends on the per-step path.
+    def _solve_chunk(self, xs):
+        rising = xs > self.state
+        while True:
+            factors = np.where(rising, self.attack, self.release)
+            # y[k] = keep[k] * y[k-1] + factor[k] * x[k] with keep = 1 - factor, so
+            # y[k] = P[k] * y[-1] + sum_j (P[k] / P[j]) * factor[j] * x[j], P = cumprod(keep).
+            decay = np.cumprod(1.0 - factors, axis=0)
+            weights = decay[:, np.newaxis] / decay[np.newaxis, :]
+            weights *= np.tril(np.ones((len(xs), len(xs)))).reshape(weights.shape[:2] + (1,) * self.state.ndim)
+            out = np.einsum("kj...,j...->k...", weights, factors * xs) + decay * self.state
+            before = np.concatenate((self.state[np.newaxis], out[:-1]))
+            settled = xs > before
+            if np.array_equal(settled, rising):
+                return out
+            rising = settled
+
+
+# Holds the highest value and lets it fall by `decay` per step, never below `floor`.
+class PeakHold(StatefulFilter):
+    def __init__(self, decay, floor):
+        super().__init__(floor)
+        self.decay = decay
+        self.floor = floor
+
+    def process(self, x):
+        x = self._begin(x)
+        self.state = np.maximum(np.maximum(x, self.state - self.decay), self.floor)
+        return filter_output(self.state)
+
+    def _process_batch(self, xs):
+        # y[k] = max(floor, y[-1] - (k+1)*decay, max_{j<=k} x[j] - (k-j)*decay)
+        xs = self._begin_batch(xs)
+        ramp = (np.arange(len(xs)) * self.decay).reshape((-1,) + (1,) * self.state.ndim)
+        held = np.maximum.accumulate(xs + ramp, axis=0) - ramp
+        out = np.maximum(np.maximum(held, self.state - ramp - self.decay), self.floor)
+        self.state = out[-1].copy()
+        return out
+
+
+# Sum of the last `window` steps kept as a running total, so each step is O(1). The total is
+# re-summed from the ring once per lap to keep rounding error from accumulating.
+class RunningSum(StatefulFilter):
+    SEQUENTIAL_STEPS = 4
+
+    def __init__(self, window):
+        super().__init__()
+        self.window = window
+
+    def _begin(self, x):
+        x = np.asarray(x, dtype=float)
+        if self.state is None or self.state.shape != x.shape:
+            self.state = np.zeros(x.shape)
+            self.ring = np.zeros((self.window,) + x.shape)
+            self.index = 0
+            self.count = 0
+        return x
+
+    def _result(self, total, count):
+        return total
+
+    def process(self, x):
+        x = self._begin(x)
+        self.state += x - self.ring[self.index]
+        self.ring[self.index] = x
+        self.index = (self.index + 1) % self.window
+        self.count = min(self.count + 1, self.window)
+        if self.index == 0:
+            self.state = self.ring.sum(axis=0)
+        return filter_output(self._result(self.state, self.count))
+
+    def _process_batch(self, xs):
+        xs = self._begin_batch(xs)
+        history = np.roll(self.ring, -self.index, axis=0)  # Oldest first; unfilled slots are zero
+        extended = np.concatenate([history, xs])
+        totals = np.cumsum(extended, axis=0)
+        totals = totals[self.window:] - totals[:len(xs)]
+        counts = np.minimum(self.count + np.arange(1, len(xs) + 1), self.window)
+        out = self._result(totals, counts.reshape((-1,) + (1,) * (xs.ndim - 1)))
+        self.ring = extended[-self.window:].copy()
+        self.index = 0
+        self.count = counts[-1]
+        self.state = self.ring.sum(axis=0)
+        return out
+
+
+class RunningMean(RunningSum):
+    def _result(self, total, count):
+        return total / count
+
+
+class FilterChain:
+    def __init__(self, *stages):
+        self.stages = stages
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    def process(self, x):
+        for stage in self.stages:
+            x = stage.process(x)
+        return x
+
+    def process_batch(self, xs):
+        for stage in self.stages:
+            xs = stage.process_batch(xs)
+        return xs
+
+
+# -----------------------------
+# Bass Front-End (Decimation & Target Frequency Detection)
 # -----------------------------
-def smooth_db_value(new_db, smoothing_factor=0.2):
-    global current_gain_db_smoothed
-    current_gain_db_smoothed = smoothing_factor * new_db + (1 - smoothing_factor) * current_gain_db_smoothed
-    return current_gain_db_smoothed
+# Everything the detector reacts to lies below ~200 Hz, so the input is decimated by 32 in two
+# polyphase FIR stages (44.1 kHz -> ~1.4 kHz) whose state carries across blocks. At the low rate
+# a 256-sample window spans ~186 ms and resolves ~5.4 Hz bins around TARGET_FREQS, which at full
+# rate would take an 8192-point FFT. Only the target bins are evaluated, as a small DFT.
+DECIMATION_STAGES = [(8, 63), (4, 47)]  # (factor, taps); aliases into 0-200 Hz stay below -80 dB
+BASS_WINDOW_SIZE = 256  # Samples at the decimated rate
+# Scales a sine's amplitude to the units of the former detector (the DC bin of a 128-sample
+# block, ~128 * 2/pi per unit amplitude), so BRIGHTNESS_GAIN and the AGC keep their calibration.
+BASS_LEVEL_SCALE = 81.5
+
+
+# Windowed-sinc low-pass; cutoff in cycles per input sample, unity gain at DC.
+def lowpass_taps(count, cutoff):
+    n = np.arange(count) - (count - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.blackman(count)
+    return (taps / taps.sum()).astype(np.float32)
+
+
+# One polyphase decimation stage: only every factor-th FIR output is computed, and the input
+# samples the next output still needs are kept for the following block.
+class DecimatingFIR:
+    def __init__(self, factor, taps, channels):
+        self.factor = factor
+        self.taps = lowpass_taps(taps, 0.4 / factor)
+        self.history = np.zeros((taps - 1, channels), dtype=np.float32)
+
+    def process(self, block):
+        samples = np.concatenate((self.history, block))
+        count = (len(samples) - len(self.taps)) // self.factor + 1
+        # Only every factor-th window is viewed: count x channels x taps.
+        step, channel_step = samples.strides
+        windows = np.lib.stride_tricks.as_strided(samples, (count, samples.shape[1], len(self.taps)),
+                                                  (step * self.factor, channel_step, step), writeable=False)
+        self.history = samples[count * self.factor:]
+        return windows @ self.taps
+
+
+class BassFrontEnd:
+    def __init__(self, rate, channels):
+        self.channels = channels
+        self.stages = [DecimatingFIR(factor, taps, channels) for factor, taps in DECIMATION_STAGES]
+        self.rate = rate / np.prod([factor for factor, _ in DECIMATION_STAGES])
+        self.samples = np.zeros((BASS_WINDOW_SIZE, channels), dtype=np.float32)
+        freqs = np.fft.rfftfreq(BASS_WINDOW_SIZE, 1.0 / self.rate)
+        bins = np.unique([np.argmin(np.abs(freqs - target)) for target in TARGET_FREQS])
+        window = np.hanning(BASS_WINDOW_SIZE)
+        # Hann-windowed DFT rows for just the target bins, scaled to amplitude.
+        n = np.arange(BASS_WINDOW_SIZE)
+        self.basis = (np.exp(-2j * np.pi * np.outer(bins, n) / BASS_WINDOW_SIZE) * window
+                      * (2.0 * BASS_LEVEL_SCALE / window.sum())).astype(np.complex64)
+
+    # Feeds one block (samples x channels); returns the strongest target-frequency level of the
+    # channel mix and of each channel over the latest window.
+    def process(self, block):
+        mix, channels = self.process_batch(block[np.newaxis])
+        return mix[0], channels[0]
+
+    # Feeds k equal blocks (k x samples x channels) through the decimators in one pass and returns
+    # the levels process() would have given after each block: (k,) for the mix, (k, channels).
+    def process_batch(self, blocks):
+        # Decimated samples available after each block: a stage holding h samples of history
+        # emits (h + n - taps) // factor + 1 outputs for the next n input samples.
+        ends = np.arange(1, len(blocks) + 1) * blocks.shape[1]
+        samples = blocks.reshape(-1, self.channels)
+        for stage in self.stages:
+            ends = np.maximum((len(stage.history) + ends - len(stage.taps)) // stage.factor + 1, 0)
+            samples = stage.process(samples)
+        history = np.concatenate((self.samples, samples))
+        self.samples = history[len(samples):]
+        if len(blocks) == 1:
+            spectra = (self.basis @ self.samples)[np.newaxis]
+        else:
+            windows = np.lib.stride_tricks.sliding_window_view(history, BASS_WINDOW_SIZE, axis=0)[ends]
+            spectra = self.basis @ windows.transpose(0, 2, 1)
+        # spectra: blocks x bins x channels
+        mix = np.add.reduce(spectra, axis=2) * (1.0 / self.channels)
+        return np.abs(mix).max(axis=1), np.abs(spectra).max(axis=1)
 
 
-def smooth_brightness(val, min_val, rate):
-    return max(val, min_val)
+bass_front_end = None  # Built for the stream's rate and channel count on the first block
 
 
 # -----------------------------
-# FFT-Based Target Frequency Detection
+# Onset Detection & Tempo Tracking
 # -----------------------------
-def detect_frequencies(data, rate, target_freqs):
+ONSET_BLOCKS_PER_FRAME = 4  # Tuned blocks folded into one onset envelope frame (~11.6 ms)
+ONSET_HISTORY_SECONDS = 6.0  # Length of the onset envelope ring buffer used for tempo estimation
+ONSET_THRESHOLD = 2.0  # Onset fires when spectral flux exceeds mean + threshold * deviation
+ONSET_ADAPT_SECONDS = 0.5  # Time constant of the adaptive flux mean/deviation
+ONSET_MIN_INTERVAL = 0.1  # Minimum seconds between two detected onsets
+TEMPO_MIN_BPM = 70
+TEMPO_MAX_BPM = 180
+TEMPO_PRIOR_BPM = 120  # Centre of the log-normal tempo prior (resolves octave errors)
+TEMPO_UPDATE_INTERVAL = 0.25  # Seconds between tempo re-estimates from the autocorrelation
+BEAT_PHASE_GAIN = 0.3  # How strongly an onset near the predicted beat pulls the beat phase
+BEAT_REANCHOR_MISSES = 3  # Consecutive onsets off the predicted beats before the phase jumps to the latest onset
+BEAT_REANCHOR_PERIOD_CHANGE = 0.04  # Relative tempo change that re-anchors the phase at the next onset
+BEAT_MIN_CONFIDENCE = 0.2  # Normalised autocorrelation peak needed before predicting beats
+
+# Predictive light triggering
+PREDICTIVE_TRIGGER = True  # Fire colour changes ahead of the predicted next beat
+OUTPUT_LATENCY = 0.030  # Bulb processing latency added on top of the measured send latency
+BEAT_HUE_STEP = 0.08  # Hue jump applied on each predicted beat (auto-cycle hue only)
+BEAT_FLASH_GLOW = 1.0  # Glow sent on a predicted beat
+BEAT_HOLD_TIME = 0.06  # Seconds regular packets are held back after a predicted beat
+
+
+class OnsetTempoTracker:
+    def __init__(self, block_size, rate):
+        self.blocks_per_frame = scaled_block_count(ONSET_BLOCKS_PER_FRAME, block_size, rate)
+        self.frame_rate = rate / (block_size * self.blocks_per_frame)
+        self.min_lag = max(1, int(60.0 * self.frame_rate / TEMPO_MAX_BPM))
+        self.max_lag = int(math.ceil(60.0 * self.frame_rate / TEMPO_MIN_BPM))
+        self.window = int(ONSET_HISTORY_SECONDS * self.frame_rate)
+        # The ring keeps max_lag extra frames so the frame leaving the window can be un-correlated.
+        self.size = self.window + self.max_lag + 1
+        self.envelope = np.zeros(self.size)
+        self.lags = np.arange(self.max_lag + 1)
+        self.acf = np.zeros(self.max_lag + 1)
+        candidate_bpm = 60.0 * self.frame_rate / np.maximum(self.lags, 1)
+        self.tempo_prior = np.exp(-0.5 * (np.log2(candidate_bpm / TEMPO_PRIOR_BPM) / 0.9) ** 2)
+        self.adapt_alpha = 1.0 / max(ONSET_ADAPT_SECONDS * self.frame_rate, 1.0)
+        self.min_onset_frames = ONSET_MIN_INTERVAL * self.frame_rate
+        self.update_frames = max(1, int(TEMPO_UPDATE_INTERVAL * self.frame_rate))
+
+        self.prev_spectrum = None
+        self.flux_accum = 0.0
+        self.blocks_in_frame = 0
+        self.frame_index = 0
+        self.flux_mean = 0.0
+        self.flux_dev = 0.0
+        self.last_onset_frame = -np.inf
+        self.beat_period = 0.0  # In frames; 0 while the tempo is unknown
+        self.next_beat_frame = None
+        self.confidence = 0.0
+        self.missed_onsets = 0  # Consecutive onsets outside the phase correction window
+        self.reanchor = False  # Set when the period changed enough that the phase is stale
+
+    @property
+    def bpm(self):
+        return 60.0 * self.frame_rate / self.beat_period if self.beat_period else 0.0
+
+    # Feed one block's magnitude spectrum; returns True when an onset was detected.
+    def process_block(self, spectrum):
+        return self.process_blocks(spectrum[np.newaxis])
+
+    # Feed consecutive blocks' spectra (blocks x bins); returns True when any of them was an onset.
+    # The flux of all blocks is computed in one pass; only the envelope frames are stepped.
+    def process_blocks(self, spectra):
+        log_spectra = np.log1p(100.0 * spectra)
+        if self.prev_spectrum is not None and len(self.prev_spectrum) == log_spectra.shape[1]:
+            previous = np.concatenate((self.prev_spectrum[np.newaxis], log_spectra[:-1]))
+            fluxes = np.sum(np.maximum(log_spectra - previous, 0.0), axis=1)
+        else:
+            fluxes = np.concatenate(([0.0], np.sum(np.maximum(np.diff(log_spectra, axis=0), 0.0), axis=1)))
+        self.prev_spectrum = log_spectra[-1]
+        onset = False
+        for flux in fluxes:
+            self.flux_accum += flux
+            self.blocks_in_frame += 1
+            if self.blocks_in_frame == self.blocks_per_frame:
+                onset = self._push_frame(self.flux_accum) or onset
+                self.flux_accum = 0.0
+                self.blocks_in_frame = 0
+        return onset
+
+    def _push_frame(self, flux):
+        is_onset = (flux > self.flux_mean + ONSET_THRESHOLD * self.flux_dev and
+                    self.frame_index - self.last_onset_frame >= self.min_onset_frames)
+        strength = max(flux - self.flux_mean, 0.0)
+        self.flux_mean += self.adapt_alpha * (flux - self.flux_mean)
+        self.flux_dev += self.adapt_alpha * (abs(flux - self.flux_mean) - self.flux_dev)
+
+        # Incremental autocorrelation over the last `window` frames: add the products of the
+        # incoming frame, subtract those of the frame that just left the window.
+        t = self.frame_index
+        pos = t % self.size
+        self.envelope[pos] = strength
+        self.acf += strength * self.envelope[(pos - self.lags) % self.size]
+        old_pos = (pos - self.window) % self.size
+        self.acf -= self.envelope[old_pos] * self.envelope[(old_pos - self.lags) % self.size]
+        # Re-sum from the ring once per lap so rounding error cannot accumulate.
+        if pos == self.size - 1:
+            self._resum_acf()
+
+        if t % self.update_frames == 0:
+            self._estimate_tempo()
+        if is_onset:
+            self.last_onset_frame = t
+            self._align_beat(t)
+        if self.next_beat_frame is not None and self.beat_period:
+            while self.next_beat_frame < t:
+                self.next_beat_frame += self.beat_period
+        self.frame_index += 1
+        return is_onset
+
+    # acf[lag] = sum over the last `window` frames f of envelope[f] * envelope[f - lag].
+    def _resum_acf(self):
+        ordered = np.roll(self.envelope, -(self.frame_index % self.size + 1))  # Oldest first
+        shifted = np.lib.stride_tricks.sliding_window_view(ordered, self.window)
+        self.acf = shifted[self.max_lag + 1 - self.lags] @ ordered[-self.window:]
+
+    def _estimate_tempo(self):
+        energy = self.acf[0]
+        if energy <= 1e-12:
+            self.confidence = 0.0
+            return
+        weighted = self.acf[self.min_lag:self.max_lag + 1] * self.tempo_prior[self.min_lag:self.max_lag + 1]
+        i = int(np.argmax(weighted))
+        lag = float(self.min_lag + i)
+        # Parabolic interpolation for a sub-frame beat period.
+        if 0 < i < len(weighted) - 1:
+            a, b, c = weighted[i - 1], weighted[i], weighted[i + 1]
+            denom = a - 2 * b + c
+            if denom < 0:
+                lag += 0.5 * (a - c) / denom
+        self.confidence = float(self.acf[self.min_lag + i] / energy)
+        if self.beat_period and abs(lag - self.beat_period) > BEAT_REANCHOR_PERIOD_CHANGE * self.beat_period:
+            self.reanchor = True
+        self.beat_period = lag
+
+    def _align_beat(self, onset_frame):
+        if not self.beat_period:
+            return
+        # The first estimate, a changed tempo or a run of onsets the prediction keeps missing all
+        # mean the phase is stale: start the beat grid over from this onset.
+        if self.next_beat_frame is None or self.reanchor or self.missed_onsets >= BEAT_REANCHOR_MISSES:
+            self.next_beat_frame = onset_frame + self.beat_period
+            self.reanchor = False
+            self.missed_onsets = 0
+            return
+        # Phase error against the nearest predicted beat, wrapped into [-period/2, period/2).
+        error = (onset_frame - self.next_beat_frame + 0.5 * self.beat_period) % self.beat_period - 0.5 * self.beat_period
+        if abs(error) < 0.25 * self.beat_period:
+            self.next_beat_frame += BEAT_PHASE_GAIN * error
+            self.missed_onsets = 0
+        else:
+            self.missed_onsets += 1
+        if self.next_beat_frame <= onset_frame:
+            self.next_beat_frame += self.beat_period
+
+    # Seconds from the end of the latest processed audio to the predicted next beat, or None.
+    def seconds_to_next_beat(self):
+        if self.next_beat_frame is None or self.confidence < BEAT_MIN_CONFIDENCE:
+            return None
+        position = self.frame_index + self.blocks_in_frame / self.blocks_per_frame
+        return (self.next_beat_frame - position) / self.frame_rate
+
+    def beat_id(self):
+        return int(round(self.next_beat_frame)) if self.next_beat_frame is not None else None
+
+
+onset_tracker = OnsetTempoTracker(BUFFER, RATE)
+
+
+# -----------------------------
+# Metrics (Prometheus Text Format)
+# -----------------------------
+METRICS_ENABLED = False  # Serve /metrics for dashboards and alerting
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+ANALYSIS_TIME_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025]
+LIFX_SEND_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0]
+FRAME_TIME_BUCKETS = [0.002, 0.004, 0.008, 0.0167, 0.033, 0.05, 0.1, 0.25]
+OUTPUT_LATENESS_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.025]
+
+
+def format_metric_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+# Counters and histograms are updated from both the analysis and output scheduler threads (LIFX
+# packets, errors, send times), so their read-modify-write updates take a lock. Gauges are a
+# single assignment and need none.
+class Counter:
+    def __init__(self, labels=None):
+        self.labels = labels or {}
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name):
+        return [f"{name}{format_metric_labels(self.labels)} {self.value}"]
+
+
+class Gauge:
+    def __init__(self, labels=None):
+        self.labels = labels or {}
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name):
+        return [f"{name}{format_metric_labels(self.labels)} {self.value}"]
+
+
+class Histogram:
+    def __init__(self, buckets, labels=None):
+        self.labels = labels or {}
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self, name):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ["+Inf"], counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{format_metric_labels(dict(self.labels, le=bound))} {cumulative}")
+        lines.append(f"{name}_sum{format_metric_labels(self.labels)} {total}")
+        lines.append(f"{name}_count{format_metric_labels(self.labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.families = {}  # name -> (type, help, [metrics])
+
+    def _register(self, name, kind, help_text, metric):
+        family = self.families.setdefault(name, (kind, help_text, []))
+        family[2].append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=None):
+        return self._register(name, "counter", help_text, Counter(labels))
+
+    def gauge(self, name, help_text, labels=None):
+        return self._register(name, "gauge", help_text, Gauge(labels))
+
+    def histogram(self, name, help_text, buckets, labels=None):
+        return self._register(name, "histogram", help_text, Histogram(buckets, labels))
+
+    def render(self):
+        lines = []
+        for name, (kind, help_text, metrics) in self.families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for metric in metrics:
+                lines.extend(metric.samples(name))
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+metric_audio_blocks = metrics.counter("vbs_audio_blocks_total", "Audio blocks delivered by the input callback")
+metric_audio_dropped = metrics.counter("vbs_audio_blocks_dropped_total", "Audio blocks dropped because the queue was full")
+metric_audio_status = {flag: metrics.counter("vbs_audio_status_flags_total", "Audio callbacks reporting a status flag",
+                                             {"flag": flag})
+                       for flag in ("input_overflow", "input_underflow")}
+metric_queue_depth = metrics.gauge("vbs_audio_queue_depth", "Blocks waiting in audio_queue when processing starts")
+metric_analysis_time = metrics.histogram("vbs_analysis_seconds", "Analysis time per audio block", ANALYSIS_TIME_BUCKETS)
+metric_lifx_packets = metrics.counter("vbs_lifx_packets_total", "LIFX colour packets sent successfully")
+metric_lifx_errors = metrics.counter("vbs_lifx_send_errors_total", "Failed LIFX send attempts")
+metric_lifx_failures = metrics.counter("vbs_lifx_send_failures_total", "LIFX updates abandoned after all retries")
+metric_lifx_skipped = metrics.counter("vbs_lifx_skipped_total", "LIFX updates skipped because no bulb is available")
+metric_lifx_send_time = metrics.histogram("vbs_lifx_send_seconds", "Duration of a LIFX set_color call", LIFX_SEND_BUCKETS)
+metric_output_lateness = metrics.histogram("vbs_output_lateness_seconds",
+                                           "Delay of a LIFX output tick past its deadline", OUTPUT_LATENESS_BUCKETS)
+metric_output_missed = metrics.counter("vbs_output_missed_ticks_total",
+                                       "LIFX output ticks skipped because the previous tick overran")
+metric_render_fps = metrics.gauge("vbs_render_fps", "Render loop frames per second")
+metric_frame_time = metrics.histogram("vbs_frame_seconds", "Render loop frame time", FRAME_TIME_BUCKETS)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+metrics_server = None
+
+
+def start_metrics_server():
+    global metrics_server
     try:
-        data = np.ascontiguousarray(data)
-        n = len(data)
-        if n == BUFFER:
-            fft_data = np.abs(np.fft.rfft(data))
-            freqs = PRECOMPUTED_RFFT_FREQS
+        metrics_server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), MetricsRequestHandler)
+    except OSError as e:
+        logging.error(f"Could not start metrics server: {e}")
+        return
+    metrics_server.daemon_threads = True
+    threading.Thread(target=metrics_server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.info(f"Metrics available at http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+
+# -----------------------------
+# Flight Recorder (Chrome / Perfetto Trace Export)
+# -----------------------------
+FLIGHT_RECORDER_ENABLED = True
+FLIGHT_RECORDER_SIZE = 65536  # Events kept in the ring (oldest are overwritten)
+FLIGHT_RECORDER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces")
+FLIGHT_RECORDER_ANOMALY_FRAME = 0.050  # A frame slower than this dumps the ring automatically
+FLIGHT_RECORDER_DUMP_COOLDOWN = 10.0  # Minimum seconds between two anomaly dumps
+FLIGHT_RECORDER_DUMP_KEY = "f9"  # pygame key name
+
+PHASE_BEGIN, PHASE_END, PHASE_INSTANT = 0, 1, 2
+PHASE_CODES = ["B", "E", "i"]
+EV_AUDIO_BLOCK, EV_AUDIO_STATUS, EV_ANALYSIS, EV_PACKET, EV_PACKET_FAILED, EV_FRAME, EV_FLIP, EV_MODE_SWITCH, \
+    EV_BEAT, EV_ANOMALY = range(10)
+EVENT_NAMES = ["audio block", "audio status", "analysis", "packet send", "packet failed", "frame", "flip",
+               "mode switch", "predicted beat", "slow frame"]
+
+
+class FlightRecorder:
+    def __init__(self, size):
+        self.size = size
+        # Preallocated columns; recording is a handful of scalar stores and never allocates.
+        self.seq = np.full(size, -1, dtype=np.int64)
+        self.timestamps = np.zeros(size, dtype=np.float64)
+        self.kinds = np.zeros(size, dtype=np.uint8)
+        self.phases = np.zeros(size, dtype=np.uint8)
+        self.values = np.zeros(size, dtype=np.float64)
+        self.threads = np.zeros(size, dtype=np.uint64)
+        self.counter = itertools.count()  # next() is atomic, so the audio thread can record too
+        self.last_dump_time = -math.inf
+
+    def record(self, kind, phase=PHASE_INSTANT, value=0.0):
+        n = next(self.counter)
+        i = n % self.size
+        self.timestamps[i] = time.perf_counter()
+        self.kinds[i] = kind
+        self.phases[i] = phase
+        self.values[i] = value
+        self.threads[i] = threading.get_ident()
+        self.seq[i] = n
+
+    def snapshot(self):
+        valid = self.seq >= 0
+        order = np.argsort(self.seq[valid])
+        return {name: column[valid][order] for name, column in (
+            ("timestamps", self.timestamps), ("kinds", self.kinds), ("phases", self.phases),
+            ("values", self.values), ("threads", self.threads))}
+
+    # Copies the ring on the calling thread, then formats and writes the JSON in the background.
+    def dump(self, reason):
+        self.last_dump_time = time.perf_counter()
+        snapshot = self.snapshot()
+        os.makedirs(FLIGHT_RECORDER_DIR, exist_ok=True)
+        path = os.path.join(FLIGHT_RECORDER_DIR, time.strftime("flight_%Y%m%d_%H%M%S") + f"_{reason}.json")
+        threading.Thread(target=self._write_trace, args=(snapshot, path), daemon=True).start()
+        return path
+
+    def dump_on_anomaly(self, reason):
+        if time.perf_counter() - self.last_dump_time >= FLIGHT_RECORDER_DUMP_COOLDOWN:
+            return self.dump(reason)
+        return None
+
+    def _write_trace(self, snapshot, path):
+        thread_ids = {}
+        events = []
+        for t, kind, phase, value, thread in zip(snapshot["timestamps"], snapshot["kinds"], snapshot["phases"],
+                                                 snapshot["values"], snapshot["threads"]):
+            tid = thread_ids.setdefault(int(thread), len(thread_ids) + 1)
+            event = {"name": EVENT_NAMES[kind], "ph": PHASE_CODES[phase], "ts": t * 1e6, "pid": 1, "tid": tid,
+                     "args": {"value": float(value)}}
+            if kind == EV_MODE_SWITCH:
+                event["args"]["mode"] = available_modes[int(value) % len(available_modes)]
+            if phase == PHASE_INSTANT:
+                event["s"] = "t"
+            events.append(event)
+        for thread, tid in thread_ids.items():
+            name = next((t.name for t in threading.enumerate() if t.ident == thread), f"thread {tid}")
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": name}})
+        try:
+            with open(path, "w") as f:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+            logging.info(f"Flight recorder dumped {len(events)} events to {path}")
+        except OSError as e:
+            logging.error(f"Flight recorder dump failed: {e}")
+
+
+class NullFlightRecorder:
+    def record(self, kind, phase=PHASE_INSTANT, value=0.0):
+        pass
+
+    def dump(self, reason):
+        return None
+
+    def dump_on_anomaly(self, reason):
+        return None
+
+
+flight_recorder = FlightRecorder(FLIGHT_RECORDER_SIZE) if FLIGHT_RECORDER_ENABLED else NullFlightRecorder()
+
+
+# -----------------------------
+# Offline Render
+# -----------------------------
+# Renders the visuals of a WAV file to a PNG sequence or raw RGB24 frames without a window. The
+# parent analyses the file into a per-frame feature timeline, worker processes each draw a
+# contiguous chunk of frames on their own offscreen surface, and the parent writes finished
+# chunks back in frame order with only a few chunks in flight.
+RENDER_FPS = 60
+RENDER_SIZE = (1280, 720)
+RENDER_CHUNK_FRAMES = 30  # Frames per worker task
+RENDER_WARMUP_FRAMES = 30  # Frames drawn and discarded before each chunk so stateful modes (orbs, waveform buffers) settle
+RENDER_QUEUE_DEPTH = 2  # Chunks in flight per worker; bounds the memory held by unwritten frames
+RENDER_REFERENCE_FPS = 240  # Frame rate the live loop's per-frame rates (hue cycle, display glow) are tuned for
+
+visual_time_ms = None  # Animation clock of the frame being rendered offline; None follows pygame's clock
+offline_samples = None
+offline_rate = None
+offline_mix = None  # Channel mix of offline_samples; forked render workers feed modes from it
+
+
+def read_wav(path):
+    with wave.open(path, "rb") as wav:
+        rate = wav.getframerate()
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        raw = wav.readframes(wav.getnframes())
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 3:
+        octets = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = octets[:, 0] | (octets[:, 1] << 8) | (octets[:, 2] << 16)
+        samples = ((ints ^ 0x800000) - 0x800000) / float(2 ** 23)
+    else:
+        samples = np.frombuffer(raw, dtype={2: np.int16, 4: np.int32}[width]) / float(2 ** (8 * width - 1))
+    return samples.astype(np.float32).reshape(-1, channels), rate
+
+
+# Runs the live analysis chain over the file and samples its state once per video frame. Each
+# frame also records the span of offline_mix analysed since the previous one, so modes that
+# consume the sample stream (the spectrogram) get every sample, as they do live.
+def build_render_timeline(samples, fps):
+    global hue_value, channel_glow_values, channel_db_smoothed, offline_mix
+    offline_mix = samples.mean(axis=1).astype(np.float32)
+    frame_count = int(len(samples) / RATE * fps)
+    channels = samples.shape[1]
+    channel_glow_values = np.zeros(channels)
+    channel_db_smoothed = np.full(channels, float(NOISE_FLOOR))
+    timeline = {
+        "glow": np.zeros(frame_count),
+        "hue": np.zeros(frame_count),
+        "display_glow": np.zeros((frame_count, channels + 1)),
+        "db": np.full((frame_count, channels), float(NOISE_FLOOR)),
+        "waveform": np.zeros((frame_count, BUFFER), dtype=np.float32),
+        "spectrum": np.zeros((frame_count, BUFFER // 2 + 1), dtype=np.float32),
+        "audio": np.zeros((frame_count, 2), dtype=np.int64),  # [start, end) in offline_mix
+    }
+    hue_step = cycle_rate * RENDER_REFERENCE_FPS / fps
+    display_smoother = OnePoleEMA(1.0 - (1.0 - DISPLAY_GLOW_SMOOTHING) ** (RENDER_REFERENCE_FPS / fps))
+    block = 0
+    for frame in range(frame_count):
+        # Analyse every block that has fully arrived by the time this frame is shown.
+        first_block = block
+        while (block + 1) * BUFFER <= len(samples) and (block + 1) * BUFFER / RATE <= frame / fps:
+            audio_queue.put((block * BUFFER / RATE, samples[block * BUFFER:(block + 1) * BUFFER]))
+            process_audio_queue()
+            block += 1
+        timeline["audio"][frame] = (first_block * BUFFER, block * BUFFER)
+        hue_value = manual_hue_value if manual_hue else (hue_value + hue_step) % 1.0
+        timeline["glow"][frame] = glow_value
+        timeline["hue"][frame] = hue_value
+        timeline["display_glow"][frame] = display_smoother.process(np.concatenate(([glow_value], channel_glow_values)))
+        timeline["db"][frame] = channel_db_smoothed
+        if feature_bus.latest is not None:
+            timeline["waveform"][frame] = feature_bus.latest.samples
+            timeline["spectrum"][frame] = feature_bus.latest.spectrum
+    return timeline
+
+
+def init_render_worker(size):
+    global screen, WINDOW_WIDTH, WINDOW_HEIGHT
+    WINDOW_WIDTH, WINDOW_HEIGHT = size
+    screen = pygame.Surface(size)
+    update_menu_dimensions()
+    update_meter_dimensions()
+
+
+# Draws frames first..first+len-1 of a timeline slice and returns the encoded frames from `start` on;
+# the frames before `start` only warm up the mode's state.
+def render_frame_chunk(task):
+    global glow_value, hue_value, display_glow, channel_display_glow
+    global channel_db_smoothed, visual_time_ms
+    first, start, frames, mode, fps, encoding = task
+    activate_mode(mode)  # Fresh mode state per chunk; the warm-up frames rebuild it
+    np.random.seed(start)  # Orb jitter depends only on the chunk, not on which worker drew it
+    encoded = []
+    for offset in range(len(frames["glow"])):
+        index = first + offset
+        glow_value = frames["glow"][offset]
+        hue_value = frames["hue"][offset]
+        display_glow = frames["display_glow"][offset][0]
+        channel_display_glow = frames["display_glow"][offset][1:]
+        channel_db_smoothed = frames["db"][offset]
+        # Each video frame republishes the analysis frame it was sampled from and feeds the mode
+        # every sample analysed since the previous video frame.
+        feature_bus.publish([index / fps], frames["waveform"][offset:offset + 1], frames["spectrum"][offset:offset + 1], RATE)
+        audio_start, audio_end = frames["audio"][offset]
+        active_mode.feed(offline_mix[audio_start:audio_end])
+        visual_time_ms = index * 1000.0 / fps
+        screen.fill((0, 0, 0))
+        draw_visualization()
+        if index < start:
+            continue
+        if encoding == "png":
+            buffer = io.BytesIO()
+            pygame.image.save(screen, buffer, "frame.png")
+            encoded.append(buffer.getvalue())
         else:
-            fft_data = np.abs(np.fft.rfft(data))
-            freqs = np.fft.rfftfreq(n, 1 / rate)
-        detected_values = []
-        for target_freq in target_freqs:
-            target_index = np.argmin(np.abs(freqs - target_freq))
-            detected_values.append(fft_data[target_index])
-        return max(detected_values)
-    except Exception as e:
-        logging.error(f"Error in detect_frequencies: {e}")
-        return 0
+            encoded.append(pygame.image.tobytes(screen, "RGB"))
+    return start, encoded
+
+
+def run_offline_render():
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    size = tuple(int(v) for v in args.render_size.lower().split("x"))
+    fps = args.render_fps
+    mode = args.render_mode or visualization_mode
+    encoding = "rgb" if args.render_output.endswith(".rgb") else "png"
+    analysis_start = time.perf_counter()
+    timeline = build_render_timeline(offline_samples, fps)
+    frame_count = len(timeline["glow"])
+    logging.info(f"Analysed {len(offline_samples) / RATE:.1f} s of audio into {frame_count} frames "
+                 f"in {time.perf_counter() - analysis_start:.1f} s")
+
+    def tasks():
+        for start in range(0, frame_count, RENDER_CHUNK_FRAMES):
+            first = max(0, start - RENDER_WARMUP_FRAMES)
+            stop = min(start + RENDER_CHUNK_FRAMES, frame_count)
+            frames = {name: values[first:stop] for name, values in timeline.items()}
+            yield first, start, frames, mode, fps, encoding
+
+    if encoding == "png":
+        os.makedirs(args.render_output, exist_ok=True)
+        raw_file = None
+    else:
+        raw_file = open(args.render_output, "wb")
+
+    def write_chunk(result):
+        start, encoded = result
+        if raw_file is not None:
+            raw_file.write(b"".join(encoded))
+            return
+        for i, frame in enumerate(encoded):
+            with open(os.path.join(args.render_output, f"frame_{start + i:06d}.png"), "wb") as f:
+                f.write(frame)
+
+    workers = args.render_workers or os.cpu_count() or 1
+    render_start = time.perf_counter()
+    try:
+        # Workers are forked so they inherit the settings, fonts and audio set up at start-up; a
+        # spawned worker would re-import this file and start from the bare definitions.
+        if "fork" not in multiprocessing.get_all_start_methods():
+            logging.warning("Process fork is unavailable on this platform; rendering in a single process.")
+            workers = 1
+        if workers == 1:
+            init_render_worker(size)
+            for task in tasks():
+                write_chunk(render_frame_chunk(task))
+        else:
+            pending = deque()
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"),
+                                     initializer=init_render_worker, initargs=(size,)) as pool:
+                for task in tasks():
+                    pending.append(pool.submit(render_frame_chunk, task))
+                    if len(pending) >= workers * RENDER_QUEUE_DEPTH:
+                        write_chunk(pending.popleft().result())
+                while pending:
+                    write_chunk(pending.popleft().result())
+    finally:
+        if raw_file is not None:
+            raw_file.close()
+    elapsed = time.perf_counter() - render_start
+    logging.info(f"Rendered {frame_count} {mode} frames at {size[0]}x{size[1]} in {elapsed:.1f} s "
+                 f"({frame_count / max(elapsed, 1e-9):.1f} frames/s, {workers} worker(s)) to {args.render_output}")
+
+
+# -----------------------------
+# Session Record & Replay
+# -----------------------------
+# Session files: a 64-byte header followed by fixed-size float32 records. Each record holds the
+# callback timestamp (a float64 stored in the first two float32 slots) and the interleaved
+# frames x channels samples, so a file can be appended to live and memory-mapped for replay.
+SESSION_MAGIC = b"VBSREC1\0"
+SESSION_HEADER = struct.Struct("<8sIIId")  # magic, sample rate, channels, block size, start time
+SESSION_HEADER_SIZE = 64
+SESSION_WRITE_QUEUE_SIZE = 4096  # Blocks buffered for the writer thread before recording drops
+
+
+class SessionRecorder:
+    def __init__(self, path, rate, channels, block_size):
+        self.path = path
+        self.record_size = 2 + block_size * channels
+        self.block_size = block_size
+        self.queue = Queue(maxsize=SESSION_WRITE_QUEUE_SIZE)
+        self.dropped_blocks = 0
+        self.written_blocks = 0
+        if os.path.exists(path) and os.path.getsize(path) >= SESSION_HEADER_SIZE:
+            header = read_session_header(path)
+            if header[1:4] != (rate, channels, block_size):
+                raise ValueError(f"{path} was recorded as {header[1:4]}, cannot append {(rate, channels, block_size)}")
+            # A recording cut off mid-write ends in a partial record; appending after it would shift
+            # every later record, so the file is truncated to its last whole record first.
+            record_bytes = self.record_size * 4
+            size = os.path.getsize(path)
+            whole_size = SESSION_HEADER_SIZE + (size - SESSION_HEADER_SIZE) // record_bytes * record_bytes
+            self.file = open(path, "r+b")
+            if whole_size != size:
+                logging.warning(f"{path} ends in a partial record; dropping {size - whole_size} trailing bytes")
+                self.file.truncate(whole_size)
+            self.file.seek(whole_size)
+        else:
+            self.file = open(path, "wb")
+            self.file.write(SESSION_HEADER.pack(SESSION_MAGIC, rate, channels, block_size, time.time())
+                            .ljust(SESSION_HEADER_SIZE, b"\0"))
+        self.thread = threading.Thread(target=self._write_loop, name="session-writer", daemon=True)
+        self.thread.start()
+
+    # Called from the audio callback: only packs the record, file I/O happens on the writer thread.
+    def push(self, timestamp, indata):
+        if len(indata) != self.block_size:
+            self.dropped_blocks += 1
+            return
+        record = np.empty(self.record_size, dtype=np.float32)
+        record[:2] = np.array([timestamp], dtype=np.float64).view(np.float32)
+        record[2:] = indata.ravel()
+        if self.queue.full():
+            self.dropped_blocks += 1
+        else:
+            self.queue.put_nowait(record)
+
+    def _write_loop(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            self.file.write(record.tobytes())
+            self.written_blocks += 1
+        self.file.close()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join(timeout=5.0)
+        logging.info(f"Recorded {self.written_blocks} blocks to {self.path} ({self.dropped_blocks} dropped)")
+
+
+def read_session_header(path):
+    with open(path, "rb") as f:
+        header = SESSION_HEADER.unpack(f.read(SESSION_HEADER.size))
+    if header[0] != SESSION_MAGIC:
+        raise ValueError(f"{path} is not a VisualBassSync session file")
+    return header
+
+
+class ReplayTimeInfo:
+    def __init__(self, replay_time):
+        self.replay_time = replay_time
+
+
+class SessionReplay:
+    def __init__(self, path, speed):
+        _, self.rate, self.channels, self.block_size, _ = read_session_header(path)
+        data = np.memmap(path, dtype=np.float32, mode="r", offset=SESSION_HEADER_SIZE)
+        record_size = 2 + self.block_size * self.channels
+        self.records = data[:len(data) - len(data) % record_size].reshape(-1, record_size)
+        self.timestamps = np.ascontiguousarray(self.records[:, :2]).view(np.float64).ravel()
+        self.speed = speed
+        self.finished = False
+        self.wall_seconds = 0.0
+
+    @property
+    def duration(self):
+        return len(self.records) * self.block_size / self.rate
+
+    def start(self):
+        threading.Thread(target=self._run, name="session-replay", daemon=True).start()
+
+    # Feeds every recorded block through the same audio_callback the live stream uses.
+    def _run(self):
+        wall_start = time.perf_counter()
+        first = self.timestamps[0] if len(self.timestamps) else 0.0
+        for record, timestamp in zip(self.records, self.timestamps):
+            if self.speed == "realtime":
+                delay = wall_start + (timestamp - first) - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                # Maximum speed never drops blocks: wait for the consumer instead.
+                while audio_queue.full():
+                    time.sleep(0.0005)
+            indata = record[2:].reshape(self.block_size, self.channels)
+            audio_callback(indata, self.block_size, ReplayTimeInfo(timestamp), None)
+        self.wall_seconds = time.perf_counter() - wall_start
+        self.finished = True
+
+
+session_recorder = None
+session_replay = None
+
+
+def positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return value
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="VisualBassSync audio-reactive visuals and LIFX lighting")
+    parser.add_argument("--record", metavar="FILE", help="append raw input blocks to a session file")
+    parser.add_argument("--replay", metavar="FILE", help="replay a recorded session instead of opening a device")
+    parser.add_argument("--replay-speed", choices=["realtime", "max"], default="realtime",
+                        help="pace replay like the recording or feed blocks as fast as they are consumed")
+    parser.add_argument("--render-offline", metavar="WAV",
+                        help="render the visuals of a WAV file to frames without a window, then exit")
+    parser.add_argument("--render-output", metavar="PATH", default="render",
+                        help="directory for a PNG sequence, or a file ending in .rgb for raw RGB24 frames")
+    parser.add_argument("--render-mode", choices=available_modes, help="mode to render (default: current mode)")
+    parser.add_argument("--render-size", metavar="WxH", default=f"{RENDER_SIZE[0]}x{RENDER_SIZE[1]}")
+    parser.add_argument("--render-fps", type=int, default=RENDER_FPS)
+    parser.add_argument("--render-workers", type=int, default=0, help="worker processes (default: one per core)")
+    parser.add_argument("--benchmark-startup", action="store_true",
+                        help="report time from launch to the first audio block and LIFX packet without "
+                             "opening a window, then exit")
+    parser.add_argument("--lifx-loadtest", action="store_true",
+                        help="measure LIFX output paths against 1, 10 and 100 simulated bulbs, then exit")
+    parser.add_argument("--lifx-simulator", metavar="N", type=positive_int,
+                        help="serve N simulated LIFX devices on the local network until interrupted")
+    parser.add_argument("--daemon", action="store_true",
+                        help="run capture, analysis and LIFX output only: no window, no device picker")
+    parser.add_argument("--benchmark-daemon", metavar="SECONDS", type=float, nargs="?",
+                        const=DAEMON_BENCHMARK_SECONDS,
+                        help="measure the daemon's CPU and memory use on synthetic input, then exit")
+    return parser.parse_args()
+
+
+# -----------------------------
+# Headless Daemon
+# -----------------------------
+# For installs without a display: capture, analysis and LIFX output run on their own, SDL and Tk
+# are never imported and the main thread sleeps on the audio queue instead of rendering frames.
+# Larger blocks and the LIFX-recommended packet rate keep the CPU footprint small.
+DAEMON_BLOCK_SIZE = 1024  # Samples per audio block (~23 ms at 44.1 kHz, under the packet interval)
+DAEMON_PACKET_INTERVAL = 0.05  # Seconds between LIFX output ticks (LIFX devices handle about 20 messages/s)
+DAEMON_QUEUE_TIMEOUT = 0.5  # Longest wait for a block before checking for shutdown
+DAEMON_BLOCKS_PER_PASS = 2  # Blocks analysed per wake-up (~46 ms, matching the packet interval)
+DAEMON_LOG_LEVEL = logging.INFO
+DAEMON_BENCHMARK_SECONDS = 30.0
+DAEMON_CPU_TARGET = 0.05  # Fraction of one core the daemon should stay under
+
+daemon_stop = threading.Event()
+synthetic_input = None
+benchmark_simulator = None
+
+
+# journald adds its own timestamps and reads stdout line by line.
+def configure_service_logging():
+    if os.environ.get("JOURNAL_STREAM"):
+        log_format = "%(levelname)s %(message)s"
+    else:
+        log_format = "%(asctime)s %(levelname)s %(message)s"
+    logging.basicConfig(level=DAEMON_LOG_LEVEL, format=log_format, force=True)
+    sys.stdout.reconfigure(line_buffering=True)
+
+
+def default_input_device(devices_list):
+    default = sd.default.device[0] if sd.default.device else -1
+    indices = [index for index, _ in devices_list]
+    return default if default in indices else indices[0]
+
+
+def request_daemon_stop(signum, frame):
+    logging.info(f"Received {signal.Signals(signum).name}, shutting down")
+    daemon_stop.set()
+
+
+# Feeds a looped 120 BPM kick with noise through audio_callback at real-time pace. The loop is
+# synthesised once, so the generator thread costs next to nothing per block. cpu_seconds counts
+# only the generator's own work: audio_callback is daemon work a real input thread would do too.
+class SyntheticInput:
+    def __init__(self, rate, channels, block_size):
+        self.block_size = block_size
+        t = np.arange(int(rate * 2.0)) / rate  # Four beats
+        kick = np.exp(-(t % 0.5) * 20) * np.sin(2 * np.pi * 45 * t)
+        noise = np.random.default_rng(0).normal(0.0, 0.02, len(t))
+        self.loop = np.repeat((0.5 * kick + noise)[:, np.newaxis], channels, axis=1).astype(np.float32)
+        self.running = False
+        self.thread = None
+        self.cpu_seconds = 0.0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="synthetic-input", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        interval = self.block_size / RATE
+        next_block = time.perf_counter()
+        position = 0
+        callback_seconds = 0.0
+        while self.running:
+            if position + self.block_size > len(self.loop):
+                position = 0
+            callback_start = time.thread_time()
+            audio_callback(self.loop[position:position + self.block_size], self.block_size, None, None)
+            callback_seconds += time.thread_time() - callback_start
+            self.cpu_seconds = time.thread_time() - callback_seconds
+            position += self.block_size
+            next_block += interval
+            delay = next_block - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+
+def run_daemon(duration=None):
+    global hue_value
+    signal.signal(signal.SIGTERM, request_daemon_stop)
+    signal.signal(signal.SIGINT, request_daemon_stop)
+    logging.info(f"Daemon running: {BUFFER} samples @ {RATE} Hz, LIFX every {output_scheduler.interval * 1000:.0f} ms")
+    last = time.perf_counter()
+    deadline = None if duration is None else last + duration
+    while not daemon_stop.is_set():
+        process_audio_queue(wait=DAEMON_QUEUE_TIMEOUT, min_blocks=DAEMON_BLOCKS_PER_PASS)
+        now = time.perf_counter()
+        # cycle_rate is a per-frame step at the 240 FPS the window runs at.
+        if manual_hue:
+            hue_value = manual_hue_value
+        else:
+            apply_beat_hue_steps()
+            hue_value = (hue_value + cycle_rate * RENDER_REFERENCE_FPS * (now - last)) % 1.0
+        last = now
+        autosave_state()
+        if session_replay is not None and session_replay.finished and audio_queue.empty():
+            break
+        if deadline is not None and now >= deadline:
+            break
+
+
+def peak_memory_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+# Runs the daemon loop on synthetic input against one simulated bulb and reports the process CPU
+# share (minus what the input generator and the simulator spent during the run, as they stand in
+# for hardware) and peak RSS.
+def run_daemon_benchmark(seconds):
+    blocks_start = metric_audio_blocks.value
+    packets_start = metric_lifx_packets.value
+    stand_in_start = synthetic_input.cpu_seconds + benchmark_simulator.cpu_seconds
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    run_daemon(seconds)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    synthetic_input.stop()
+    output_scheduler.stop()
+    benchmark_simulator.stop()
+    cpu -= synthetic_input.cpu_seconds + benchmark_simulator.cpu_seconds - stand_in_start
+    share = cpu / wall
+    memory = peak_memory_mb()
+    print(f"Daemon benchmark: {wall:.1f} s, {metric_audio_blocks.value - blocks_start:.0f} blocks of {BUFFER}, "
+          f"{metric_lifx_packets.value - packets_start:.0f} LIFX packets sent, "
+          f"{benchmark_simulator.stats(wall_start)['accepted']} received by the simulated bulb")
+    print(f"  CPU: {share:.2%} of one core ({cpu:.2f} s), target < {DAEMON_CPU_TARGET:.0%}: "
+          f"{'ok' if share < DAEMON_CPU_TARGET else 'over'}")
+    print(f"  Peak RSS: {memory:.1f} MB" if memory is not None else "  Peak RSS: unavailable")
+    print(f"  SDL loaded: {'pygame' in sys.modules}, Tk loaded: {'tkinter' in sys.modules}")
+    return share < DAEMON_CPU_TARGET
 
 
 # -----------------------------
@@ -219,111 +1665,1432 @@ def detect_frequencies(data, rate, target_freqs):
 # -----------------------------
 def audio_callback(indata, frames, time_info, status):
     try:
+        block_time = getattr(time_info, "replay_time", None)
+        if block_time is None:
+            block_time = time.time()
+        mark_startup("first audio block")
+        metric_audio_blocks.inc()
+        flight_recorder.record(EV_AUDIO_BLOCK, PHASE_INSTANT, frames)
+        if session_recorder is not None:
+            session_recorder.push(block_time, indata)
         if status:
-            logging.warning(status)
-        data = indata[:, 0].copy()
+            # No logging here: the callback runs on the audio thread, flags go to metrics and the trace.
+            for flag, counter in metric_audio_status.items():
+                if getattr(status, flag, False):
+                    counter.inc()
+            flight_recorder.record(EV_AUDIO_STATUS, PHASE_INSTANT, 1.0)
+        data = indata.copy()
         if not audio_queue.full():
-            audio_queue.put(data)
+            audio_queue.put((block_time, data))
+        else:
+            metric_audio_dropped.inc()
     except Exception as e:
         logging.error(f"Error in audio_callback: {e}")
 
 
-MIN_DB = -100
-current_gain_db = MIN_DB
-current_decay_rate = 5
-MAX_DECAY_RATE = 10
-DECAY_RAMP_UP_INTERVAL = 1
-last_decay_ramp_up_time = time.time()
+# -----------------------------
+# Adaptive Gain Control (Streaming Quantiles)
+# -----------------------------
+# Maps detection onto 0-1 between a low and a high quantile of its recent values instead of a
+# fixed gain, so a quiet room and a festival rig both use the full brightness range.
+AGC_ENABLED = True
+AGC_LOW_QUANTILE = 0.10  # Detection at or below this quantile maps to 0
+AGC_HIGH_QUANTILE = 0.95  # Detection at or above this quantile maps to 1
+AGC_WINDOW_SECONDS = 8.0  # Effective memory of the quantile estimates
+AGC_QUANTILE_RATE = 10.0  # Step size of the quantile estimates, in mean deviations per window
+AGC_ATTACK = 0.05  # Seconds for the mapped range to widen when the level jumps up
+AGC_RELEASE = 2.0  # Seconds for the mapped range to narrow again when the level drops
+AGC_MIN_RANGE = 4.0  # Smallest detection range mapped onto 0-1, so silence is not amplified to full glow
+
+
+class StreamingQuantileAGC:
+    # Each quantile q follows q += step * (tau - [x < q]), an exponentially weighted stochastic
+    # approximation that needs no history. The step scales with a running mean absolute deviation
+    # so the estimate converges at the same speed whatever the input level, and is divided by
+    # min(tau, 1 - tau) so a tail quantile does not crawl in its slow direction. Works element-wise
+    # on arrays, so one instance covers all input channels. With step_seconds set it also works as
+    # a FilterChain stage, which calls process and process_batch without a dt.
+    def __init__(self, low_quantile, high_quantile, window, rate, attack, release, min_range, initial_ceiling):
+        self.quantiles = np.array([low_quantile, high_quantile])
+        self.step_scale = 1.0 / np.minimum(self.quantiles, 1.0 - self.quantiles)
+        self.window = window
+        self.rate = rate
+        self.attack = attack
+        self.release = release
+        self.min_range = min_range
+        self.initial_ceiling = initial_ceiling
+        self.step_seconds = None  # dt of a step when none is passed
+        self.estimates = None
+
+    def reset(self):
+        self.estimates = None
+
+    def _reset(self, shape):
+        # Start from the fixed-gain mapping (0 .. initial_ceiling) and adapt from there.
+        self.estimates = np.zeros((2,) + shape)
+        self.estimates[1] = self.initial_ceiling
+        self.mean = OnePoleEMA(0.0, self.initial_ceiling / 2)
+        self.deviation = OnePoleEMA(0.0, self.initial_ceiling / 4)
+        # The range widens quickly on a louder passage and relaxes slowly: the ceiling attacks
+        # upwards, the floor attacks downwards.
+        self.ceiling = AttackRelease(0.0, 0.0, self.initial_ceiling)
+        self.floor = AttackRelease(0.0, 0.0, 0.0)
+        self.dt = None
+
+    def _set_dt(self, dt):
+        self.dt = dt
+        weight = min(dt / self.window, 1.0)
+        self.mean.factor = self.deviation.factor = weight
+        self.gain = self.rate * weight * self.step_scale.reshape((2,) + (1,) * (self.estimates.ndim - 1))
+        attack = 1.0 - math.exp(-dt / self.attack)
+        release = 1.0 - math.exp(-dt / self.release)
+        self.ceiling.attack, self.ceiling.release = attack, release
+        self.floor.attack, self.floor.release = release, attack
+
+    def process(self, value, dt=None):
+        return self.process_batch(np.asarray(value, dtype=float)[np.newaxis], dt)[0]
+
+    # Takes k consecutive values (steps along axis 0), each dt apart, and returns the output after
+    # each. Every stage steps through all k values in one vectorized pass, so the result is the
+    # same however the values were split into batches.
+    def process_batch(self, values, dt=None):
+        xs = np.asarray(values, dtype=float)
+        if dt is None:
+            dt = self.step_seconds
+        if self.estimates is None or self.estimates.shape[1:] != xs.shape[1:]:
+            self._reset(xs.shape[1:])
+        if dt != self.dt:
+            self._set_dt(dt)
+        deviations = self.deviation.process_batch(np.abs(xs - self.mean.process_batch(xs)))
+        # Quantile step k moves each estimate by steps[k] * (tau - [x[k] < estimate before k]).
+        # As in AttackRelease, guess the comparisons from the current estimates and repeat with
+        # those of the resulting path until they agree.
+        quantiles = self.quantiles.reshape(self.gain.shape)
+        steps = self.gain * np.maximum(deviations, 1e-9)[:, np.newaxis]
+        values_k = xs[:, np.newaxis]
+        below = values_k < self.estimates
+        while True:
+            path = self.estimates + np.cumsum(steps * (quantiles - below), axis=0)
+            if len(xs) == 1:
+                break
+            settled = values_k < np.concatenate((self.estimates[np.newaxis], path[:-1]))
+            if np.array_equal(settled, below):
+                break
+            below = settled
+        self.estimates = path[-1]
+        lows = path[:, 0]
+        highs = np.maximum(path[:, 1], lows + self.min_range)
+        ceilings = self.ceiling.process_batch(highs)
+        floors = self.floor.process_batch(lows)
+        spans = np.maximum(ceilings - floors, self.min_range)
+        return np.clip((xs - floors) / spans, 0.0, 1.0)
 
 
-def apply_decay():
-    global current_gain_db, current_decay_rate, last_decay_ramp_up_time
-    if time.time() - last_decay_ramp_up_time >= DECAY_RAMP_UP_INTERVAL:
-        current_decay_rate = min(current_decay_rate + 1, MAX_DECAY_RATE)
-        last_decay_ramp_up_time = time.time()
-    current_gain_db -= current_decay_rate
-    if current_gain_db < MIN_DB:
-        current_gain_db = MIN_DB
+# -----------------------------
+# Feature Bus
+# -----------------------------
+# Every analysed block becomes one FeatureFrame: the channel-mix samples, their magnitude
+# spectrum, band levels and timestamps, computed once in analyse_blocks. Detectors, modes and
+# outputs read frames from feature_bus instead of transforming the samples again. Frames are
+# published and read on the analysis thread; their arrays are shared and read-only.
+# The spectrogram mode is the one consumer with a transform of its own: its log-frequency rows
+# need SPECTROGRAM_FFT_SIZE-point resolution on a fixed hop, while a frame's spectrum has BUFFER
+# points (344 Hz bins at 128 samples) and its hop follows the block size.
+FEATURE_HISTORY = 64  # Frames kept on the bus; spans ZONE_FFT_SIZE even at 64-sample blocks
+
+
+class FeatureFrame:
+    def __init__(self, seq, capture_time, analysis_time, samples, spectrum, band_weights):
+        self.seq = seq
+        self.capture_time = capture_time  # Block capture time (replay and offline render aware)
+        self.analysis_time = analysis_time  # time.perf_counter() when the frame was computed
+        self.samples = samples  # Channel mix
+        self.spectrum = spectrum  # rfft magnitudes of samples
+        self.band_weights = band_weights
+        self._bands = None
+
+    # Normalised dB (0-1) per FEATURE_BAND_EDGES band. Derived from the spectrum on first use, so
+    # frames nobody asks for (the headless daemon) never pay for it.
+    @property
+    def bands(self):
+        if self._bands is None:
+            self._bands = spectrum_to_db_scale(self.spectrum, len(self.samples)) @ self.band_weights
+            self._bands.flags.writeable = False
+        return self._bands
+
+
+class FeatureBus:
+    def __init__(self, history):
+        self.frames = deque(maxlen=history)
+        self.seq = 0
+        self.band_weights = None  # (block size, rate, bins x bands averaging matrix)
+
+    @property
+    def latest(self):
+        return self.frames[-1] if self.frames else None
+
+    def _band_weights(self, n, rate):
+        if self.band_weights is None or self.band_weights[:2] != (n, rate):
+            band_bins, _ = feature_bins(n, rate)
+            weights = np.zeros((n // 2 + 1, len(band_bins)))
+            for band, bins in enumerate(band_bins):
+                weights[bins, band] = 1.0 / len(bins)
+            self.band_weights = (n, rate, weights)
+        return self.band_weights[2]
+
+    # Publishes one frame per block from blocks x samples mixes and blocks x bins spectra.
+    def publish(self, capture_times, samples, spectra, rate):
+        band_weights = self._band_weights(samples.shape[1], rate)
+        analysis_time = time.perf_counter()
+        samples.flags.writeable = False
+        spectra.flags.writeable = False
+        for i, capture_time in enumerate(capture_times):
+            self.seq += 1
+            self.frames.append(FeatureFrame(self.seq, capture_time, analysis_time, samples[i], spectra[i], band_weights))
+
+    # The newest `count` mixed samples across the history, zero-padded while it is still short.
+    # Iterates a snapshot: the output scheduler thread reads while analysis appends.
+    def recent_samples(self, count):
+        parts = []
+        total = 0
+        for frame in reversed(tuple(self.frames)):
+            if total >= count:
+                break
+            parts.append(frame.samples)
+            total += len(frame.samples)
+        if total < count:
+            parts.append(np.zeros(count - total, dtype=np.float32))
+        return np.concatenate(parts[::-1])[-count:]
+
+
+feature_bus = FeatureBus(FEATURE_HISTORY)
 
 
 # -----------------------------
 # Process Audio Queue on Main Thread
 # -----------------------------
-BRIGHTNESS_GAIN = 1.6  # Boost factor for brightness/glow calculation
+BRIGHTNESS_GAIN = 1.6  # Boost factor for brightness/glow calculation (fixed gain when AGC is off)
+
+# Smoothing chain. Every stage runs on one vector per step: index 0 is the channel mix, the
+# rest are the input channels. The per-block values hold for blocks of TUNED_BLOCK_SECONDS.
+SMOOTHING_WINDOW = 10  # Blocks averaged for the detection value
+DB_SMOOTHING = 0.2  # EMA factor per block for the dB readings
+DB_PEAK_DECAY = 0.05  # dB per block the held peak falls (about 17 dB/s at 128 samples)
+DISPLAY_GLOW_SMOOTHING = 0.05  # EMA factor per rendered frame for the on-screen glow
+
+
+# Detection to glow: the running mean of the detection, then the AGC. Without AGC the chain ends
+# at the mean and the caller applies BRIGHTNESS_GAIN.
+def build_glow_chain(block_size, rate):
+    smoother = RunningMean(scaled_block_count(SMOOTHING_WINDOW, block_size, rate))
+    if not AGC_ENABLED:
+        return FilterChain(smoother)
+    agc = StreamingQuantileAGC(AGC_LOW_QUANTILE, AGC_HIGH_QUANTILE, AGC_WINDOW_SECONDS, AGC_QUANTILE_RATE,
+                               AGC_ATTACK, AGC_RELEASE, AGC_MIN_RANGE, 100 / BRIGHTNESS_GAIN)
+    agc.step_seconds = block_size / rate
+    return FilterChain(smoother, agc)
+
 
+# Builds the per-block stages for the stream's block period, rescaled so the smoothing window,
+# dB time constant and peak fall rate stay the same in seconds.
+def build_block_smoothers(block_size, rate):
+    global glow_chain, db_smoother, db_peak_hold
+    scale = block_size / rate / TUNED_BLOCK_SECONDS
+    glow_chain = build_glow_chain(block_size, rate)
+    db_smoother = OnePoleEMA(1.0 - (1.0 - DB_SMOOTHING) ** scale, NOISE_FLOOR)
+    db_peak_hold = PeakHold(DB_PEAK_DECAY * scale, NOISE_FLOOR)
 
-def process_audio_queue(dt):
-    global waveform_data, latest_audio_data, glow_value, last_update_time, last_packet_time, hue_value
-    global current_gain_db, smoothing_buffer, left_channel_amplitude, right_channel_amplitude
+
+build_block_smoothers(BUFFER, RATE)
+display_glow_smoother = OnePoleEMA(DISPLAY_GLOW_SMOOTHING)
+
+
+def process_audio_queue(wait=0.0, min_blocks=1):
     try:
-        while not audio_queue.empty():
-            audio_data = audio_queue.get()
-            waveform_data = audio_data
-            latest_audio_data = audio_data.copy()
-
-            current_time = time.time()
-
-            # If stereo (more than one channel), compute separate amplitudes
-            if audio_data.ndim > 1 and audio_data.shape[1] >= 2:
-                left_channel_amplitude = np.max(np.abs(audio_data[:, 0]))
-                right_channel_amplitude = np.max(np.abs(audio_data[:, 1]))
-                # Combine channels by averaging for overall detection:
-                combined_audio = np.mean(audio_data, axis=1)
-            else:
-                combined_audio = audio_data
-                left_channel_amplitude = np.max(np.abs(audio_data))
-                right_channel_amplitude = np.max(np.abs(audio_data))
-
-            # dB reading based on peak amplitude from the combined signal
-            peak_value = np.max(np.abs(combined_audio))
-            display_db = 20 * np.log10(peak_value) if peak_value > 0 else -100
-            smooth_db_value(display_db)
-
-            # Brightness/glow computed from FFT-based detection on the combined signal
-            detection_value = detect_frequencies(combined_audio, RATE, TARGET_FREQS)
-            smoothing_buffer.append(detection_value)
-            smoothed_value = np.mean(smoothing_buffer) if smoothing_buffer else 0
-            new_glow_value = min((smoothed_value * BRIGHTNESS_GAIN / 100) * control_sensitivity, 1.0)
-
-            if current_time - last_update_time >= UPDATE_INTERVAL:
-                last_update_time = current_time
-            glow_value = new_glow_value
-
-            if current_time - last_packet_time >= PACKET_SEND_INTERVAL:
-                send_lifx_color(glow_value, hue_value)
-                last_packet_time = current_time
+        metric_queue_depth.set(audio_queue.qsize())
+        # Headless callers block for min_blocks blocks (fewer wake-ups per second); the render
+        # loop never waits.
+        try:
+            pending = [audio_queue.get(timeout=wait) if wait else audio_queue.get_nowait()]
+        except Empty:
+            return
+        while wait and len(pending) < min_blocks:
+            try:
+                pending.append(audio_queue.get(timeout=wait))
+            except Empty:
+                break
+        # Drain the backlog. Blocks that piled up during a long frame are analysed together in
+        # one vectorized pass, and only the newest state is published.
+        while True:
+            try:
+                pending.append(audio_queue.get_nowait())
+            except Empty:
+                break
+        if output_scheduler.stepped:
+            # Replay steps the output schedule after every block, so each tick sees the same
+            # state no matter how many blocks were queued.
+            for block in pending:
+                analyse_blocks([block])
+        else:
+            analyse_blocks(pending)
     except Exception as e:
         logging.error(f"Error in process_audio_queue: {e}")
 
 
+# Analyses (capture time, samples) blocks in one pass and publishes the state after the newest.
+def analyse_blocks(pending):
+    global glow_value, current_gain_db, current_gain_db_smoothed
+    global channel_glow_values, channel_db_smoothed, bass_front_end
+    block_time = pending[-1][0]
+    analysis_start = time.perf_counter()
+    flight_recorder.record(EV_ANALYSIS, PHASE_BEGIN, len(pending))
+    # blocks x samples x channels
+    audio_blocks = np.stack([data if data.ndim == 2 else data[:, np.newaxis] for _, data in pending])
+    # Combine channels by averaging for overall detection and the waveform views:
+    combined_blocks = np.add.reduce(audio_blocks, axis=2) * (1.0 / audio_blocks.shape[2])
+
+    # Per-channel peak amplitudes
+    channel_peaks = np.max(np.abs(audio_blocks), axis=1)
+
+    # dB readings from the peak amplitude of the combined signal and of each channel
+    peaks = np.column_stack((np.max(np.abs(combined_blocks), axis=1), channel_peaks))
+    levels_db = 20 * np.log10(np.maximum(peaks, 1e-5))
+    smoothed_db = db_smoother.process_batch(levels_db)[-1]
+    current_gain_db_smoothed = smoothed_db[0]
+    channel_db_smoothed = smoothed_db[1:]
+    current_gain_db = db_peak_hold.process_batch(levels_db)[-1, 0]
+
+    # One batched rfft over all blocks and channels; the spectrum of the channel mean is the
+    # mean of the complex channel spectra, so the combined signal needs no extra FFT.
+    channel_spectra = np.fft.rfft(audio_blocks, axis=1)
+    block_spectra = np.abs(np.add.reduce(channel_spectra, axis=2) * (1.0 / audio_blocks.shape[2]))
+    feature_bus.publish([capture_time for capture_time, _ in pending], combined_blocks, block_spectra, RATE)
+    if bass_front_end is None or bass_front_end.channels != audio_blocks.shape[2]:
+        bass_front_end = BassFrontEnd(RATE, audio_blocks.shape[2])
+    detection_values, channel_detection = bass_front_end.process_batch(audio_blocks)
+    onset = onset_tracker.process_blocks(block_spectra)
+    glows = glow_chain.process_batch(np.column_stack((detection_values, channel_detection)))[-1]
+    if not AGC_ENABLED:
+        glows = glows * BRIGHTNESS_GAIN / 100
+    glows = np.minimum(glows * control_sensitivity, 1.0)
+    glow_value = float(glows[0])
+    channel_glow_values = glows[1:]
+
+    publish_features(feature_bus.latest)
+    if active_mode is not None:
+        active_mode.feed(combined_blocks.ravel())
+    metric_analysis_time.observe(time.perf_counter() - analysis_start)
+    flight_recorder.record(EV_ANALYSIS, PHASE_END, glow_value)
+
+    # Packets leave from the output scheduler; analysis only hands over onsets and beats.
+    if onset:
+        output_scheduler.onset_pending = True
+    if PREDICTIVE_TRIGGER:
+        schedule_predicted_beat(block_time)
+    output_scheduler.advance(block_time)
+
+
+# -----------------------------
+# Additional Audio Inputs
+# -----------------------------
+# Every entry of EXTRA_INPUTS gets its own capture stream, queue and analysis thread, so inputs
+# are analysed in parallel and a slow one never holds up the others or the main input. They run
+# at the main stream's sample rate and block size and follow the shared sensitivity and hue.
+EXTRA_INPUT_QUEUE_SIZE = 16
+EXTRA_INPUT_QUEUE_TIMEOUT = 0.5  # Longest wait for a block before checking for shutdown
+
+
+class AudioInput:
+    def __init__(self, name, device, channels, lights, region):
+        self.name = name
+        self.device = device
+        self.channels = channels
+        self.lights = lights
+        self.region = region
+        self.queue = Queue(maxsize=EXTRA_INPUT_QUEUE_SIZE)
+        self.front_end = BassFrontEnd(RATE, channels)
+        self.glow_chain = build_glow_chain(BUFFER, RATE)
+        self.display_smoother = OnePoleEMA(DISPLAY_GLOW_SMOOTHING)
+        self.planner = KeyframePlanner()
+        self.glow = 0.0
+        self.display_glow = 0.0
+        self.gain_db = float(NOISE_FLOOR)
+        self.dropped = 0
+        self.stream = None
+        self.thread = None
+        self.running = False
+
+    def callback(self, indata, frames, time_info, status):
+        if not self.queue.full():
+            self.queue.put(indata.copy())
+        else:
+            self.dropped += 1
+
+    # Opens the stream before starting the worker so a device that cannot be opened leaves no thread
+    # behind; a stream that opens but fails to start is torn down through stop().
+    def start(self):
+        self.stream = sd.InputStream(device=self.device, samplerate=RATE, blocksize=BUFFER, channels=self.channels,
+                                     latency=STREAM_LATENCY, callback=self.callback)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=f"input-{self.name}", daemon=True)
+        self.thread.start()
+        try:
+            self.stream.start()
+        except Exception:
+            self.stop()
+            raise
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.dropped:
+            logging.info(f"Input {self.name}: {self.dropped} block(s) dropped")
+
+    def _run(self):
+        while self.running:
+            try:
+                audio_data = self.queue.get(timeout=EXTRA_INPUT_QUEUE_TIMEOUT)
+            except Empty:
+                continue
+            try:
+                self.analyze(audio_data)
+            except Exception as e:
+                logging.error(f"Error in input {self.name}: {e}")
+
+    # The same chain as process_audio_queue, on the channel mix only.
+    def analyze(self, audio_data):
+        if audio_data.ndim == 1:
+            audio_data = audio_data[:, np.newaxis]
+        detection_value, _ = self.front_end.process(audio_data)
+        glow = self.glow_chain.process(detection_value)
+        if not AGC_ENABLED:
+            glow = glow * BRIGHTNESS_GAIN / 100
+        self.glow = float(min(glow * control_sensitivity, 1.0))
+        self.gain_db = 20 * math.log10(max(float(np.max(np.abs(audio_data))), 1e-5))
+
+
+def open_extra_input(device, lights, region):
+    info = sd.query_devices(device, kind="input")
+    channels = max(1, min(INPUT_CHANNELS, info["max_input_channels"]))
+    group = [lifxlan.Light(mac, ip) for mac, ip in lights] if LIFX_ENABLED else []
+    audio_input = AudioInput(info["name"], info["index"], channels, group, region)
+    audio_input.start()
+    return audio_input
+
+
+# Opens every EXTRA_INPUTS entry once the main stream's rate and block size are final. An input
+# that cannot be opened is logged and left out; the others keep running.
+def start_extra_inputs():
+    for device, lights, region in EXTRA_INPUTS:
+        try:
+            audio_input = open_extra_input(device, lights, region)
+        except Exception as e:
+            logging.error(f"Could not open input {device!r}: {e}")
+            continue
+        extra_inputs.append(audio_input)
+        print(f"Input {audio_input.name}: {audio_input.channels} channel(s), {len(audio_input.lights)} light(s)")
+
+
+def stop_extra_inputs():
+    for audio_input in extra_inputs:
+        audio_input.stop()
+
+
+# -----------------------------
+# WebSocket Feature Server
+# -----------------------------
+# Streams compact binary feature frames to browser visualizers (index.html) so one analysis
+# drives any number of screens. Plain HTTP requests to the same port are served index.html.
+FEATURE_SERVER_ENABLED = False
+FEATURE_SERVER_HOST = "127.0.0.1"  # Use "0.0.0.0" to serve other machines on the network
+FEATURE_SERVER_PORT = 8765
+FEATURE_SERVER_MAX_FPS = 60  # Feature frames published per second
+FEATURE_SEND_SPECTRUM = True  # Include the optional log-frequency spectrum in each frame
+FEATURE_SPECTRUM_BINS = 64
+FEATURE_BAND_EDGES = [20, 60, 150, 400, 1000, 2500, 6000, 16000]  # Hz, one band between each pair
+
+# Frame layout (little-endian): magic "VBS1", flags u8 (bit 0 = spectrum present), band count u8,
+# spectrum bin count u16, sequence u32, timestamp f64, glow f32, hue f32, dB f32,
+# then bands as f32 (0-1) and the spectrum as u8 (-100..0 dB mapped to 0..255).
+FEATURE_FRAME_HEADER = struct.Struct("<4sBBHIdfff")
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WEBSOCKET_MAX_PAYLOAD = 4096  # Clients only send control frames; anything larger is refused with 1009
+
+
+def spectrum_to_db_scale(magnitudes, n):
+    # Normalised dB (0 at -100 dB, 1 at 0 dB) of rfft magnitudes of an n-sample block.
+    db = 20 * np.log10(np.maximum(magnitudes * (2.0 / n), 1e-5))
+    return np.clip((db + 100.0) / 100.0, 0.0, 1.0)
+
+
+def feature_bins(n, rate):
+    freqs = np.fft.rfftfreq(n, 1.0 / rate)
+    band_bins = [np.nonzero((freqs >= lo) & (freqs < hi))[0] for lo, hi in zip(FEATURE_BAND_EDGES, FEATURE_BAND_EDGES[1:])]
+    # Fall back to the nearest bin when a band is narrower than the FFT resolution.
+    band_bins = [b if len(b) else np.array([np.argmin(np.abs(freqs - lo))]) for b, lo in zip(band_bins, FEATURE_BAND_EDGES)]
+    log_freqs = np.geomspace(FEATURE_BAND_EDGES[0], min(FEATURE_BAND_EDGES[-1], rate / 2), FEATURE_SPECTRUM_BINS)
+    spectrum_bins = np.clip(np.searchsorted(freqs, log_freqs), 0, len(freqs) - 1)
+    return band_bins, spectrum_bins
+
+
+def pack_feature_frame(seq, frame, glow, hue, db, rate):
+    global feature_bin_cache
+    n = len(frame.samples)
+    bands = frame.bands.astype("<f4")
+    if FEATURE_SEND_SPECTRUM:
+        if feature_bin_cache is None or feature_bin_cache[0] != (n, rate):
+            feature_bin_cache = ((n, rate), feature_bins(n, rate)[1])
+        scaled = spectrum_to_db_scale(frame.spectrum[feature_bin_cache[1]], n)
+        spectrum = (scaled * 255).astype(np.uint8)
+    else:
+        spectrum = np.zeros(0, np.uint8)
+    header = FEATURE_FRAME_HEADER.pack(b"VBS1", 1 if FEATURE_SEND_SPECTRUM else 0, len(bands), len(spectrum),
+                                       seq & 0xFFFFFFFF, frame.capture_time, glow, hue, db)
+    return header + bands.tobytes() + spectrum.tobytes()
+
+
+feature_bin_cache = None
+
+
+def websocket_frame(payload, opcode=0x2):
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def recv_exact(sock, count):
+    data = b""
+    while len(data) < count:
+        chunk = sock.recv(count - len(data))
+        if not chunk:
+            raise ConnectionError("client closed the connection")
+        data += chunk
+    return data
+
+
+# Raised for a client frame the server will not accept; the connection is closed with `status`.
+class WebSocketProtocolError(Exception):
+    def __init__(self, status, reason):
+        super().__init__(reason)
+        self.status = status
+
+
+def read_websocket_frame(sock):
+    first, second = recv_exact(sock, 2)
+    opcode = first & 0x0F
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", recv_exact(sock, 2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", recv_exact(sock, 8))[0]
+    if not first & 0x80 or opcode == 0x0:
+        raise WebSocketProtocolError(1002, "fragmented frames are not supported")
+    if length > WEBSOCKET_MAX_PAYLOAD:
+        raise WebSocketProtocolError(1009, f"frame of {length} bytes exceeds {WEBSOCKET_MAX_PAYLOAD}")
+    mask = recv_exact(sock, 4) if second & 0x80 else None
+    payload = recv_exact(sock, length)
+    if mask:
+        payload = (np.frombuffer(payload, dtype=np.uint8) ^ np.resize(np.frombuffer(mask, dtype=np.uint8), length)).tobytes()
+    return opcode, payload
+
+
+class FeatureClient:
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.condition = threading.Condition()
+        self.pending = None  # Only the newest frame is kept; older unsent frames are dropped
+        self.closed = False
+        self.sent_frames = 0
+        self.dropped_frames = 0
+
+    def offer(self, payload):
+        with self.condition:
+            if self.pending is not None:
+                self.dropped_frames += 1
+            self.pending = payload
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+
+class FeatureServer:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.clients = []
+        self.clients_lock = threading.Lock()
+        self.listener = None
+        self.running = False
+
+    def start(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((self.host, self.port))
+        self.listener.listen(16)
+        self.running = True
+        threading.Thread(target=self._accept_loop, name="feature-server", daemon=True).start()
+        logging.info(f"Feature server listening on http://{self.host}:{self.port}/")
+
+    def stop(self):
+        self.running = False
+        try:
+            self.listener.close()
+        except OSError:
+            pass
+        with self.clients_lock:
+            for client in self.clients:
+                client.close()
+
+    def publish(self, payload):
+        with self.clients_lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.offer(payload)
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                sock, address = self.listener.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve_client, args=(sock, address), daemon=True).start()
+
+    def _serve_client(self, sock, address):
+        try:
+            request = b""
+            while b"\r\n\r\n" not in request and len(request) < 8192:
+                chunk = sock.recv(1024)
+                if not chunk:
+                    return
+                request += chunk
+            lines = request.decode("latin-1").split("\r\n")
+            headers = {k.strip().lower(): v.strip() for k, _, v in (line.partition(":") for line in lines[1:] if line)}
+            if headers.get("upgrade", "").lower() != "websocket":
+                self._serve_page(sock, lines[0])
+                return
+            accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + WEBSOCKET_GUID).encode()).digest())
+            sock.sendall(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                         b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, KeyError) as e:
+            logging.warning(f"Feature server handshake with {address} failed: {e}")
+            sock.close()
+            return
+
+        client = FeatureClient(sock, address)
+        with self.clients_lock:
+            self.clients.append(client)
+        logging.info(f"Feature client connected: {address}")
+        try:
+            self._client_loop(client)
+        except (OSError, ConnectionError):
+            pass
+        finally:
+            with self.clients_lock:
+                self.clients.remove(client)
+            sock.close()
+            logging.info(f"Feature client {address} disconnected ({client.sent_frames} sent, "
+                         f"{client.dropped_frames} dropped)")
+
+    def _client_loop(self, client):
+        while self.running:
+            with client.condition:
+                client.condition.wait_for(lambda: client.pending is not None or client.closed, timeout=0.5)
+                payload, client.pending = client.pending, None
+                if client.closed:
+                    return
+            if payload is not None:
+                # A slow client only blocks its own thread; frames published meanwhile replace `pending`.
+                client.sock.sendall(websocket_frame(payload))
+                client.sent_frames += 1
+            while select.select([client.sock], [], [], 0)[0]:
+                try:
+                    opcode, data = read_websocket_frame(client.sock)
+                except WebSocketProtocolError as e:
+                    logging.warning(f"Feature client {client.address}: {e}")
+                    client.sock.sendall(websocket_frame(struct.pack("!H", e.status), opcode=0x8))
+                    return
+                if opcode == 0x8:
+                    client.sock.sendall(websocket_frame(data[:2], opcode=0x8))
+                    return
+                if opcode == 0x9:
+                    client.sock.sendall(websocket_frame(data, opcode=0xA))
+
+    def _serve_page(self, sock, request_line):
+        path = request_line.split(" ")[1] if request_line.count(" ") >= 2 else "/"
+        page = os.path.join(os.path.dirname(os.path.abspath(__file__)), "index.html")
+        try:
+            if path.split("?")[0] not in ("/", "/index.html"):
+                raise FileNotFoundError(path)
+            with open(page, "rb") as f:
+                body = f.read()
+            status = b"200 OK"
+        except OSError:
+            body = b"Not found"
+            status = b"404 Not Found"
+        sock.sendall(b"HTTP/1.1 " + status + b"\r\nContent-Type: text/html; charset=utf-8\r\nContent-Length: " +
+                     str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+        sock.close()
+
+
+feature_server = None
+feature_frame_seq = 0
+last_feature_time = 0.0
+
+
+def publish_features(frame):
+    global feature_frame_seq, last_feature_time
+    if feature_server is None or frame.capture_time - last_feature_time < 1.0 / FEATURE_SERVER_MAX_FPS:
+        return
+    last_feature_time = frame.capture_time
+    feature_frame_seq += 1
+    feature_server.publish(pack_feature_frame(feature_frame_seq, frame, glow_value, hue_value,
+                                              current_gain_db_smoothed, RATE))
+
+
+# -----------------------------
+# Predictive Beat Triggering
+# -----------------------------
+last_fired_beat = None
+beat_hold_until = 0.0
+beat_hue_steps = Queue()  # Hue jumps of fired beats, applied by the thread that advances hue_value
+
+
+# Called after each analysed block: converts the predicted beat into a send deadline for the
+# output scheduler. The deadline is refined block by block until the beat has fired.
+def schedule_predicted_beat(capture_time):
+    to_beat = onset_tracker.seconds_to_next_beat()
+    beat = onset_tracker.beat_id()
+    if to_beat is None or beat == last_fired_beat:
+        return
+    if output_scheduler.stepped:
+        # Replay runs the schedule on the recorded capture clock, where the live stream and
+        # send latencies do not exist.
+        output_scheduler.schedule_beat(capture_time + to_beat - OUTPUT_LATENCY, beat)
+        return
+    # The newest processed audio is already input_latency old, and a packet sent now
+    # lands after the measured send latency plus the bulb's own processing time.
+    input_latency = getattr(stream, "latency", 0.0) or 0.0
+    lead = lifx_send_latency + OUTPUT_LATENCY
+    output_scheduler.schedule_beat(time.perf_counter() + to_beat - input_latency - lead, beat)
+
+
+# Runs on the output scheduler thread when a beat deadline is reached.
+def fire_predicted_beat(beat, now):
+    global last_fired_beat, beat_hold_until
+    last_fired_beat = beat
+    flight_recorder.record(EV_BEAT, PHASE_INSTANT, onset_tracker.bpm)
+    flash_hue = hue_value
+    if not manual_hue:
+        flash_hue = (hue_value + BEAT_HUE_STEP) % 1.0
+        beat_hue_steps.put(BEAT_HUE_STEP)
+    for lights, glow, planner in lifx_output_targets():
+        flash_glow = max(glow, BEAT_FLASH_GLOW)
+        for light in lights:
+            send_lifx_color(flash_glow, flash_hue, retries=1, light=light, acknowledged=False)
+        planner.mark_sent(flash_glow, flash_hue, now, 0.0)
+    beat_hold_until = now + BEAT_HOLD_TIME
+
+
+def apply_beat_hue_steps():
+    global hue_value
+    while True:
+        try:
+            step = beat_hue_steps.get_nowait()
+        except Empty:
+            return
+        hue_value = (hue_value + step) % 1.0
+
+
+# -----------------------------
+# LIFX Output Scheduler
+# -----------------------------
+# Sends on a fixed cadence from its own thread, independent of when audio blocks arrive or how
+# long a frame takes. Each tick has an absolute deadline on the monotonic perf_counter clock and
+# sends the freshest analysis state; a tick that overruns skips the deadlines it missed instead
+# of bursting to catch up. Predicted beats get their own deadline between ticks. Packets go out
+# unacknowledged with a single attempt, so a lost packet or an unreachable bulb never holds up
+# the cadence.
+#
+# During session replay there is no thread: process_audio_queue steps the schedule to each
+# block's capture time, so ticks and beats land on the same blocks on every replay.
+OUTPUT_JITTER_WINDOW = 2000  # Recent ticks kept for the jitter report
+OUTPUT_REPORT_INTERVAL = 60.0  # Seconds between jitter reports in the log (0 = only at shutdown)
+
+
+class OutputScheduler:
+    def __init__(self, interval):
+        self.interval = interval
+        self.wake = threading.Event()
+        self.running = False
+        self.thread = None
+        self.beat = None  # (deadline, beat id) of the next predicted beat
+        self.onset_pending = False  # Set by analysis, consumed by the next keyframe tick
+        self.lateness = deque(maxlen=OUTPUT_JITTER_WINDOW)  # Tick start minus its deadline (seconds)
+        self.spacing = deque(maxlen=OUTPUT_JITTER_WINDOW)  # Time between consecutive tick starts
+        self.ticks = 0
+        self.missed = 0
+        self.last_report = 0.0
+        self.next_tick = None
+        self.last_start = None
+        self.stepped = False  # Driven by advance() on recorded capture times instead of a thread
+
+    def start(self):
+        self.running = True
+        if session_replay is not None:
+            self.stepped = True
+            return
+        self.thread = threading.Thread(target=self._run, name="lifx-output", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.stepped:
+            self.running = False
+            logging.info(self.report())
+            return
+        if self.thread is None:
+            return
+        self.running = False
+        self.wake.set()
+        self.thread.join()
+        self.thread = None
+        logging.info(self.report())
+
+    def schedule_beat(self, deadline, beat):
+        previous = self.beat
+        self.beat = (deadline, beat)
+        if previous is None or deadline < previous[0]:
+            self.wake.set()
+
+    # Replay: runs whatever fell due up to the capture time of the newest analysed block.
+    def advance(self, now):
+        if not (self.stepped and self.running):
+            return
+        if self.next_tick is None:
+            self.next_tick = self.last_report = now
+        self._step(now)
+
+    def _run(self):
+        self.next_tick = self.last_report = time.perf_counter()
+        while self.running:
+            beat = self.beat
+            deadline = self.next_tick if beat is None else min(self.next_tick, beat[0])
+            remaining = deadline - time.perf_counter()
+            if remaining > 0:
+                self.wake.wait(remaining)
+                self.wake.clear()
+                continue
+            self._step(time.perf_counter())
+
+    # Fires a due beat and the due tick at `now`, then moves the tick deadline past `now`.
+    def _step(self, now):
+        beat = self.beat
+        if beat is not None and beat[0] <= now:
+            self.beat = None
+            if beat[1] != last_fired_beat:
+                fire_predicted_beat(beat[1], now)
+        if now < self.next_tick:
+            return
+        lateness = now - self.next_tick
+        self.lateness.append(lateness)
+        metric_output_lateness.observe(lateness)
+        if self.last_start is not None:
+            self.spacing.append(now - self.last_start)
+        self.last_start = now
+        self.ticks += 1
+        try:
+            self._tick(now)
+        except Exception as e:
+            logging.error(f"Error in output scheduler: {e}")
+        self.next_tick += self.interval
+        # A stepped schedule spends no time on its clock while sending.
+        behind = (now if self.stepped else time.perf_counter()) - self.next_tick
+        if behind >= 0:
+            skipped = int(behind / self.interval) + 1
+            self.missed += skipped
+            metric_output_missed.inc(skipped)
+            self.next_tick += skipped * self.interval
+        if OUTPUT_REPORT_INTERVAL and now - self.last_report >= OUTPUT_REPORT_INTERVAL:
+            self.last_report = now
+            logging.info(self.report())
+
+    def _tick(self, now):
+        if zone_outputs:
+            update_zone_outputs(now)
+        if now < beat_hold_until:
+            return
+        if LIFX_OUTPUT_MODE == "keyframe":
+            onset = self.onset_pending
+            self.onset_pending = False
+            for lights, glow, planner in lifx_output_targets():
+                keyframe = planner.plan(glow, hue_value, now, onset)
+                if keyframe is not None:
+                    for light in lights:
+                        send_lifx_color(keyframe[0], keyframe[1], retries=1, duration=keyframe[2], light=light,
+                                        acknowledged=False)
+        else:
+            for lights, glow, _ in lifx_output_targets():
+                for light in lights:
+                    send_lifx_color(glow, hue_value, retries=1, light=light, acknowledged=False)
+
+    def jitter_stats(self):
+        if not self.lateness:
+            return None
+        lateness = np.array(self.lateness) * 1000
+        spacing = np.array(self.spacing) * 1000 if self.spacing else np.zeros(1)
+        return {"ticks": self.ticks, "missed": self.missed, "late_p50_ms": np.percentile(lateness, 50),
+                "late_p99_ms": np.percentile(lateness, 99), "late_max_ms": lateness.max(),
+                "spacing_mean_ms": spacing.mean(), "spacing_std_ms": spacing.std()}
+
+    def report(self):
+        stats = self.jitter_stats()
+        if stats is None:
+            return "Output scheduler: no ticks"
+        return (f"Output scheduler: {stats['ticks']} ticks every {self.interval * 1000:.1f} ms, "
+                f"{stats['missed']} missed; lateness p50 {stats['late_p50_ms']:.2f} ms, "
+                f"p99 {stats['late_p99_ms']:.2f} ms, max {stats['late_max_ms']:.2f} ms; "
+                f"spacing {stats['spacing_mean_ms']:.2f} +/- {stats['spacing_std_ms']:.2f} ms")
+
+
+output_scheduler = OutputScheduler(PACKET_SEND_INTERVAL)
+
+
+# -----------------------------
+# LIFX Keyframe Planning
+# -----------------------------
+# "immediate" sends the current glow every PACKET_SEND_INTERVAL; "keyframe" sends sparse
+# keyframes with a transition duration and lets the bulb interpolate between them.
+LIFX_OUTPUT_MODE = "immediate"
+KEYFRAME_MIN_INTERVAL = 0.08  # Shortest spacing between two gliding keyframes (seconds)
+KEYFRAME_MAX_INTERVAL = 0.25  # Longest a changed envelope waits before a new keyframe (seconds)
+KEYFRAME_TOLERANCE = 0.04  # Glow deviation from the bulb's target that forces a new keyframe
+KEYFRAME_HUE_TOLERANCE = 0.02  # Hue deviation (0-1 circle) that forces a new keyframe
+KEYFRAME_ONSET_RISE = 0.25  # Glow jump above the bulb's current level treated as a sharp onset
+
+
+class KeyframePlanner:
+    def __init__(self):
+        self.sent_time = -math.inf
+        self.start_glow = 0.0
+        self.target_glow = 0.0
+        self.target_hue = 0.0
+        self.duration = 0.0
+
+    # Glow the bulb is showing right now, assuming it interpolates linearly to the last keyframe.
+    def bulb_glow(self, now):
+        if self.duration <= 0:
+            return self.target_glow
+        progress = min((now - self.sent_time) / self.duration, 1.0)
+        return self.start_glow + (self.target_glow - self.start_glow) * progress
+
+    def mark_sent(self, glow, hue, now, duration):
+        self.start_glow = self.bulb_glow(now)
+        self.target_glow = glow
+        self.target_hue = hue
+        self.duration = duration
+        self.sent_time = now
+
+    # Returns (glow, hue, duration) when a keyframe should be sent now, otherwise None.
+    def plan(self, glow, hue, now, onset=False):
+        elapsed = now - self.sent_time
+        if onset or glow - self.bulb_glow(now) >= KEYFRAME_ONSET_RISE:
+            self.mark_sent(glow, hue, now, 0.0)
+            return glow, hue, 0.0
+        if elapsed < KEYFRAME_MIN_INTERVAL:
+            return None
+        glow_error = abs(glow - self.target_glow)
+        hue_error = abs((hue - self.target_hue + 0.5) % 1.0 - 0.5)
+        changed = glow_error > 1.0 / 256 or hue_error > 1.0 / 1024
+        if glow_error > KEYFRAME_TOLERANCE or hue_error > KEYFRAME_HUE_TOLERANCE or (
+                changed and elapsed >= KEYFRAME_MAX_INTERVAL):
+            # Glide over roughly the spacing the envelope needed to drift this far.
+            duration = min(max(elapsed, KEYFRAME_MIN_INTERVAL), KEYFRAME_MAX_INTERVAL)
+            self.mark_sent(glow, hue, now, duration)
+            return glow, hue, duration
+        return None
+
+
+keyframe_planner = KeyframePlanner()
+channel_keyframe_planners = {channel: KeyframePlanner() for channel in CHANNEL_LIGHT_GROUPS}
+
+
+# (lights, glow, planner) for the main bulb, every channel-mapped light group and every extra input.
+def lifx_output_targets():
+    if not LIFX_ENABLED:
+        return []
+    targets = [(lifx_lights or [bulb], glow_value, keyframe_planner)]
+    for channel, lights in channel_light_groups.items():
+        if channel < len(channel_glow_values):
+            targets.append((lights, channel_glow_values[channel], channel_keyframe_planners[channel]))
+    for audio_input in extra_inputs:
+        if audio_input.lights:
+            targets.append((audio_input.lights, audio_input.glow, audio_input.planner))
+    return targets
+
+
 # -----------------------------
 # Corrected LIFX Color Sending Function
 # -----------------------------
-def send_lifx_color(glow, hue, retries=3):
+lifx_send_latency = 0.0  # Smoothed duration of a successful set_color call (seconds)
+LIFX_LATENCY_SMOOTHING = 0.1
+
+
+lifx_missing_warned = False
+# Acknowledged sends go through lifxlan and wait for the bulb's ack. Unacknowledged sends are
+# packed with struct and leave through one shared socket, a fraction of the CPU per packet; at a
+# steady packet rate a lost packet is simply superseded by the next one. The output scheduler
+# always sends unacknowledged; LIFX_ACKNOWLEDGED is the default for other callers.
+LIFX_ACKNOWLEDGED = True
+lifx_socket = None
+
+
+def send_unacknowledged_packet(light, packet):
+    global lifx_socket
+    if lifx_socket is None:
+        lifx_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    lifx_socket.sendto(packet, (light.ip_addr, light.port))
+
+
+def send_unacknowledged_color(light, color, duration_ms):
+    target = bytes.fromhex(light.mac_addr.replace(":", ""))
+    payload = struct.pack("<B4HI", 0, *color, duration_ms)
+    send_unacknowledged_packet(light, encode_lifx_message(MSG_LIGHT_SET_COLOR, target, light.source_id, 0, payload))
+
+
+def send_lifx_color(glow, hue, retries=3, duration=0.0, light=None, acknowledged=None):
+    global lifx_send_latency, lifx_missing_warned
+    if acknowledged is None:
+        acknowledged = LIFX_ACKNOWLEDGED
+    if light is None:
+        light = bulb
     # If no light is available, skip sending color.
-    if bulb is None:
-        logging.warning("No LIFX bulb available; skipping color update.")
+    if light is None:
+        metric_lifx_skipped.inc()
+        if not lifx_missing_warned:
+            lifx_missing_warned = True
+            logging.warning("No LIFX bulb available; skipping color updates.")
         return
 
-    brightness = max(int(glow * control_sensitivity * 65535), int(control_brightness_floor * 65535))
-    lifx_hue = int(hue * 65535) % 65535
-    saturation = 65535
-    kelvin = 3500
+    color = hsbk_color(hue, max(glow * control_sensitivity, control_brightness_floor))
     for attempt in range(retries):
         try:
-            bulb.set_color([lifx_hue, saturation, brightness, kelvin])
-            logging.info(f"Sent LIFX color: hue={lifx_hue}, brightness={brightness}")
+            send_start = time.perf_counter()
+            flight_recorder.record(EV_PACKET, PHASE_BEGIN, color[2])
+            if acknowledged:
+                light.set_color(color, duration=int(duration * 1000))
+            else:
+                send_unacknowledged_color(light, color, int(duration * 1000))
+            send_time = time.perf_counter() - send_start
+            lifx_send_latency += LIFX_LATENCY_SMOOTHING * (send_time - lifx_send_latency)
+            metric_lifx_send_time.observe(send_time)
+            metric_lifx_packets.inc()
+            flight_recorder.record(EV_PACKET, PHASE_END, color[0])
+            mark_startup("first packet")
             return
         except Exception as e:
+            metric_lifx_errors.inc()
+            flight_recorder.record(EV_PACKET_FAILED, PHASE_INSTANT, attempt + 1)
             logging.error(f"Error on attempt {attempt + 1}: {e}")
-            time.sleep(0.1)
+            if attempt + 1 < retries:
+                time.sleep(0.1)
+    metric_lifx_failures.inc()
     logging.error(f"Failed to send color to LIFX after {retries} attempts")
 
 
+# -----------------------------
+# LIFX Multizone & Tile Output
+# -----------------------------
+# Each strip or tile chain gets one colour per zone from a log-frequency spectrum and is updated
+# with a single extended-multizone or 64-pixel tile message, so a 16-zone strip costs one packet
+# per update like a single bulb does. Updates run on the output scheduler thread and go out
+# unacknowledged, so an unreachable strip never holds up analysis or the other lights.
+ZONE_FFT_SIZE = 2048  # Samples in the zone spectrum window (~46 ms at 44.1 kHz)
+ZONE_MIN_FREQ = 30
+ZONE_MAX_FREQ = 8000
+ZONE_UPDATE_INTERVAL = 0.05  # Seconds between zone messages (LIFX devices handle about 20 messages/s)
+ZONE_HUE_SPREAD = 0.25  # Hue difference between the lowest and the highest band
+ZONE_MIN_RANGE_DB = 12.0  # Smallest level range a band's gain control maps onto 0-1
+TILE_WIDTH = 8  # Tile pixels per side; each column shows one band as a bar
+EXTENDED_ZONE_CAPACITY = 82  # Colours carried by one extended multizone message
+
+zone_window = np.hanning(ZONE_FFT_SIZE).astype(np.float32)
+last_zone_update_time = 0.0
+zone_message_types = None  # (extended multizone, tile) message classes, built with lifxlan
+
+
+# lifxlan packs every colour field through bitstring, which makes a 64-pixel tile message cost
+# ~18x a set_color. These subclasses send the same wire format with the colour array packed in
+# one numpy call.
+def build_zone_message_types():
+    from lifxlan.msgtypes import MultiZoneSetExtendedColorZones, SetTileState64
+
+    class PackedExtendedColorZones(MultiZoneSetExtendedColorZones):
+        def get_payload(self):
+            colors = np.zeros((EXTENDED_ZONE_CAPACITY, 4), dtype="<u2")
+            colors[:self.count] = self.colors
+            return struct.pack("<IBHB", self.duration, self.apply, self.index, self.count) + colors.tobytes()
+
+    class PackedTileState64(SetTileState64):
+        def get_payload(self):
+            return (struct.pack("<BBBBBBI", self.tile_index, self.length, self.reserved, self.x, self.y,
+                                self.width, self.duration) + np.asarray(self.colors, dtype="<u2").tobytes())
+
+    return PackedExtendedColorZones, PackedTileState64
+
+
+class ZoneOutput:
+    def __init__(self, kind, light, count):
+        self.kind = kind
+        self.light = light
+        self.count = count
+        self.bands = count if kind == "multizone" else TILE_WIDTH
+        self.band_starts = None
+        self.agc = StreamingQuantileAGC(AGC_LOW_QUANTILE, AGC_HIGH_QUANTILE, AGC_WINDOW_SECONDS, AGC_QUANTILE_RATE,
+                                        AGC_ATTACK, AGC_RELEASE, ZONE_MIN_RANGE_DB, 60.0)
+
+    # First spectrum bin of each log-spaced band; every band gets at least one bin.
+    def _band_starts(self, freqs):
+        edges = np.geomspace(ZONE_MIN_FREQ, min(ZONE_MAX_FREQ, freqs[-1]), self.bands + 1)
+        starts = np.searchsorted(freqs, edges[:-1])
+        starts = np.maximum(starts, np.arange(self.bands) + starts[0])
+        return starts, max(np.searchsorted(freqs, edges[-1]), starts[-1] + 1)
+
+    def levels(self, magnitudes, freqs, dt):
+        if self.band_starts is None:
+            self.band_starts = self._band_starts(freqs)
+        starts, stop = self.band_starts
+        band_peaks = np.maximum.reduceat(magnitudes[:stop], starts)
+        return self.agc.process(20 * np.log10(band_peaks + 1e-9), dt)
+
+    def colors(self, levels):
+        hues = (hue_value + ZONE_HUE_SPREAD * np.arange(self.bands) / max(self.bands - 1, 1)) % 1.0
+        brightness = np.clip(np.maximum(levels * control_sensitivity, control_brightness_floor), 0.0, 1.0)
+        if self.kind == "tile":
+            # Spectrum bars: column x is band x, lit from the bottom row up to its level.
+            rows = np.arange(TILE_WIDTH)[:, np.newaxis]
+            lit = levels[np.newaxis, :] * TILE_WIDTH > (TILE_WIDTH - 1 - rows)
+            brightness = np.where(lit, brightness[np.newaxis, :], control_brightness_floor).ravel()
+            hues = np.tile(hues, TILE_WIDTH)
+        return hsbk_colors(hues, brightness)
+
+    def message(self, colors, duration_ms):
+        extended_type, tile_type = zone_message_types
+        if self.kind == "multizone":
+            return extended_type, {"index": 0, "colors": colors, "count": len(colors),
+                                   "duration": duration_ms, "apply": 1}
+        # One 64-pixel frame applied to every tile in the chain.
+        return tile_type, {"tile_index": 0, "length": self.count, "colors": colors, "duration": duration_ms,
+                           "reserved": 0, "x": 0, "y": 0, "width": TILE_WIDTH}
+
+
+def connect_zone_outputs():
+    global zone_outputs, zone_message_types
+    zone_outputs = []
+    for kind, mac, ip, count in LIFX_ZONE_LIGHTS:
+        if kind not in ("multizone", "tile") or (kind == "multizone" and count > EXTENDED_ZONE_CAPACITY):
+            logging.error(f"Unsupported zone light {kind} with {count} zones at {ip}")
+            continue
+        zone_outputs.append(ZoneOutput(kind, lifxlan.Light(mac, ip), count))
+    if zone_outputs and zone_message_types is None:
+        zone_message_types = build_zone_message_types()
+
+
+# A lost zone message is superseded by the next update, so there is no ack to wait for or retry.
+def send_zone_colors(output, colors, duration=0.0):
+    msg_type, payload = output.message(colors, int(duration * 1000))
+    light = output.light
+    try:
+        send_start = time.perf_counter()
+        flight_recorder.record(EV_PACKET, PHASE_BEGIN, len(colors))
+        send_unacknowledged_packet(light, msg_type(light.mac_addr, light.source_id, 0, payload).packed_message)
+        metric_lifx_send_time.observe(time.perf_counter() - send_start)
+        metric_lifx_packets.inc()
+        flight_recorder.record(EV_PACKET, PHASE_END, len(colors))
+    except Exception as e:
+        metric_lifx_errors.inc()
+        metric_lifx_failures.inc()
+        flight_recorder.record(EV_PACKET_FAILED, PHASE_INSTANT, 1)
+        logging.error(f"Error sending zone colors to {light.ip_addr}: {e}")
+
+
+# Called from every output scheduler tick. The longer zone window is assembled from the feature
+# bus history only when a message is due; the half-tick slack keeps tick jitter from skipping one.
+def update_zone_outputs(current_time):
+    global last_zone_update_time
+    if current_time - last_zone_update_time < ZONE_UPDATE_INTERVAL - 0.5 * output_scheduler.interval:
+        return
+    dt = current_time - last_zone_update_time if last_zone_update_time else ZONE_UPDATE_INTERVAL
+    last_zone_update_time = current_time
+    magnitudes = np.abs(np.fft.rfft(feature_bus.recent_samples(ZONE_FFT_SIZE) * zone_window))
+    freqs = np.fft.rfftfreq(ZONE_FFT_SIZE, 1.0 / RATE)
+    for output in zone_outputs:
+        colors = output.colors(output.levels(magnitudes, freqs, min(dt, 1.0)))
+        send_zone_colors(output, colors, duration=ZONE_UPDATE_INTERVAL)
+
+
+# -----------------------------
+# LIFX Simulator & Output Load Test
+# -----------------------------
+# A local stand-in for a room of bulbs. One UDP socket serves N simulated devices by target MAC;
+# each accepts messages into a small buffer that drains at a bulb's processing rate, acknowledges
+# what it accepted and drops the rest, so send paths can be measured without hardware.
+LIFX_SIM_HOST = "127.0.0.1"
+LIFX_SIM_RATE = 20.0  # Messages per second a simulated device processes (LIFX guidance: ~20/s)
+LIFX_SIM_BUFFER = 4  # Messages a device holds before it starts dropping
+LIFX_SIM_LOSS = 0.01  # Fraction of packets lost on the network before reaching a device
+LIFX_SIM_ACK_DELAY = 0.002  # Device turnaround from receipt to acknowledgement (seconds)
+LIFX_SIM_MAC_PREFIX = "d0:73:d5"
+LIFX_SIM_PRODUCT = 27  # Reported product id (LIFX A19), so discovery treats devices as colour lights
+LOADTEST_BULB_COUNTS = (1, 10, 100)
+LOADTEST_SECONDS = 5.0  # Driving time per output path and bulb count
+LOADTEST_ZONES = 16  # Zones per simulated strip on the multizone path
+
+# size, protocol, source, target (MAC + 2 bytes), reserved, flags, sequence, reserved, type, reserved
+LIFX_HEADER = struct.Struct("<HHI8s6sBBQHH")
+MSG_GET_SERVICE = 2
+MSG_STATE_SERVICE = 3
+MSG_GET_VERSION = 32
+MSG_STATE_VERSION = 33
+MSG_ACKNOWLEDGEMENT = 45
+MSG_LIGHT_SET_COLOR = 102
+MSG_SET_EXTENDED_COLOR_ZONES = 510
+MSG_SET_TILE_STATE_64 = 715
+
+
+def decode_lifx_message(data):
+    if len(data) < LIFX_HEADER.size:
+        return None
+    size, _, source, target, _, flags, seq, _, msg_type, _ = LIFX_HEADER.unpack_from(data)
+    if size != len(data):
+        return None
+    return {"source": source, "target": target[:6], "ack": bool(flags & 0x02), "res": bool(flags & 0x01),
+            "seq": seq, "type": msg_type, "payload": data[LIFX_HEADER.size:]}
+
+
+def encode_lifx_message(msg_type, target, source, seq, payload=b""):
+    return LIFX_HEADER.pack(LIFX_HEADER.size + len(payload), 0x1400, source, target + b"\0\0", b"\0" * 6, 0, seq,
+                            0, msg_type, 0) + payload
+
+
+class SimulatedLifxDevice:
+    def __init__(self, mac):
+        self.mac = mac
+        self.busy_until = 0.0  # When the buffered messages will have been processed
+        self.arrivals = []  # Receipt time of every packet addressed to this device
+        self.accepted = 0
+        self.lost = 0
+        self.overflowed = 0
+        self.color = None  # Last HSBK applied (first zone or pixel for zone messages)
+
+    def receive(self, message, now, rate, buffer, loss):
+        self.arrivals.append(now)
+        if np.random.random() < loss:
+            self.lost += 1
+            return False
+        start = max(now, self.busy_until)
+        if (start - now) * rate >= buffer:
+            self.overflowed += 1
+            return False
+        self.busy_until = start + 1.0 / rate
+        self.accepted += 1
+        payload = message["payload"]
+        if message["type"] == MSG_LIGHT_SET_COLOR and len(payload) >= 9:
+            self.color = struct.unpack_from("<4H", payload, 1)
+        elif message["type"] == MSG_SET_EXTENDED_COLOR_ZONES and len(payload) >= 16:
+            self.color = struct.unpack_from("<4H", payload, 8)
+        elif message["type"] == MSG_SET_TILE_STATE_64 and len(payload) >= 18:
+            self.color = struct.unpack_from("<4H", payload, 10)
+        return True
+
+
+class LifxSimulator:
+    def __init__(self, device_count, host=LIFX_SIM_HOST, port=0, rate=LIFX_SIM_RATE, buffer=LIFX_SIM_BUFFER,
+                 loss=LIFX_SIM_LOSS, ack_delay=LIFX_SIM_ACK_DELAY):
+        self.devices = {}
+        for index in range(device_count):
+            mac = f"{LIFX_SIM_MAC_PREFIX}:{index >> 16 & 0xff:02x}:{index >> 8 & 0xff:02x}:{index & 0xff:02x}"
+            self.devices[bytes.fromhex(mac.replace(":", ""))] = SimulatedLifxDevice(mac)
+        self.rate = rate
+        self.buffer = buffer
+        self.loss = loss
+        self.ack_delay = ack_delay
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.host, self.port = self.sock.getsockname()
+        self.unknown = 0
+        self.pending_acks = deque()  # (due time, packet, address); due times only increase
+        self.running = False
+        self.thread = None
+        self.cpu_seconds = 0.0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="lifx-simulator", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        self.sock.close()
+
+    def _run(self):
+        while self.running:
+            timeout = 0.05
+            if self.pending_acks:
+                timeout = max(0.0, min(timeout, self.pending_acks[0][0] - time.perf_counter()))
+            readable, _, _ = select.select([self.sock], [], [], timeout)
+            if readable:
+                data, address = self.sock.recvfrom(2048)
+                self._handle(data, address, time.perf_counter())
+            now = time.perf_counter()
+            while self.pending_acks and self.pending_acks[0][0] <= now:
+                _, packet, address = self.pending_acks.popleft()
+                self.sock.sendto(packet, address)
+            self.cpu_seconds = time.thread_time()
+
+    def _handle(self, data, address, now):
+        message = decode_lifx_message(data)
+        if message is None:
+            self.unknown += 1
+            return
+        if message["type"] == MSG_GET_SERVICE:
+            # Discovery: every device answers with its UDP service and port.
+            for target in self.devices:
+                self.sock.sendto(encode_lifx_message(MSG_STATE_SERVICE, target, message["source"], message["seq"],
+                                                     struct.pack("<BI", 1, self.port)), address)
+            return
+        device = self.devices.get(message["target"])
+        if device is None:
+            self.unknown += 1
+            return
+        if message["type"] == MSG_GET_VERSION:
+            self.sock.sendto(encode_lifx_message(MSG_STATE_VERSION, message["target"], message["source"],
+                                                 message["seq"], struct.pack("<III", 1, LIFX_SIM_PRODUCT, 0)), address)
+            return
+        if device.receive(message, now, self.rate, self.buffer, self.loss) and message["ack"]:
+            self.pending_acks.append((now + self.ack_delay, encode_lifx_message(
+                MSG_ACKNOWLEDGEMENT, message["target"], message["source"], message["seq"]), address))
+
+    def lights(self):
+        return [lifxlan.Light(device.mac, self.host, port=self.port) for device in self.devices.values()]
+
+    def stats(self, since):
+        arrivals = sum(len(device.arrivals) for device in self.devices.values())
+        dropped = sum(device.lost + device.overflowed for device in self.devices.values())
+        gaps = [np.max(np.diff([since] + device.arrivals)) for device in self.devices.values() if device.arrivals]
+        return {"arrivals": arrivals, "accepted": arrivals - dropped, "dropped": dropped,
+                "drop_rate": dropped / arrivals if arrivals else 0.0, "max_gap": max(gaps) if gaps else 0.0}
+
+
+def drive_bulb_path(lights, seconds):
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    next_send = time.perf_counter()
+    phase = 0
+    while time.perf_counter() < deadline:
+        glow = 0.5 + 0.5 * math.sin(phase * 0.2)
+        for light in lights:
+            send_start = time.perf_counter()
+            send_lifx_color(glow, (phase * 0.01) % 1.0, light=light)
+            latencies.append(time.perf_counter() - send_start)
+            if time.perf_counter() >= deadline:
+                break
+        phase += 1
+        next_send += PACKET_SEND_INTERVAL
+        time.sleep(max(0.0, next_send - time.perf_counter()))
+    return latencies
+
+
+def drive_multizone_path(lights, seconds):
+    global zone_message_types
+    if zone_message_types is None:
+        zone_message_types = build_zone_message_types()
+    outputs = [ZoneOutput("multizone", light, LOADTEST_ZONES) for light in lights]
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    next_send = time.perf_counter()
+    phase = 0
+    while time.perf_counter() < deadline:
+        levels = 0.5 + 0.5 * np.sin(phase * 0.2 + np.arange(LOADTEST_ZONES))
+        for output in outputs:
+            send_start = time.perf_counter()
+            send_zone_colors(output, output.colors(levels), duration=ZONE_UPDATE_INTERVAL)
+            latencies.append(time.perf_counter() - send_start)
+            if time.perf_counter() >= deadline:
+                break
+        phase += 1
+        next_send += ZONE_UPDATE_INTERVAL
+        time.sleep(max(0.0, next_send - time.perf_counter()))
+    return latencies
+
+
+LOADTEST_PATHS = {"bulb": drive_bulb_path, "multizone": drive_multizone_path}
+
+
+# Drives every output path against 1, 10 and 100 simulated devices at the live send schedule and
+# reports what actually got through. Send errors are expected under overload and not logged.
+def run_lifx_loadtest(counts=LOADTEST_BULB_COUNTS, seconds=LOADTEST_SECONDS):
+    ensure_lifxlan()
+    print(f"LIFX load test: {seconds:.0f} s per run, devices process {LIFX_SIM_RATE:.0f} msg/s, "
+          f"buffer {LIFX_SIM_BUFFER}, loss {LIFX_SIM_LOSS:.1%}")
+    print(f"  {'path':<10}{'devices':>8}{'sent':>8}{'pkt/s':>9}{'drop':>8}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'max ms':>9}{'max gap s':>11}")
+    logging.disable(logging.ERROR)
+    try:
+        for path, drive in LOADTEST_PATHS.items():
+            for count in counts:
+                simulator = LifxSimulator(count)
+                simulator.start()
+                start = time.perf_counter()
+                latencies = np.array(drive(simulator.lights(), seconds)) * 1000
+                elapsed = time.perf_counter() - start
+                time.sleep(LIFX_SIM_ACK_DELAY * 2)
+                simulator.stop()
+                stats = simulator.stats(start)
+                print(f"  {path:<10}{count:>8}{len(latencies):>8}{stats['accepted'] / elapsed:>9.1f}"
+                      f"{stats['drop_rate']:>8.1%}{np.percentile(latencies, 50):>9.2f}"
+                      f"{np.percentile(latencies, 95):>9.2f}{latencies.max():>9.1f}{stats['max_gap']:>11.2f}")
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+# Serves simulated devices on the LIFX port until interrupted; discovery finds them like real bulbs.
+def run_lifx_simulator(device_count):
+    simulator = LifxSimulator(device_count, host="0.0.0.0", port=56700)
+    simulator.start()
+    print(f"Simulating {device_count} LIFX devices on UDP {simulator.port}; Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(5.0)
+            stats = simulator.stats(time.perf_counter())
+            logging.info(f"Simulator: {stats['arrivals']} packets, {stats['dropped']} dropped")
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
 # -----------------------------
 # Tkinter Device Selector
 # -----------------------------
 def select_device_tk(devices_list):
+    import tkinter as tk
+    from tkinter import ttk
+    mark_startup("import tkinter")
     selected_index = None
 
     def on_select():
@@ -344,30 +3111,303 @@ def select_device_tk(devices_list):
     return selected_index
 
 
-all_devices = sd.query_devices()
-mic_devices = [(i, d['name']) for i, d in enumerate(all_devices) if d['max_input_channels'] > 0]
-if not mic_devices:
-    print("No microphone input devices found. Exiting.")
-    sys.exit(1)
-device_index = select_device_tk(mic_devices)
-print(f"Selected microphone device index: {device_index}")
+# -----------------------------
+# Persisted Configuration & State
+# -----------------------------
+# Remembers the input device, LIFX bulbs and control settings so unattended restarts come
+# straight back up without the device picker or bulb discovery.
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "visualbass_config.json")
+STATE_AUTOSAVE_INTERVAL = 5.0  # Seconds between checks for changed settings to save
+
+
+def load_config():
+    try:
+        with open(CONFIG_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# Writes to a temporary file first so a crash mid-write never leaves a truncated file behind.
+def write_json_file(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def save_config(config):
+    try:
+        write_json_file(CONFIG_FILE, config)
+    except OSError as e:
+        logging.warning(f"Could not save config: {e}")
+
+
+def capture_state():
+    return {
+        "mode": visualization_mode,
+        "control_brightness_floor": control_brightness_floor,
+        "control_sensitivity": control_sensitivity,
+        "cycle_rate": cycle_rate,
+        "manual_hue_value": manual_hue_value,
+    }
+
+
+def restore_state(state):
+    global visualization_mode, current_mode_index, control_brightness_floor, control_sensitivity
+    global cycle_rate, manual_hue_value, manual_hue
+    if state.get("mode") in available_modes:
+        visualization_mode = state["mode"]
+        current_mode_index = available_modes.index(visualization_mode)
+    control_brightness_floor = max(0.0, min(float(state.get("control_brightness_floor", control_brightness_floor)), 1.0))
+    control_sensitivity = float(state.get("control_sensitivity", control_sensitivity))
+    cycle_rate = float(state.get("cycle_rate", cycle_rate))
+    manual_hue_value = max(0.0, min(float(state.get("manual_hue_value", manual_hue_value)), 1.0))
+    manual_hue = manual_hue_value != 0
+
+
+# Returns the index of the saved input device, or None when it is no longer present.
+def find_saved_device(saved_device):
+    if not saved_device:
+        return None
+    try:
+        info = sd.query_devices(f"{saved_device['name']}, {saved_device['hostapi']}", kind="input")
+    except (ValueError, sd.PortAudioError):
+        return None
+    if info["name"] != saved_device["name"] or info["max_input_channels"] <= 0:
+        return None
+    return info["index"]
+
+
+def connect_lifx_lights(config):
+    global lifx, bulb, lifx_lights, channel_light_groups
+    if not LIFX_ENABLED:
+        return
+    ensure_lifxlan()
+    channel_light_groups = {channel: [lifxlan.Light(mac, ip) for mac, ip in lights]
+                            for channel, lights in CHANNEL_LIGHT_GROUPS.items()}
+    connect_zone_outputs()
+    if LIFX_MAC and LIFX_IP:
+        lights = [lifxlan.Light(LIFX_MAC, LIFX_IP)]
+    elif config.get("bulbs") is not None:
+        lights = [lifxlan.Light(saved["mac"], saved["ip"]) for saved in config["bulbs"]]
+    elif LIFX_DISCOVER_ON_START:
+        try:
+            lifx = lifxlan.LifxLAN()
+            lights = lifx.get_lights()
+        except lifxlan.WorkflowException as e:
+            logging.warning(f"LIFX discovery failed: {e}")
+            lights = []
+        else:
+            logging.info(f"Discovered {len(lights)} LIFX light(s)")
+            config["bulbs"] = [{"mac": light.get_mac_addr(), "ip": light.get_ip_addr()} for light in lights]
+    else:
+        lights = []
+    lifx_lights = lights
+    bulb = lights[0] if lights else None
+    mark_startup("lights ready")
+
+
+last_state_check_time = 0.0
+
+
+def autosave_state():
+    global last_state_check_time
+    now = time.time()
+    if now - last_state_check_time < STATE_AUTOSAVE_INTERVAL:
+        return
+    last_state_check_time = now
+    state = capture_state()
+    if state != app_config.get("state"):
+        app_config["state"] = state
+        save_config(app_config)
+
 
 # -----------------------------
-# Start Audio Stream
+# Block Size & Latency Calibration
 # -----------------------------
-try:
-    stream = sd.InputStream(
-        device=device_index,
-        samplerate=RATE,
-        blocksize=BUFFER,
-        channels=1,
-        callback=audio_callback
-    )
-    stream.start()
-    print("Audio stream started.")
-except Exception as e:
-    print("Failed to start audio stream:", e)
-    sys.exit(1)
+AUTO_TUNE_AUDIO = True  # Probe the device for the lowest-latency glitch-free configuration
+# Probing runs once per device and channel count and is cached. Worst case on a first start is
+# every candidate for CALIBRATION_SECONDS (4 block sizes x 2 rates x 2 latencies x 0.5 s = 8 s),
+# plus timing the analysis once per block size and rate.
+FORCE_RECALIBRATION = False  # Ignore the cached configuration and probe again
+CALIBRATION_BLOCK_SIZES = [64, 128, 256, 512]
+CALIBRATION_SAMPLE_RATES = [44100, 48000]
+CALIBRATION_LATENCIES = ["low", "high"]
+CALIBRATION_SECONDS = 0.5  # Probe duration per candidate configuration
+CALIBRATION_WARMUP_BLOCKS = 8  # Callbacks ignored while the stream settles
+CALIBRATION_MAX_JITTER = 0.5  # Allowed std of callback spacing as a fraction of the block period
+CALIBRATION_MAX_LOAD = 0.25  # Allowed p95 analysis time as a fraction of the block period
+CALIBRATION_ANALYSIS_BLOCKS = 32  # Synthetic blocks timed through the analysis per block size and rate
+CALIBRATION_LATENCY_TOLERANCE = 0.002  # Configurations this close to the lowest latency compete on load
+CALIBRATION_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "visualbass_calibration.json")
+STREAM_LATENCY = None  # Latency hint passed to sd.InputStream (None = PortAudio default)
+
+
+def apply_audio_config(block_size, rate):
+    global BUFFER, RATE, onset_tracker, bass_front_end
+    BUFFER = block_size
+    RATE = rate
+    bass_front_end = None
+    onset_tracker = OnsetTempoTracker(BUFFER, RATE)
+    build_block_smoothers(BUFFER, RATE)
+
+
+# Times the real analysis path on synthetic noise at one block size and rate. The analysis state
+# is rebuilt for that configuration, so the caller applies its final one afterwards.
+def measure_analysis_time(channels, block_size, rate):
+    apply_audio_config(block_size, rate)
+    noise = np.random.default_rng(0).standard_normal((CALIBRATION_ANALYSIS_BLOCKS, block_size, channels))
+    analysis_times = []
+    for index, block in enumerate(noise.astype(np.float32) * 0.1):
+        audio_queue.put((index * block_size / rate, block))
+        analysis_start = time.perf_counter()
+        process_audio_queue()
+        analysis_times.append(time.perf_counter() - analysis_start)
+    return float(np.percentile(analysis_times[CALIBRATION_WARMUP_BLOCKS:], 95))
+
+
+def probe_stream_config(device, channels, block_size, rate, latency, analysis_time):
+    arrivals = []
+    flagged_blocks = 0
+
+    def probe_callback(indata, frames, time_info, status):
+        nonlocal flagged_blocks
+        arrivals.append(time.perf_counter())
+        if len(arrivals) > CALIBRATION_WARMUP_BLOCKS and status:
+            flagged_blocks += 1
+
+    try:
+        with sd.InputStream(device=device, samplerate=rate, blocksize=block_size, channels=channels,
+                            latency=latency, callback=probe_callback) as probe:
+            time.sleep(CALIBRATION_SECONDS)
+            reported_latency = probe.latency
+    except Exception as e:
+        logging.info(f"Calibration: {block_size} @ {rate} Hz ({latency}) unsupported: {e}")
+        return None
+
+    period = block_size / rate
+    intervals = np.diff(arrivals[CALIBRATION_WARMUP_BLOCKS:])
+    if len(intervals) < 4:
+        return None
+    result = {
+        "blocksize": block_size,
+        "samplerate": rate,
+        "latency": latency,
+        "total_latency": float(reported_latency) + period,
+        "jitter": float(np.std(intervals)),
+        "flagged_blocks": flagged_blocks,
+        "analysis_time": analysis_time,
+    }
+    result["glitch_free"] = (flagged_blocks == 0 and
+                             result["jitter"] <= CALIBRATION_MAX_JITTER * period and
+                             result["analysis_time"] <= CALIBRATION_MAX_LOAD * period)
+    logging.info(f"Calibration: {block_size} @ {rate} Hz ({latency}): latency {result['total_latency'] * 1000:.1f} ms, "
+                 f"jitter {result['jitter'] * 1000:.2f} ms, flagged {flagged_blocks}, "
+                 f"analysis {result['analysis_time'] * 1e6:.0f} us -> {'ok' if result['glitch_free'] else 'rejected'}")
+    return result
+
+
+def calibration_device_key(device, channels):
+    info = sd.query_devices(device)
+    hostapi = sd.query_hostapis(info['hostapi'])['name']
+    return f"{info['name']}|{hostapi}|{channels}"
+
+
+def load_calibration_cache():
+    try:
+        with open(CALIBRATION_CACHE_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def calibrate_audio_stream(device, channels):
+    key = calibration_device_key(device, channels)
+    cache = load_calibration_cache()
+    if key in cache and not FORCE_RECALIBRATION:
+        return cache[key]
+
+    candidates = sorted(((b, r, l) for b in CALIBRATION_BLOCK_SIZES for r in CALIBRATION_SAMPLE_RATES
+                         for l in CALIBRATION_LATENCIES), key=lambda c: (c[0] / c[1], c[2] != "low"))
+    print(f"Calibrating audio input (up to {len(candidates) * CALIBRATION_SECONDS:.0f} s, once per device)...")
+    default_config = (BUFFER, RATE)
+    analysis_times = {}
+    results = []
+    for block_size, rate, latency in candidates:
+        # A block longer than the lowest total latency found so far (plus the tolerance) cannot win.
+        if results and block_size / rate >= min(r["total_latency"] for r in results) + CALIBRATION_LATENCY_TOLERANCE:
+            break
+        if (block_size, rate) not in analysis_times:
+            analysis_times[block_size, rate] = measure_analysis_time(channels, block_size, rate)
+        result = probe_stream_config(device, channels, block_size, rate, latency, analysis_times[block_size, rate])
+        if result and result["glitch_free"]:
+            results.append(result)
+    apply_audio_config(*default_config)
+    if not results:
+        logging.warning("Calibration found no glitch-free configuration; keeping defaults.")
+        return None
+
+    # Within the tolerance of the lowest latency the lightest analysis load wins, so a millisecond
+    # of latency never costs analysing twice as many blocks per second.
+    lowest = min(r["total_latency"] for r in results)
+    best = min((r for r in results if r["total_latency"] <= lowest + CALIBRATION_LATENCY_TOLERANCE),
+               key=lambda r: r["analysis_time"] * r["samplerate"] / r["blocksize"])
+    chosen = {k: best[k] for k in ("blocksize", "samplerate", "latency")}
+    cache[key] = chosen
+    try:
+        write_json_file(CALIBRATION_CACHE_FILE, cache)
+    except OSError as e:
+        logging.warning(f"Could not write calibration cache: {e}")
+    return chosen
+
+
+def stop_audio_and_services():
+    if stream is not None:
+        stream.stop()
+        stream.close()
+    stop_extra_inputs()
+    output_scheduler.stop()
+    app_config["state"] = capture_state()
+    save_config(app_config)
+    if session_recorder is not None:
+        session_recorder.close()
+    if feature_server is not None:
+        feature_server.stop()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+
+
+# -----------------------------
+# Startup Benchmark
+# -----------------------------
+STARTUP_BENCHMARK_TIMEOUT = 10.0  # Seconds to wait for the first audio block and packet
+
+
+def print_startup_report():
+    print("Startup timeline (seconds since launch):")
+    previous = 0.0
+    for label, at in sorted(startup_marks.items(), key=lambda item: item[1]):
+        print(f"  {at:7.3f}  +{at - previous:6.3f}  {label}")
+        previous = at
+    for label in ("first audio block", "first packet"):
+        if label not in startup_marks:
+            print(f"  {'-':>7}  {'':7}  {label} (not reached)")
+
+
+# Drives the audio pipeline without a window until the first packet has left (or the first block
+# has arrived when there is no light to send to), then prints the startup timeline.
+def run_startup_benchmark():
+    deadline = time.perf_counter() + STARTUP_BENCHMARK_TIMEOUT
+    while time.perf_counter() < deadline:
+        process_audio_queue()
+        if "first packet" in startup_marks:
+            break
+        if "first audio block" in startup_marks and not (lifx_lights or bulb or channel_light_groups):
+            break
+        time.sleep(0.001)
+    print_startup_report()
+
 
 # -----------------------------
 # Menu Constants & Variables
@@ -384,14 +3424,14 @@ MENU_PANEL_ALPHA = 200
 MENU_FONT_SIZE = 18
 MENU_FONT_COLOR = (255, 255, 255)
 
-# These rects will be updated on resize.
-menu_button_rect = pygame.Rect(0, 0, 0, 0)
-menu_panel_rect = pygame.Rect(0, 0, 0, 0)
+# These rects are created once the window exists and updated on resize.
+menu_button_rect = None
+menu_panel_rect = None
 # Define four fields: Mode, Hue, Cycle Rate, Brightness Slider.
-mode_field_rect = pygame.Rect(0, 0, 0, 0)
-hue_field_rect = pygame.Rect(0, 0, 0, 0)
-cycle_rate_field_rect = pygame.Rect(0, 0, 0, 0)
-brightness_slider_rect = pygame.Rect(0, 0, 0, 0)
+mode_field_rect = None
+hue_field_rect = None
+cycle_rate_field_rect = None
+brightness_slider_rect = None
 
 menu_font = None
 brightness_font = None
@@ -465,21 +3505,6 @@ def update_menu_dimensions():
                                          MENU_PANEL_WIDTH - 2 * field_padding,
                                          field_height)
 
-# -----------------------------
-# Pygame Initialization & Setup
-# -----------------------------
-pygame.init()
-pygame.font.init()
-screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT), pygame.RESIZABLE)
-pygame.display.set_caption("Reactive dB Meters - Hidden Below Noise Floor")
-clock = pygame.time.Clock()
-font = pygame.font.SysFont("Arial", 20)
-brightness_font = pygame.font.SysFont("Arial", BRIGHTNESS_FONT_SIZE)
-
-# Initialize menu dimensions at startup (manual call here)
-update_menu_dimensions()  # Initialize menu dimensions at startup
-update_meter_dimensions()  # Initialize meter dimensions at startup
-
 # -----------------------------
 # Cube/Polygon / Gravity / Waveform Functions (unchanged)
 # -----------------------------
@@ -496,8 +3521,7 @@ def draw_meter_with_glow(target, rect, draw_color, glow_width):
 
 
 def init_cube():
-    global cube_vertices
-    cube_vertices = [
+    return [
         np.matrix([-1, -1, 1]),
         np.matrix([1, -1, 1]),
         np.matrix([1, 1, 1]),
@@ -509,7 +3533,7 @@ def init_cube():
     ]
 
 
-def draw_cube(screen, center_x, center_y, rotation_x, rotation_y, rotation_z, scale, line_color):
+def draw_cube(screen, cube_vertices, center_x, center_y, rotation_x, rotation_y, rotation_z, scale, line_color):
     projection_matrix = np.matrix([[1, 0, 0],
                                    [0, 1, 0]])
     projected_points = []
@@ -538,13 +3562,11 @@ def draw_cube(screen, center_x, center_y, rotation_x, rotation_y, rotation_z, sc
         connect_points(p, p + 4)
 
 
-def draw_polygon_mode(screen, glow_value, hue, center_x, center_y):
-    if not cube_vertices:
-        init_cube()
+def draw_polygon_mode(screen, cube_vertices, glow_value, line_color, center_x, center_y):
     center_x, center_y = screen.get_width() // 2, screen.get_height() // 2
     min_dimension = min(screen.get_width(), screen.get_height())
     scale = (DEFAULT_SCALE_FACTOR * (glow_value * MAX_SCALE_FACTOR)) * (min_dimension / 800)
-    angle = pygame.time.get_ticks() * 0.0010
+    angle = (pygame.time.get_ticks() if visual_time_ms is None else visual_time_ms) * 0.0010
     rotation_z = np.matrix([
         [math.cos(angle), -math.sin(angle), 0],
         [math.sin(angle), math.cos(angle), 0],
@@ -560,18 +3582,7 @@ def draw_polygon_mode(screen, glow_value, hue, center_x, center_y):
         [0, math.cos(angle), -math.sin(angle)],
         [0, math.sin(angle), math.cos(angle)]
     ])
-    brightness = max(glow_value * control_sensitivity, control_brightness_floor)
-    r, g, b = colorsys.hsv_to_rgb(hue, 1, brightness)
-    line_color = (int(r * 255), int(g * 255), int(b * 255))
-    draw_cube(screen, center_x, center_y, rotation_x, rotation_y, rotation_z, scale, line_color)
-
-
-def pygame_visualizer(internal_width, internal_height):
-    update_offscreen_surface(internal_width, internal_height)
-    center_x = pygame_surface.get_width() // 2
-    center_y = pygame_surface.get_height() // 2
-    draw_polygon_mode(pygame_surface, glow_value, hue_value, center_x, center_y)
-    return pygame_surface
+    draw_cube(screen, cube_vertices, center_x, center_y, rotation_x, rotation_y, rotation_z, scale, line_color)
 
 
 class Orb:
@@ -586,11 +3597,7 @@ class Orb:
         pygame.draw.circle(surface, self.color, (int(self.pos[0]), int(self.pos[1])), int(self.radius))
 
 
-orbs = []
-
-
 def init_orbs():
-    global orbs
     orbs = []
     for i in range(ORB_AMOUNT):
         side = np.random.choice(["top", "bottom", "left", "right"])
@@ -607,12 +3614,12 @@ def init_orbs():
             x = WINDOW_WIDTH
             y = np.random.uniform(0, WINDOW_HEIGHT)
         orbs.append(Orb((x, y), 5))
+    return orbs
 
 # -----------------------------
 # Constants for Gravity & Orbs
 # -----------------------------
-def update_orbs():
-    global orbs, base_color
+def update_orbs(orbs):
     center_x = WINDOW_WIDTH / 2
     center_y = WINDOW_HEIGHT / 2
     max_distance = min(WINDOW_WIDTH, WINDOW_HEIGHT) // 2
@@ -640,10 +3647,10 @@ def update_orbs():
         orb.color = base_color
         if orb.radius >= 1:
             remaining_orbs.append(orb)
-    orbs = remaining_orbs
+    return remaining_orbs
 
 
-def draw_orbs():
+def draw_orbs(orbs):
     for orb in orbs:
         orb.draw(screen)
 
@@ -652,19 +3659,19 @@ def draw_orbs():
 # -----------------------------
 WAVEFORM_HEIGHT_SCALE = 0.85  # Maximum fraction of half-screen height used for waveform amplitude
 
-def update_waveform_buffers():
-    global waveform_buffers, control_waveform_points
-    waveform_buffers = [deque(maxlen=5) for _ in range(control_waveform_points)]
+def init_waveform_buffers():
+    return [deque(maxlen=5) for _ in range(control_waveform_points)]
 
 
-def draw_waveform_mode():
-    global latest_audio_data, hue_value, control_brightness_floor, glow_value, control_sensitivity
+def draw_waveform_mode(waveform_buffers):
+    global hue_value, control_brightness_floor, glow_value, control_sensitivity
     try:
-        if latest_audio_data is None or len(latest_audio_data) < 2:
+        frame = feature_bus.latest
+        if frame is None or len(frame.samples) < 2:
             return
 
         # Get raw waveform data and downsample
-        waveform_data = np.nan_to_num(latest_audio_data, nan=0.0)
+        waveform_data = np.nan_to_num(frame.samples, nan=0.0)
         downsample_factor = max(1, len(waveform_data) // control_waveform_points)
         downsampled_waveform = waveform_data[::downsample_factor]
         downsampled_waveform = np.nan_to_num(downsampled_waveform, nan=0.0)
@@ -679,10 +3686,8 @@ def draw_waveform_mode():
                                            (1 - WAVEFORM_SMOOTHING_FACTOR) * downsampled_waveform[i])
 
         amplitude_scale = 1.1
-        r, g, b = colorsys.hsv_to_rgb((hue_value + 0.1) % 1.0, 1,
-                                      max(glow_value * control_sensitivity * amplitude_scale,
-                                          control_brightness_floor))
-        base_color = (int(r * 255), int(g * 255), int(b * 255))
+        line_color = rgb_color(hue_value + 0.1, max(glow_value * control_sensitivity * amplitude_scale,
+                                                    control_brightness_floor))
 
         num_points = len(downsampled_waveform)
         if num_points < 2:
@@ -703,7 +3708,7 @@ def draw_waveform_mode():
         height_factor = WINDOW_HEIGHT / BASE_HEIGHT
         line_width = int(min(1 + glow_value * 5, 6) * height_factor)
         for i in range(num_points - 1):
-            pygame.draw.line(screen, base_color, points[i], points[i + 1], line_width)
+            pygame.draw.line(screen, line_color, points[i], points[i + 1], line_width)
     except Exception as e:
         logging.error(f"Error in draw_waveform_mode: {e}")
 
@@ -750,10 +3755,7 @@ def draw_separated_diamond(center_x, center_y, glow_value):
     second_triangle_size = SECOND_SMALL_TRIANGLE_SIZE * scale
     second_triangle_offset = SECOND_SMALL_TRIANGLE_OFFSET * scale
 
-    # Use hue_value for color (global hue), brightness from glow_value.
-    brightness = max(glow_value * control_sensitivity, control_brightness_floor)
-    r, g, b = colorsys.hsv_to_rgb(hue_value, 1, brightness)
-    diamond_color = (int(r * 255), int(g * 255), int(b * 255))
+    diamond_color = base_color
 
     # Setup 45° rotation.
     rotation_angle = math.radians(45)
@@ -860,24 +3862,23 @@ def draw_circle_outline(center_x, center_y, radius, outline_thickness, outline_c
 # Pygame version of draw_radial_db_meters (Updated, Responsive, 1:1 Scaled with Bounce)
 # -----------------------------
 def draw_radial_db_meters():
-    global latest_audio_data, glow_value, hue_value, control_sensitivity, control_brightness_floor
+    global glow_value, hue_value, control_sensitivity, control_brightness_floor
     try:
-        if latest_audio_data is None or len(latest_audio_data) < 2:
+        frame = feature_bus.latest
+        if frame is None or len(frame.samples) < 2:
             return
 
         current_width = screen.get_width()
         current_height = screen.get_height()
         scale = min(current_width / BASE_WIDTH, current_height / BASE_HEIGHT)
 
-        fft_data = np.abs(np.fft.fft(latest_audio_data))[:len(latest_audio_data)//2]
+        fft_data = frame.spectrum[:len(frame.samples)//2]
         num_bars = DEFAULT_NUM_BARS
         bar_width = int(DEFAULT_BAR_WIDTH * scale)
         max_amplitude = np.max(fft_data) if np.max(fft_data) != 0 else 1
         bar_amplitudes = [amp / max_amplitude for amp in fft_data[:num_bars]]
 
-        brightness = max(glow_value * control_sensitivity, control_brightness_floor)
-        r, g, b = colorsys.hsv_to_rgb(hue_value, 1, brightness)
-        color = (int(r * 255), int(g * 255), int(b * 255))
+        color = base_color
 
         # The starting circle radius expands with glow_value (bounce effect)
         circle_radius = (BASE_CIRCLE_RADIUS + glow_value * BOUNCE_INTENSITY) * scale
@@ -995,7 +3996,7 @@ def draw_menu():
 
 
 def handle_menu_events(event):
-    global menu_open, current_mode_index, visualization_mode, orbs
+    global menu_open
     global slider_active, editing_brightness_floor, brightness_floor_input
     global editing_hue, hue_input, editing_cycle_rate, cycle_rate_input
     global manual_hue_value, cycle_rate, control_brightness_floor
@@ -1014,15 +4015,12 @@ def handle_menu_events(event):
             if brightness_slider_rect.collidepoint(mx, my):
                 if event.button == 1:
                     slider_active = True
-                    print("[DEBUG] Brightness slider activated at", event.pos)
+                    logging.debug("Brightness slider activated at %s", event.pos)
                 elif event.button == 3:
                     editing_brightness_floor = True
                     brightness_floor_input = ""
             elif mode_field_rect.collidepoint(mx, my):
-                current_mode_index = (current_mode_index + 1) % len(available_modes)
-                visualization_mode = available_modes[current_mode_index]
-                if visualization_mode == "gravity" and not orbs:
-                    init_orbs()
+                switch_mode(available_modes[(current_mode_index + 1) % len(available_modes)])
             elif hue_field_rect.collidepoint(mx, my):
                 editing_hue = True
                 hue_input = ""
@@ -1036,7 +4034,7 @@ def handle_menu_events(event):
         fps_rect = draw_fps()  # Get the FPS area (draw and get the clickable rect)
         if fps_rect and fps_rect.collidepoint(mx, my):
             show_fps = not show_fps  # Toggle FPS visibility
-            print("[DEBUG] FPS visibility toggled!")
+            logging.debug("FPS visibility toggled")
 
     elif event.type == pygame.MOUSEBUTTONUP:
         if event.button == 1:
@@ -1044,14 +4042,10 @@ def handle_menu_events(event):
 
     elif event.type == pygame.MOUSEMOTION:
         if slider_active and not editing_brightness_floor:
-            # Debug prints
-            print("[DEBUG] Mouse moved:", event.pos)
-            print("[DEBUG] Brightness slider rect:", brightness_slider_rect)
             relative_x = event.pos[0] - brightness_slider_rect.x
             new_val = relative_x / brightness_slider_rect.width
             new_val = max(0, min(new_val, 1))
             control_brightness_floor = new_val
-            print(f"[DEBUG] control_brightness_floor updated to: {control_brightness_floor}")
 
 
 # -----------------------------
@@ -1062,12 +4056,19 @@ def handle_keyboard_events(event):
     global editing_hue, hue_input, manual_hue_value, manual_hue
     global editing_cycle_rate, cycle_rate_input, cycle_rate
     global show_fps  # Global flag for FPS visibility
+    global show_profiler
 
     # Handling FPS visibility toggle via F2 key
     if event.type == pygame.KEYDOWN:
         if event.key == pygame.K_F2:
             show_fps = not show_fps  # Toggle FPS visibility when F2 is pressed
-            print("[DEBUG] FPS visibility toggled by F2!")
+            logging.debug("FPS visibility toggled by F2")
+        elif pygame.key.name(event.key) == FLIGHT_RECORDER_DUMP_KEY:
+            flight_recorder.dump("hotkey")
+        elif pygame.key.name(event.key) == PROFILER_TOGGLE_KEY:
+            show_profiler = not show_profiler
+        elif pygame.key.name(event.key) == PROFILER_EXPORT_KEY:
+            frame_profiler.export_csv()
 
     # Brightness editing
     if editing_brightness_floor:
@@ -1104,9 +4105,9 @@ def handle_keyboard_events(event):
                     val = max(0.0, min(val, 1.0))  # Clamp the value between 0 and 1
                     manual_hue_value = val  # Store the hue as a float between 0.0 and 1.0
                     manual_hue = (val != 0)  # Set flag to check if it's manual hue
-                    print(f"[DEBUG] Manual hue set to {manual_hue_value} (manual_hue={manual_hue})")
+                    logging.debug("Manual hue set to %s (manual_hue=%s)", manual_hue_value, manual_hue)
                 except ValueError:
-                    print("[DEBUG] Invalid hue input!")
+                    logging.debug("Invalid hue input: %r", s)
                 editing_hue = False  # Stop editing after hitting Enter
             elif event.key == pygame.K_BACKSPACE:
                 hue_input = hue_input[:-1]  # Backspace support
@@ -1122,9 +4123,9 @@ def handle_keyboard_events(event):
                 try:
                     val = float(s)
                     cycle_rate = val
-                    print(f"[DEBUG] Cycle rate set to {cycle_rate}")
+                    logging.debug("Cycle rate set to %s", cycle_rate)
                 except ValueError:
-                    print("[DEBUG] Invalid cycle rate input!")
+                    logging.debug("Invalid cycle rate input: %r", s)
                 editing_cycle_rate = False
             elif event.key == pygame.K_BACKSPACE:
                 cycle_rate_input = cycle_rate_input[:-1]
@@ -1134,147 +4135,567 @@ def handle_keyboard_events(event):
 
 
 # -----------------------------
-# Main Loop
+# Visualization Mode Registry
 # -----------------------------
-running = True
-update_offscreen_surface(WINDOW_WIDTH, WINDOW_HEIGHT)
-if visualization_mode == "polygon":
-    if not cube_vertices:
-        init_cube()
-elif visualization_mode == "waveform":
-    update_waveform_buffers()
-    draw_waveform_mode()
-if visualization_mode == "radial":
-    draw_radial_db_meters()
+# Each mode owns its buffers and caches. init() builds them and may run on a background thread
+# (it must not touch the display or fonts), resize() follows the window size, update() advances
+# per-frame state, draw() renders onto `screen` and release() drops everything again. Only the
+# active mode holds resources; a newly selected mode warms up in the background and replaces the
+# active one on the first frame after it is ready. A mode whose warm-up fails is released again
+# and never replaces the active one.
+class VisualizationMode:
+    def __init__(self, name):
+        self.name = name
+        self.size = None
+        self.ready = threading.Event()
+        self.failed = False
+        self.warm_up_thread = None
+
+    def init(self):
+        pass
+
+    def resize(self, width, height):
+        self.size = (width, height)
+
+    def update(self):
+        pass
+
+    # Receives every analysed block of mixed samples (main thread, active mode only).
+    def feed(self, samples):
+        pass
+
+    def draw(self):
+        pass
+
+    def release(self):
+        pass
+
+
+class PolygonMode(VisualizationMode):
+    def init(self):
+        self.vertices = init_cube()
+        self.surface = pygame.Surface((OFFSCREEN_WIDTH, OFFSCREEN_HEIGHT))
+        self.scaled = None
+
+    def resize(self, width, height):
+        super().resize(width, height)
+        self.scaled = pygame.Surface((width, height))
+
+    def draw(self):
+        self.surface.fill((0, 0, 0))
+        draw_polygon_mode(self.surface, self.vertices, glow_value, base_color,
+                          self.surface.get_width() // 2, self.surface.get_height() // 2)
+        pygame.transform.scale(self.surface, self.size, self.scaled)
+        screen.blit(self.scaled, (0, 0))
+
+    def release(self):
+        self.vertices = self.surface = self.scaled = None
+
+
+class MeterMode(VisualizationMode):
+    def draw(self):
+        draw_db_meters()
+
+
+class GravityMode(MeterMode):
+    def init(self):
+        self.orbs = []
+
+    def update(self):
+        if glow_value > 0 and not self.orbs:
+            self.orbs = init_orbs()
+        self.orbs = update_orbs(self.orbs)
+
+    def draw(self):
+        draw_db_meters()
+        draw_orbs(self.orbs)
+
+    def release(self):
+        self.orbs = []
+
+
+class WaveformMode(VisualizationMode):
+    def init(self):
+        self.buffers = init_waveform_buffers()
+
+    def draw(self):
+        draw_waveform_mode(self.buffers)
+
+    def release(self):
+        self.buffers = []
+
+
+class RadialMode(VisualizationMode):
+    def draw(self):
+        draw_radial_db_meters()
+
+
+# Scrolling log-frequency spectrogram. Each hop of SPECTROGRAM_HOP samples becomes one pixel
+# column written into a ring surface through surfarray; drawing blits the ring in two parts, so
+# the per-frame work is one column per hop and never re-renders the history on screen.
+SPECTROGRAM_FFT_SIZE = 2048
+SPECTROGRAM_HOP = 512  # Samples per column (~86 columns/s at 44.1 kHz)
+SPECTROGRAM_MIN_FREQ = 30
+SPECTROGRAM_MAX_FREQ = 12000
+SPECTROGRAM_FLOOR_DB = -80.0  # Level shown as black (dB relative to a full-scale sine)
+SPECTROGRAM_CEILING_DB = -10.0  # Level shown at the top of the colormap
+SPECTROGRAM_COLORMAP = [(0, 0, 0), (40, 10, 90), (180, 30, 90), (250, 140, 20), (255, 250, 200)]
+
+SPECTROGRAM_LUT = np.stack([np.interp(np.linspace(0, 1, 256), np.linspace(0, 1, len(SPECTROGRAM_COLORMAP)),
+                                      [color[channel] for color in SPECTROGRAM_COLORMAP])
+                            for channel in range(3)], axis=1).astype(np.uint8)
+
+
+class SpectrogramMode(VisualizationMode):
+    def init(self):
+        self.window = np.hanning(SPECTROGRAM_FFT_SIZE).astype(np.float32)
+        self.samples = np.zeros(SPECTROGRAM_FFT_SIZE - SPECTROGRAM_HOP, dtype=np.float32)
+        self.spectra = []  # Magnitude spectra waiting to be drawn, one row per hop
+        self.rate = RATE
+        self.surface = None
+        self.column = 0  # Next column to write; the oldest column on screen
+        self.row_bins = None
+
+    def resize(self, width, height):
+        super().resize(width, height)
+        self.surface = pygame.Surface((width, height), 0, 32)
+        self.column = 0
+        self.row_bins = None
+
+    def feed(self, samples):
+        self.samples = np.concatenate((self.samples, samples))
+        count = (len(self.samples) - SPECTROGRAM_FFT_SIZE) // SPECTROGRAM_HOP + 1
+        if count <= 0:
+            return
+        frames = np.lib.stride_tricks.sliding_window_view(self.samples, SPECTROGRAM_FFT_SIZE)[::SPECTROGRAM_HOP]
+        self.spectra.append(np.abs(np.fft.rfft(frames[:count] * self.window, axis=1)))
+        self.samples = self.samples[count * SPECTROGRAM_HOP:]
+
+    # Fractional spectrum bin shown by each pixel row, highest frequency at the top.
+    def _row_bins(self, height):
+        bin_width = self.rate / SPECTROGRAM_FFT_SIZE
+        top = min(SPECTROGRAM_MAX_FREQ, self.rate / 2)
+        positions = np.geomspace(top, SPECTROGRAM_MIN_FREQ, height) / bin_width
+        low = np.minimum(positions.astype(np.intp), SPECTROGRAM_FFT_SIZE // 2 - 1)
+        return low, (positions - low).astype(np.float32)
+
+    def update(self):
+        if not self.spectra:
+            return
+        width, height = self.surface.get_size()
+        spectra = np.concatenate(self.spectra)[-width:]
+        self.spectra = []
+        if self.row_bins is None:
+            self.row_bins = self._row_bins(height)
+        low, frac = self.row_bins
+        db = 20 * np.log10(spectra * (4.0 / SPECTROGRAM_FFT_SIZE) + 1e-9)
+        rows = db[:, low] * (1.0 - frac) + db[:, low + 1] * frac
+        levels = (rows - SPECTROGRAM_FLOOR_DB) * (255.0 / (SPECTROGRAM_CEILING_DB - SPECTROGRAM_FLOOR_DB))
+        columns = SPECTROGRAM_LUT[np.clip(levels, 0, 255).astype(np.uint8)]
+        pixels = pygame.surfarray.pixels3d(self.surface)
+        first = min(len(columns), width - self.column)
+        pixels[self.column:self.column + first] = columns[:first]
+        pixels[:len(columns) - first] = columns[first:]
+        del pixels
+        self.column = (self.column + len(columns)) % width
+
+    def draw(self):
+        width, height = self.surface.get_size()
+        screen.blit(self.surface, (0, 0), pygame.Rect(self.column, 0, width - self.column, height))
+        screen.blit(self.surface, (width - self.column, 0), pygame.Rect(0, 0, self.column, height))
+
+    def release(self):
+        self.surface = None
+        self.spectra = []
+
+
+MODE_CLASSES = {
+    "polygon": PolygonMode,
+    "both": MeterMode,
+    "db meters": MeterMode,
+    "gravity": GravityMode,
+    "waveform": WaveformMode,
+    "radial": RadialMode,
+    "spectrogram": SpectrogramMode,
+}
+pending_mode = None  # Mode warming up in the background
+
+
+# Only a mode that built all of its resources is marked ready; a failed one is released again.
+def warm_up_mode(mode, size):
+    try:
+        mode.init()
+        mode.resize(*size)
+    except Exception as e:
+        logging.error(f"Error warming up {mode.name} mode: {e}")
+        mode.release()
+        mode.failed = True
+        return False
+    mode.ready.set()
+    return True
+
+
+# Makes a mode active immediately (startup and offline render).
+def activate_mode(name):
+    global active_mode, pending_mode, visualization_mode, current_mode_index
+    if active_mode is not None:
+        active_mode.release()
+    visualization_mode = name
+    current_mode_index = available_modes.index(name)
+    active_mode = MODE_CLASSES[name](name)
+    pending_mode = None
+    if not warm_up_mode(active_mode, (WINDOW_WIDTH, WINDOW_HEIGHT)):
+        raise RuntimeError(f"Could not start the {name} mode")
+
+
+# Selects a mode; the current one keeps drawing until the new one has warmed up. A mode that is
+# still warming up when another is selected is waited for and released, so repeated presses
+# never leave warm-up threads or buffers behind.
+def switch_mode(name):
+    global pending_mode, visualization_mode, current_mode_index
+    if pending_mode is not None:
+        pending_mode.warm_up_thread.join()
+        pending_mode.release()
+        pending_mode = None
+    visualization_mode = name
+    current_mode_index = available_modes.index(name)
+    flight_recorder.record(EV_MODE_SWITCH, PHASE_INSTANT, current_mode_index)
+    pending_mode = MODE_CLASSES[name](name)
+    pending_mode.warm_up_thread = threading.Thread(target=warm_up_mode, name="mode-warm-up", daemon=True,
+                                                   args=(pending_mode, (WINDOW_WIDTH, WINDOW_HEIGHT)))
+    pending_mode.warm_up_thread.start()
+
+
+def update_active_mode():
+    global active_mode, pending_mode, visualization_mode, current_mode_index
+    if pending_mode is not None and pending_mode.ready.is_set():
+        active_mode.release()
+        active_mode, pending_mode = pending_mode, None
+    elif pending_mode is not None and pending_mode.failed:
+        # Keep drawing the current mode and select it again.
+        pending_mode = None
+        visualization_mode = active_mode.name
+        current_mode_index = available_modes.index(active_mode.name)
+    if active_mode.size != (WINDOW_WIDTH, WINDOW_HEIGHT):
+        active_mode.resize(WINDOW_WIDTH, WINDOW_HEIGHT)
+    active_mode.update()
 
-display_glow = 0.0
 
 # -----------------------------
-# Main Loop
+# Visualization Drawing
 # -----------------------------
+def draw_db_meters():
+    bounding_x = MARGIN
+    bounding_y = MARGIN
+    bounding_w = WINDOW_WIDTH - 2 * MARGIN
+    bounding_h = WINDOW_HEIGHT - 2 * MARGIN
+    if bounding_w >= 0 and bounding_h >= 0:
+        color_factor = max(display_glow, control_brightness_floor)
+        brightness_percent = round(color_factor * 100)
+        modulated_color = (int(base_color[0] * color_factor),
+                           int(base_color[1] * color_factor),
+                           int(base_color[2] * color_factor))
+        # Left and right meters follow the first and last input channel independently.
+        meter_x_positions = [bounding_x, bounding_x + bounding_w - METER_WIDTH]
+        text_y = bounding_y + bounding_h + TEXT_PADDING
+        for meter_x, channel in zip(meter_x_positions, [0, -1]):
+            channel_glow = channel_display_glow[channel]
+            channel_color_factor = max(channel_glow, control_brightness_floor)
+            meter_color = (int(base_color[0] * channel_color_factor),
+                           int(base_color[1] * channel_color_factor),
+                           int(base_color[2] * channel_color_factor))
+            meter_fill_height = int(channel_glow * bounding_h)
+            meter_top = (bounding_y + bounding_h) - meter_fill_height
+            meter_rect = pygame.Rect(meter_x, meter_top, METER_WIDTH, meter_fill_height)
+            draw_meter_with_glow(screen, meter_rect, meter_color, GLOW_WIDTH)
+
+            db_text_color = (int(255 * channel_color_factor),) * 3
+            db_text = f"{channel_db_smoothed[channel]:.1f} dB"
+            db_surface = font.render(db_text, True, db_text_color)
+            text_x = meter_rect.x + (METER_WIDTH - db_surface.get_width()) / 2
+            screen.blit(db_surface, (text_x, text_y))
+
+        brightness_text = f"Brightness: {brightness_percent}%"
+        brightness_surface = brightness_font.render(brightness_text, True, modulated_color)
+        brightness_x = (WINDOW_WIDTH - brightness_surface.get_width()) // 2
+        brightness_y = 10
+        screen.blit(brightness_surface, (brightness_x, brightness_y))
+
+
+# Draws the active mode onto `screen` (no menu or HUD); shared by the main loop and offline render.
+def draw_visualization():
+    global base_color
+    # One colour per frame, shared by every mode, the orbs and the meters.
+    base_color = rgb_color(hue_value, max(glow_value * control_sensitivity, control_brightness_floor))
+
+    update_active_mode()
+    active_mode.draw()
+
+
 # -----------------------------
-# Main Loop
+# Start-up
 # -----------------------------
-while running:
-    dt = clock.get_time() / 1000.0  # Delta time for updates
-    process_audio_queue(UPDATE_INTERVAL)  # Process the audio queue
-
-    # Update the display glow
-    display_glow += 0.05 * (glow_value - display_glow)
+# Everything above only defines the pipeline, so importing this file (the tests do) parses
+# no arguments, opens no devices and creates no window.
+if __name__ == "__main__":
+    args = parse_args()
+    daemon_mode = args.daemon or args.benchmark_daemon is not None
+    if daemon_mode:
+        configure_service_logging()
+
+    app_config = load_config()
+    restore_state(app_config.get("state", {}))
+
+    if args.lifx_loadtest or args.lifx_simulator is not None:
+        ensure_lifxlan()
+        if args.lifx_simulator is not None:
+            run_lifx_simulator(args.lifx_simulator)
+        else:
+            run_lifx_loadtest()
+        sys.exit(0)
+
+    if args.replay:
+        session_replay = SessionReplay(args.replay, args.replay_speed)
+        input_channels = session_replay.channels
+        print(f"Replaying {args.replay}: {session_replay.duration:.1f} s at {args.replay_speed} speed")
+    elif args.render_offline:
+        offline_samples, offline_rate = read_wav(args.render_offline)
+        offline_samples = offline_samples[:, :INPUT_CHANNELS]
+        input_channels = offline_samples.shape[1]
+        LIFX_ENABLED = False
+    elif args.benchmark_daemon is not None:
+        input_channels = INPUT_CHANNELS
+    else:
+        ensure_sounddevice()
+        device_index = find_saved_device(app_config.get("device"))
+        if device_index is None:
+            # Only fall back to the picker when there is no saved device or it has gone away.
+            all_devices = sd.query_devices()
+            mic_devices = [(i, d['name']) for i, d in enumerate(all_devices) if d['max_input_channels'] > 0]
+            if not mic_devices:
+                print("No microphone input devices found. Exiting.")
+                sys.exit(1)
+            device_index = default_input_device(mic_devices) if daemon_mode else select_device_tk(mic_devices)
+        print(f"Selected microphone device index: {device_index}")
+        device_info = sd.query_devices(device_index)
+        app_config["device"] = {"name": device_info["name"],
+                                "hostapi": sd.query_hostapis(device_info["hostapi"])["name"]}
+        input_channels = max(1, min(INPUT_CHANNELS, device_info['max_input_channels']))
+    mark_startup("input selected")
+    if args.benchmark_daemon is not None:
+        ensure_lifxlan()
+        benchmark_simulator = LifxSimulator(1, loss=0.0)
+        benchmark_simulator.start()
+        lifx_lights = benchmark_simulator.lights()
+        bulb = lifx_lights[0]
+    else:
+        connect_lifx_lights(app_config)
+    save_config(app_config)
+
+    if daemon_mode and session_replay is None:
+        apply_audio_config(DAEMON_BLOCK_SIZE, RATE)
+    elif AUTO_TUNE_AUDIO and session_replay is None and not args.render_offline:
+        audio_config = calibrate_audio_stream(device_index, input_channels)
+        if audio_config:
+            apply_audio_config(audio_config["blocksize"], audio_config["samplerate"])
+            STREAM_LATENCY = audio_config["latency"]
+            print(f"Audio config: {BUFFER} samples @ {RATE} Hz, latency '{STREAM_LATENCY}'")
 
-    # Check if the mouse is hovering over the menu button or the panel
-    mx, my = pygame.mouse.get_pos()
-    if menu_button_rect.collidepoint(mx, my) or menu_panel_rect.collidepoint(mx, my):
-        menu_open = True
+    # -----------------------------
+    # Start Audio Stream
+    # -----------------------------
+    stream = None
+    if session_replay is not None:
+        apply_audio_config(session_replay.block_size, session_replay.rate)
+    if args.record:
+        session_recorder = SessionRecorder(args.record, RATE, input_channels, BUFFER)
+    if session_replay is not None:
+        session_replay.start()
+    elif args.render_offline:
+        apply_audio_config(BUFFER, offline_rate)
+    elif args.benchmark_daemon is not None:
+        synthetic_input = SyntheticInput(RATE, input_channels, BUFFER)
+        synthetic_input.start()
     else:
-        menu_open = False
+        try:
+            stream = sd.InputStream(
+                device=device_index,
+                samplerate=RATE,
+                blocksize=BUFFER,
+                channels=input_channels,
+                latency=STREAM_LATENCY,
+                callback=audio_callback
+            )
+            stream.start()
+            mark_startup("stream started")
+            print("Audio stream started.")
+        except Exception as e:
+            print("Failed to start audio stream:", e)
+            sys.exit(1)
+        start_extra_inputs()
 
-    # Update menu fade based on whether it's open or not
-    update_menu_fade(dt)
+    if LIFX_ENABLED:
+        if daemon_mode:
+            output_scheduler.interval = DAEMON_PACKET_INTERVAL
+        output_scheduler.start()
 
-    # Handle events (mouse clicks, keyboard presses, resizing, etc.)
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        elif event.type == pygame.VIDEORESIZE:
-            WINDOW_WIDTH, WINDOW_HEIGHT = event.size
-            screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT), pygame.RESIZABLE)
-            update_offscreen_surface(WINDOW_WIDTH, WINDOW_HEIGHT)
-            update_menu_dimensions()
-            update_meter_dimensions()
-        handle_menu_events(event)
-        handle_keyboard_events(event)
-
-    # Clear the screen before drawing new frames
-    screen.fill((0, 0, 0))
-
-    # Update the hue value based on the auto-cycle or manual hue value
-    if not manual_hue:
-        hue_value += cycle_rate
-        if hue_value > 1.0:
-            hue_value -= 1.0
-    else:
-        hue_value = manual_hue_value
+    if METRICS_ENABLED:
+        start_metrics_server()
 
-    # Calculate brightness and corresponding RGB color
-    brightness = max(glow_value * control_sensitivity, control_brightness_floor)
-    r, g, b = colorsys.hsv_to_rgb(hue_value, 1.0, brightness)
-    base_color = (int(r * 255), int(g * 255), int(b * 255))
+    if FEATURE_SERVER_ENABLED:
+        try:
+            feature_server = FeatureServer(FEATURE_SERVER_HOST, FEATURE_SERVER_PORT)
+            feature_server.start()
+        except OSError as e:
+            feature_server = None
+            logging.error(f"Could not start feature server: {e}")
+
+    if args.benchmark_startup:
+        run_startup_benchmark()
+        stop_audio_and_services()
+        sys.exit(0)
+
+    if args.benchmark_daemon is not None:
+        within_target = run_daemon_benchmark(args.benchmark_daemon)
+        stop_audio_and_services()
+        sys.exit(0 if within_target else 1)
+
+    if args.daemon:
+        run_daemon()
+        stop_audio_and_services()
+        logging.info("Daemon stopped")
+        sys.exit(0)
 
     # -----------------------------
-    # Visualization Mode Drawing
+    # Pygame Initialization & Setup
     # -----------------------------
-    # Draw visualization based on the selected mode
-    if visualization_mode == "polygon":
-        poly_surface = pygame_visualizer(OFFSCREEN_WIDTH, OFFSCREEN_HEIGHT)
-        poly_scaled = pygame.transform.scale(poly_surface, (WINDOW_WIDTH, WINDOW_HEIGHT))
-        screen.blit(poly_scaled, (0, 0))
-    elif visualization_mode == "waveform":
-        draw_waveform_mode()
-    elif visualization_mode == "radial":
-        draw_radial_db_meters()  # Draw radial dB meters
-
-    if visualization_mode in ["both", "db meters", "gravity"]:
-        # Draw dB meters (if needed)
-        bounding_x = MARGIN
-        bounding_y = MARGIN
-        bounding_w = WINDOW_WIDTH - 2 * MARGIN
-        bounding_h = WINDOW_HEIGHT - 2 * MARGIN
-        if bounding_w >= 0 and bounding_h >= 0:
-            volume_factor = display_glow
-            color_factor = max(display_glow, control_brightness_floor)
-            brightness_percent = round(color_factor * 100)
-            modulated_color = (int(base_color[0] * color_factor),
-                               int(base_color[1] * color_factor),
-                               int(base_color[2] * color_factor))
-            meter_fill_height = int(volume_factor * bounding_h)
-            meter_top = (bounding_y + bounding_h) - meter_fill_height
+    if args.render_offline:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    ensure_pygame()
+    pygame.init()
+    pygame.font.init()
+    screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT), pygame.RESIZABLE)
+    pygame.display.set_caption("Reactive dB Meters - Hidden Below Noise Floor")
+    clock = pygame.time.Clock()
+    font = pygame.font.SysFont("Arial", 20)
+    brightness_font = pygame.font.SysFont("Arial", BRIGHTNESS_FONT_SIZE)
 
-            left_meter_rect = pygame.Rect(bounding_x, meter_top, METER_WIDTH, meter_fill_height)
-            right_meter_rect = pygame.Rect(bounding_x + bounding_w - METER_WIDTH, meter_top, METER_WIDTH,
-                                           meter_fill_height)
-            draw_meter_with_glow(screen, left_meter_rect, modulated_color, GLOW_WIDTH)
-            draw_meter_with_glow(screen, right_meter_rect, modulated_color, GLOW_WIDTH)
+    # Initialize menu dimensions at startup (manual call here)
+    update_menu_dimensions()  # Initialize menu dimensions at startup
+    update_meter_dimensions()  # Initialize meter dimensions at startup
+    mark_startup("window ready")
 
-            db_text_color = (int(255 * color_factor), int(255 * color_factor), int(255 * color_factor))
-            db_text = f"{current_gain_db_smoothed:.1f} dB"
-            db_surface = font.render(db_text, True, db_text_color)
-            text_y = bounding_y + bounding_h + TEXT_PADDING
-            left_text_x = left_meter_rect.x + (METER_WIDTH - db_surface.get_width()) / 2
-            right_text_x = right_meter_rect.x + (METER_WIDTH - db_surface.get_width()) / 2
-            screen.blit(db_surface, (left_text_x, text_y))
-            screen.blit(db_surface, (right_text_x, text_y))
-
-            brightness_text = f"Brightness: {brightness_percent}%"
-            brightness_surface = brightness_font.render(brightness_text, True, modulated_color)
-            brightness_x = (WINDOW_WIDTH - brightness_surface.get_width()) // 2
-            brightness_y = 10
-            screen.blit(brightness_surface, (brightness_x, brightness_y))
-
-    # Handle gravity mode and orb animations
-    if visualization_mode == "gravity":
-        if glow_value > 0 and not orbs:
-            init_orbs()
-        update_orbs()
-        draw_orbs()
+    if args.render_offline:
+        run_offline_render()
+        stop_audio_and_services()
+        pygame.quit()
+        sys.exit(0)
 
     # -----------------------------
-    # Draw Menu Button & Menu
+    # Main Loop
     # -----------------------------
-    draw_menu_button()
-    if menu_alpha > 0:
-        draw_menu()
+    running = True
+    activate_mode(visualization_mode)
 
+    display_glow = 0.0
+    channel_display_glow = np.zeros(len(channel_glow_values))
+
+    # -----------------------------
+    # Main Loop
+    # -----------------------------
     # -----------------------------
-    # Draw FPS (top-right corner)
+    # Main Loop
     # -----------------------------
-    fps_rect = draw_fps()  # This draws the FPS if visible and returns the clickable area
+    last_frame_start = time.perf_counter()
+    while running:
+        frame_start = time.perf_counter()
+        if frame_start - last_frame_start > FLIGHT_RECORDER_ANOMALY_FRAME:
+            flight_recorder.record(EV_ANOMALY, PHASE_INSTANT, frame_start - last_frame_start)
+            flight_recorder.dump_on_anomaly("slow_frame")
+        last_frame_start = frame_start
+        flight_recorder.record(EV_FRAME, PHASE_BEGIN)
+        frame_profiler.begin_frame()
+        dt = clock.get_time() / 1000.0  # Delta time for updates
+        process_audio_queue()  # Process the audio queue
+        if session_replay is not None and session_replay.finished and audio_queue.empty():
+            running = False
 
-    # Flip the display (updates the screen)
-    pygame.display.flip()
-    clock.tick(240)  # Control the frame rate (fps)
+        # Update the display glow
+        display_glows = display_glow_smoother.process(np.concatenate(([glow_value], channel_glow_values)))
+        display_glow = display_glows[0]
+        channel_display_glow = display_glows[1:]
+        frame_profiler.mark("audio")
 
+        # Check if the mouse is hovering over the menu button or the panel
+        mx, my = pygame.mouse.get_pos()
+        if menu_button_rect.collidepoint(mx, my) or menu_panel_rect.collidepoint(mx, my):
+            menu_open = True
+        else:
+            menu_open = False
 
-stream.stop()
-stream.close()
-pygame.quit()
+        # Update menu fade based on whether it's open or not
+        update_menu_fade(dt)
+
+        # Handle events (mouse clicks, keyboard presses, resizing, etc.)
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.VIDEORESIZE:
+                WINDOW_WIDTH, WINDOW_HEIGHT = event.size
+                screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT), pygame.RESIZABLE)
+                update_menu_dimensions()
+                update_meter_dimensions()
+            handle_menu_events(event)
+            handle_keyboard_events(event)
+        frame_profiler.mark("events")
+
+        # Clear the screen before drawing new frames
+        screen.fill((0, 0, 0))
+
+        # Update the hue value based on the auto-cycle or manual hue value
+        if not manual_hue:
+            apply_beat_hue_steps()
+            hue_value += cycle_rate
+            if hue_value > 1.0:
+                hue_value -= 1.0
+        else:
+            hue_value = manual_hue_value
+
+        draw_visualization()
+        draw_input_regions()
+        frame_profiler.mark("draw")
+
+        # -----------------------------
+        # Draw Menu Button & Menu
+        # -----------------------------
+        draw_menu_button()
+        if menu_alpha > 0:
+            draw_menu()
+
+        # -----------------------------
+        # Draw FPS or Profiler Overlay (top-right corner)
+        # -----------------------------
+        if show_profiler:
+            draw_profiler_overlay()
+        else:
+            fps_rect = draw_fps()  # This draws the FPS if visible and returns the clickable area
+        frame_profiler.mark("hud")
+
+        # Flip the display (updates the screen)
+        flight_recorder.record(EV_FLIP, PHASE_BEGIN)
+        pygame.display.flip()
+        flight_recorder.record(EV_FLIP, PHASE_END)
+        frame_profiler.mark("flip")
+        flight_recorder.record(EV_FRAME, PHASE_END)
+        # Control the frame rate (fps); a maximum-speed replay renders as fast as it can.
+        clock.tick(0 if session_replay is not None and session_replay.speed == "max" else 240)
+        metric_frame_time.observe(clock.get_time() / 1000.0)
+        metric_render_fps.set(clock.get_fps())
+        autosave_state()
+
+
+    stop_audio_and_services()
+    if session_replay is not None and session_replay.finished:
+        print(f"Replayed {len(session_replay.records)} blocks ({session_replay.duration:.1f} s of audio) in "
+              f"{session_replay.wall_seconds:.2f} s ({session_replay.duration / max(session_replay.wall_seconds, 1e-9):.1f}x real time)")
+    pygame.quit()
@@ -0,0 +1,16 @@
+import importlib.util
+import os
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "VisualBassSync 0.05b.py")
+
+
+# The script's file name is not a module name, so it is loaded from its path. Importing it only
+# defines the pipeline: no arguments are parsed and no device or window is opened.
+@pytest.fixture(scope="session")
+def vbs():
+    spec = importlib.util.spec_from_file_location("visualbass", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+DT = 128 / 44100
+
+
+def make_agc(vbs):
+    return vbs.StreamingQuantileAGC(vbs.AGC_LOW_QUANTILE, vbs.AGC_HIGH_QUANTILE, vbs.AGC_WINDOW_SECONDS,
+                                    vbs.AGC_QUANTILE_RATE, vbs.AGC_ATTACK, vbs.AGC_RELEASE, vbs.AGC_MIN_RANGE, 60.0)
+
+
+def levels(shape, seed=0):
+    # A quiet passage, a loud one and back, in dB-like units.
+    rng = np.random.default_rng(seed)
+    xs = rng.uniform(20.0, 40.0, shape)
+    xs[len(xs) // 3:2 * len(xs) // 3] += 30.0
+    return xs
+
+
+@pytest.mark.parametrize("shape", [(3000,), (3000, 2)])
+@pytest.mark.parametrize("splits", [(), (1, 5, 100, 1000, 2999)])
+def test_batch_matches_step_loop(vbs, shape, splits):
+    xs = levels(shape)
+    step = make_agc(vbs)
+    expected = np.array([step.process(x, DT) for x in xs])
+    batch = make_agc(vbs)
+    bounds = [0] + list(splits) + [len(xs)]
+    out = np.concatenate([batch.process_batch(xs[a:b], DT) for a, b in zip(bounds, bounds[1:])])
+    np.testing.assert_allclose(out, expected, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(batch.estimates, step.estimates, rtol=1e-9)
+
+
+def test_step_seconds_default(vbs):
+    xs = levels((500,))
+    explicit = make_agc(vbs)
+    implicit = make_agc(vbs)
+    implicit.step_seconds = DT
+    np.testing.assert_array_equal(implicit.process_batch(xs), explicit.process_batch(xs, DT))
+
+
+def test_quantiles_converge(vbs):
+    agc = make_agc(vbs)
+    seconds = 4 * vbs.AGC_WINDOW_SECONDS
+    xs = np.random.default_rng(1).uniform(0.0, 100.0, int(seconds / DT))
+    out = agc.process_batch(xs, DT)
+    low, high = agc.estimates
+    assert low == pytest.approx(100.0 * vbs.AGC_LOW_QUANTILE, abs=5.0)
+    assert high == pytest.approx(100.0 * vbs.AGC_HIGH_QUANTILE, abs=5.0)
+    assert out.min() >= 0.0 and out.max() <= 1.0
+
+
+def test_steady_input_stays_low(vbs):
+    # A constant level has no spread: min_range keeps it from being stretched to full scale.
+    agc = make_agc(vbs)
+    out = agc.process_batch(np.full(int(2 * vbs.AGC_WINDOW_SECONDS / DT), 45.0), DT)
+    assert out[-1] < 0.1
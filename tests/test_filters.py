@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+
+def step_outputs(make, xs):
+    f = make()
+    return np.array([f.process(x) for x in xs])
+
+
+def batch_outputs(make, xs, splits):
+    # Feeds xs as consecutive batches ending at the given offsets.
+    f = make()
+    bounds = [0] + list(splits) + [len(xs)]
+    return np.concatenate([f.process_batch(xs[a:b]) for a, b in zip(bounds, bounds[1:]) if b > a])
+
+
+def bursty(shape, seed=0):
+    # Quiet stretches, sudden bursts and repeated values, so filters both rise and fall.
+    rng = np.random.default_rng(seed)
+    xs = rng.standard_normal(shape).cumsum(axis=0)
+    xs[rng.random(shape[0]) < 0.1] += 20.0
+    xs[50:60] = xs[49]
+    return xs
+
+
+@pytest.fixture(params=["ema", "attack_release", "peak_hold", "running_sum", "running_mean", "chain"])
+def make_filter(request, vbs):
+    return {
+        "ema": lambda: vbs.OnePoleEMA(0.2, 1.0),
+        "attack_release": lambda: vbs.AttackRelease(0.6, 0.05, 0.5),
+        "peak_hold": lambda: vbs.PeakHold(0.3, -5.0),
+        "running_sum": lambda: vbs.RunningSum(7),
+        "running_mean": lambda: vbs.RunningMean(7),
+        "chain": lambda: vbs.FilterChain(vbs.RunningMean(3), vbs.AttackRelease(0.5, 0.1), vbs.OnePoleEMA(0.3)),
+    }[request.param]
+
+
+@pytest.mark.parametrize("shape", [(300,), (300, 3)])
+@pytest.mark.parametrize("splits", [(), (1, 4, 9, 40, 170), (64, 128)])
+def test_batch_matches_step_loop(make_filter, shape, splits):
+    xs = bursty(shape)
+    np.testing.assert_allclose(batch_outputs(make_filter, xs, splits), step_outputs(make_filter, xs),
+                               rtol=1e-9, atol=1e-9)
+
+
+def test_attack_release_follows_direction(vbs):
+    f = vbs.AttackRelease(0.5, 0.1)
+    out = f.process_batch(np.array([10.0] * 12 + [0.0] * 12))
+    assert out[0] == pytest.approx(5.0)
+    assert out[12] == pytest.approx(out[11] * 0.9)
+
+
+def test_state_restarts_on_channel_change(vbs):
+    f = vbs.OnePoleEMA(0.5, 2.0)
+    f.process_batch(np.ones((20, 2)))
+    assert f.process(np.zeros(3)).tolist() == [1.0, 1.0, 1.0]
+
+
+def test_scaled_block_count_keeps_duration(vbs):
+    tuned = vbs.TUNED_BLOCK_SECONDS
+    assert vbs.scaled_block_count(10, 512, 512 / tuned) == 10
+    assert vbs.scaled_block_count(10, 256, 512 / tuned) == 20
+    assert vbs.scaled_block_count(1, 4096, 44100) == 1
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+RATE = 44100
+
+
+def reference_decimate(fir, x):
+    # Plain FIR over the zero-padded signal, keeping every factor-th output.
+    taps = fir.taps.astype(float)
+    padded = np.concatenate((np.zeros((len(taps) - 1, x.shape[1])), x))
+    return np.stack([np.correlate(padded[:, c], taps, "valid")[::fir.factor] for c in range(x.shape[1])], axis=1)
+
+
+@pytest.mark.parametrize("factor,taps", [(8, 63), (4, 47)])
+def test_decimating_fir_matches_reference(vbs, factor, taps):
+    x = np.random.default_rng(0).standard_normal((4000, 2)).astype(np.float32)
+    fir = vbs.DecimatingFIR(factor, taps, 2)
+    expected = reference_decimate(vbs.DecimatingFIR(factor, taps, 2), x)
+    # Uneven blocks, including ones shorter than a factor and than the filter, so the carried
+    # history is exercised at every phase.
+    bounds = [0, 3, 64, 65, 200, 1111, 2500, 4000]
+    out = np.concatenate([fir.process(x[a:b]) for a, b in zip(bounds, bounds[1:])])
+    assert out.shape == (len(expected), 2)
+    np.testing.assert_allclose(out, expected, rtol=1e-4, atol=1e-5)
+
+
+def test_lowpass_taps_unity_dc(vbs):
+    assert vbs.lowpass_taps(63, 0.05).sum() == pytest.approx(1.0, abs=1e-6)
+
+
+@pytest.mark.parametrize("block_size", [64, 128, 1024])
+def test_bass_front_end_batch_matches_blocks(vbs, block_size):
+    blocks = np.random.default_rng(1).standard_normal((40, block_size, 2)).astype(np.float32)
+    single = vbs.BassFrontEnd(RATE, 2)
+    expected = [single.process(block) for block in blocks]
+    batched = vbs.BassFrontEnd(RATE, 2)
+    mix, channels = zip(*[batched.process_batch(blocks[a:a + 8]) for a in range(0, len(blocks), 8)])
+    np.testing.assert_allclose(np.concatenate(mix), [m for m, _ in expected], rtol=1e-4, atol=1e-4)
+    np.testing.assert_allclose(np.concatenate(channels), [c for _, c in expected], rtol=1e-4, atol=1e-4)
+
+
+def test_bass_front_end_sine_level(vbs):
+    # A full-scale sine on a target bin reads BASS_LEVEL_SCALE once the window has filled.
+    front_end = vbs.BassFrontEnd(RATE, 1)
+    freqs = np.fft.rfftfreq(vbs.BASS_WINDOW_SIZE, 1.0 / front_end.rate)
+    freq = freqs[np.argmin(np.abs(freqs - vbs.TARGET_FREQS[0]))]
+    t = np.arange(RATE) / RATE
+    blocks = np.sin(2 * np.pi * freq * t).astype(np.float32)[:RATE // 128 * 128].reshape(-1, 128, 1)
+    mix, channels = front_end.process_batch(blocks)
+    assert mix[-1] == pytest.approx(vbs.BASS_LEVEL_SCALE, rel=0.02)
+    assert channels[-1, 0] == pytest.approx(mix[-1])
+
+
+def test_bass_front_end_rejects_high_frequencies(vbs):
+    front_end = vbs.BassFrontEnd(RATE, 1)
+    t = np.arange(RATE) / RATE
+    blocks = np.sin(2 * np.pi * 1000.0 * t).astype(np.float32)[:RATE // 128 * 128].reshape(-1, 128, 1)
+    mix, _ = front_end.process_batch(blocks)
+    assert mix[-1] < vbs.BASS_LEVEL_SCALE * 1e-3
@@ -0,0 +1,36 @@
+import struct
+
+import pytest
+
+msgtypes = pytest.importorskip("lifxlan.msgtypes")
+
+MAC = "d0:73:d5:01:02:03"
+MAC_BYTES = bytes.fromhex(MAC.replace(":", ""))
+
+
+def test_round_trip(vbs):
+    payload = struct.pack("<B4HI", 0, 1, 2, 3, 4, 5)
+    data = vbs.encode_lifx_message(vbs.MSG_LIGHT_SET_COLOR, MAC_BYTES, 1234, 17, payload)
+    assert vbs.decode_lifx_message(data) == {"source": 1234, "target": MAC_BYTES, "ack": False, "res": False,
+                                             "seq": 17, "type": vbs.MSG_LIGHT_SET_COLOR, "payload": payload}
+
+
+def test_decodes_lifxlan_messages(vbs):
+    message = msgtypes.LightSetPower(MAC, 99, 42, {"power_level": 65535, "duration": 0}, ack_requested=True)
+    decoded = vbs.decode_lifx_message(message.packed_message)
+    assert (decoded["source"], decoded["target"], decoded["seq"]) == (99, MAC_BYTES, 42)
+    assert decoded["type"] == 117 and decoded["ack"] and not decoded["res"]
+    assert decoded["payload"] == message.get_payload()
+
+
+def test_encodes_like_lifxlan(vbs):
+    # A reply as the simulator sends it parses the same way lifxlan's own encoding does.
+    message = msgtypes.Acknowledgement(MAC, 99, 42)
+    data = vbs.encode_lifx_message(vbs.MSG_ACKNOWLEDGEMENT, MAC_BYTES, 99, 42)
+    assert vbs.decode_lifx_message(data) == vbs.decode_lifx_message(message.packed_message)
+
+
+def test_rejects_short_or_inconsistent_packets(vbs):
+    data = vbs.encode_lifx_message(vbs.MSG_GET_SERVICE, MAC_BYTES, 1, 1)
+    assert vbs.decode_lifx_message(data[:-1]) is None
+    assert vbs.decode_lifx_message(data + b"\0") is None
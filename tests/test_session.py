@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+import pytest
+
+RATE = 44100
+CHANNELS = 2
+BLOCK_SIZE = 128
+
+
+def record(vbs, path, blocks, start=0):
+    recorder = vbs.SessionRecorder(path, RATE, CHANNELS, BLOCK_SIZE)
+    for i, block in enumerate(blocks):
+        recorder.push(1.7e9 + (start + i) * BLOCK_SIZE / RATE, block)
+    recorder.close()
+
+
+def make_blocks(count, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, BLOCK_SIZE, CHANNELS)).astype(np.float32)
+
+
+def test_round_trip(vbs, tmp_path):
+    path = str(tmp_path / "session.vbs")
+    blocks = make_blocks(5)
+    record(vbs, path, blocks)
+
+    replay = vbs.SessionReplay(path, "max")
+    assert (replay.rate, replay.channels, replay.block_size) == (RATE, CHANNELS, BLOCK_SIZE)
+    assert replay.duration == pytest.approx(5 * BLOCK_SIZE / RATE)
+    # Timestamps are float64 split across two float32 slots and must come back bit for bit.
+    np.testing.assert_array_equal(replay.timestamps, 1.7e9 + np.arange(5) * BLOCK_SIZE / RATE)
+    np.testing.assert_array_equal(replay.records[:, 2:].reshape(blocks.shape), blocks)
+
+
+def test_wrong_block_size_is_dropped(vbs, tmp_path):
+    path = str(tmp_path / "session.vbs")
+    recorder = vbs.SessionRecorder(path, RATE, CHANNELS, BLOCK_SIZE)
+    recorder.push(0.0, np.zeros((BLOCK_SIZE // 2, CHANNELS), dtype=np.float32))
+    recorder.close()
+    assert recorder.dropped_blocks == 1
+    assert len(vbs.SessionReplay(path, "max").records) == 0
+
+
+def test_torn_tail(vbs, tmp_path):
+    path = str(tmp_path / "session.vbs")
+    blocks = make_blocks(5)
+    record(vbs, path, blocks[:3])
+    with open(path, "ab") as f:
+        f.write(b"\x01" * 100)  # A record cut off mid-write
+
+    # Replay ignores the partial record ...
+    replay = vbs.SessionReplay(path, "max")
+    assert len(replay.records) == 3
+    del replay
+
+    # ... and appending truncates it first, so later records stay aligned.
+    record(vbs, path, blocks[3:], start=3)
+    record_bytes = (2 + BLOCK_SIZE * CHANNELS) * 4
+    assert os.path.getsize(path) == vbs.SESSION_HEADER_SIZE + 5 * record_bytes
+    replay = vbs.SessionReplay(path, "max")
+    np.testing.assert_array_equal(replay.timestamps, 1.7e9 + np.arange(5) * BLOCK_SIZE / RATE)
+    np.testing.assert_array_equal(replay.records[:, 2:].reshape(blocks.shape), blocks)
+
+
+def test_append_rejects_other_format(vbs, tmp_path):
+    path = str(tmp_path / "session.vbs")
+    record(vbs, path, make_blocks(1))
+    with pytest.raises(ValueError):
+        vbs.SessionRecorder(path, RATE, CHANNELS, BLOCK_SIZE * 2)
+
+
+def test_header_rejects_other_files(vbs, tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"\0" * 128)
+    with pytest.raises(ValueError):
+        vbs.read_session_header(str(path))
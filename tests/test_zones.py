@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+msgtypes = pytest.importorskip("lifxlan.msgtypes")
+
+MAC = "d0:73:d5:01:02:03"
+
+
+@pytest.fixture
+def zone_types(vbs, monkeypatch):
+    types = vbs.build_zone_message_types()
+    monkeypatch.setattr(vbs, "zone_message_types", types)
+    return types
+
+
+def zone_output(vbs, kind, count):
+    return vbs.ZoneOutput(kind, None, count)
+
+
+def test_extended_zones_match_lifxlan(vbs, zone_types):
+    output = zone_output(vbs, "multizone", 16)
+    colors = output.colors(np.linspace(0.0, 1.0, 16))
+    msg_type, payload = output.message(colors, 250)
+    assert msg_type is zone_types[0]
+    packed = msg_type(MAC, 7, 3, payload).get_payload()
+    stock = msgtypes.MultiZoneSetExtendedColorZones(MAC, 7, 3, dict(payload, colors=colors.tolist())).get_payload()
+    # The protocol always carries EXTENDED_ZONE_CAPACITY colours; lifxlan sends only those given.
+    assert len(packed) == 8 + vbs.EXTENDED_ZONE_CAPACITY * 8
+    assert packed[:len(stock)] == stock
+    assert packed[len(stock):] == bytes(len(packed) - len(stock))
+
+
+def test_tile_state_matches_lifxlan(vbs, zone_types):
+    output = zone_output(vbs, "tile", 5)
+    colors = output.colors(np.linspace(0.0, 1.0, vbs.TILE_WIDTH))
+    assert colors.shape == (vbs.TILE_WIDTH * vbs.TILE_WIDTH, 4)
+    msg_type, payload = output.message(colors, 100)
+    assert msg_type is zone_types[1]
+    packed = msg_type(MAC, 7, 3, payload)
+    stock = msgtypes.SetTileState64(MAC, 7, 3, dict(payload, colors=colors.tolist()))
+    assert packed.get_payload() == stock.get_payload()
+    assert packed.packed_message == stock.packed_message
+
+
+def test_tile_bars_light_from_the_bottom(vbs):
+    output = zone_output(vbs, "tile", 1)
+    levels = np.zeros(vbs.TILE_WIDTH)
+    levels[2] = 0.5
+    brightness = output.colors(levels)[:, 2].reshape(vbs.TILE_WIDTH, vbs.TILE_WIDTH)
+    lit = brightness > brightness.min()
+    assert lit[:, 2].tolist() == [False] * (vbs.TILE_WIDTH // 2) + [True] * (vbs.TILE_WIDTH // 2)
+    assert not lit[:, [0, 1, 3]].any()
+
+
+def test_bands_cover_the_range(vbs):
+    output = zone_output(vbs, "multizone", 24)
+    freqs = np.fft.rfftfreq(vbs.ZONE_FFT_SIZE, 1.0 / 44100)
+    starts, stop = output._band_starts(freqs)
+    assert len(starts) == 24
+    assert np.all(np.diff(starts) >= 1)
+    assert stop > starts[-1]